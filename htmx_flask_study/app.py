@@ -8,6 +8,10 @@ from flask_login import (
     current_user,
 )
 from database import db, Task, Category, User
+import queries
+from perf import Perf
+from query_budget import QueryBudget
+from user_cache import UserCache
 from datetime import datetime, timezone
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
@@ -19,12 +23,19 @@ logging.basicConfig(level=logging.DEBUG)
 load_dotenv()
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///tasks.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL", "sqlite:///tasks.db"
+)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.secret_key = "SECRET_KEY"
+app.config["TASK_PAGE_SIZE"] = 50
+app.config["REDIS_URL"] = os.environ.get("REDIS_URL")  # optional shared user cache tier
 
 # Initialize extensions
 db.init_app(app)
+Perf(app)
+QueryBudget(app)
+user_cache = UserCache(app, User)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = "login"
@@ -42,9 +53,68 @@ oauth.register(
 )
 
 
+# Row template per view; mutations render only the row they touched
+ROW_TEMPLATES = {
+    "dashboard": "partials/task_row.html",
+    "detailed": "partials/task_row_with_status.html",
+}
+LIST_TEMPLATES = {
+    "dashboard": "partials/task_list.html",
+    "detailed": "partials/task_list_with_status.html",
+}
+
+
+# Sidebar lists shown in place of the full list. The add forms post the one on
+# screen (see #task-list-filter), which is re-run since a new row may not belong
+# in it or may sort below the top.
+TASK_FILTERS = {
+    "today": lambda user_id, today: queries.tasks_due_on(user_id, today),
+    "upcoming": lambda user_id, today: queries.upcoming_tasks(user_id, today),
+    "priority": lambda user_id, today: queries.priority_tasks(user_id),
+}
+
+
+def filtered_tasks(list_filter):
+    today = datetime.now(timezone.utc).date()
+    return TASK_FILTERS[list_filter](current_user.id, today).all()
+
+
+def current_view():
+    view = request.args.get("view", "dashboard")
+    return view if view in ROW_TEMPLATES else "dashboard"
+
+
+def render_task_patch(op, task=None, task_id=None, view=None, **context):
+    """Render one task as an out-of-band insert, replace or delete of its row."""
+    return render_template(
+        "partials/task_patch.html",
+        op=op,
+        task=task,
+        task_id=task_id,
+        row_template=ROW_TEMPLATES[view or current_view()],
+        counts=queries.task_counts(current_user.id),
+        **context,
+    )
+
+
+def render_task_insert(task, view=None):
+    """Insert the new task's row, or re-run the filtered list on screen instead."""
+    list_filter = request.form.get("list")
+    if list_filter not in TASK_FILTERS:
+        return render_task_patch("insert", task, view=view)
+    return render_task_patch(
+        "list", view=view, tasks=filtered_tasks(list_filter), list_filter=list_filter
+    )
+
+
+def first_task_page():
+    return queries.task_page(current_user.id, limit=app.config["TASK_PAGE_SIZE"])
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # A detached snapshot; commits that touch the user invalidate it
+    return user_cache.get(int(user_id))
 
 
 # Auth routes
@@ -141,39 +211,75 @@ def landing():
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
+    tasks, next_cursor = first_task_page()
+    return render_template(
+        "index.html",
+        tasks=tasks,
+        next_cursor=next_cursor,
+        counts=queries.task_counts(current_user.id),
     )
-    return render_template("index.html", tasks=tasks)
 
 
 @app.route("/detailed")
 @login_required
 def detailed_index():
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
+    tasks, next_cursor = first_task_page()
+    return render_template(
+        "detailed_index.html",
+        tasks=tasks,
+        next_cursor=next_cursor,
+        counts=queries.task_counts(current_user.id),
+    )
+
+
+@app.route("/tasks")
+@login_required
+def list_tasks():
+    # The only place the list is rebuilt after the page loads (Refresh)
+    tasks, next_cursor = first_task_page()
+    return render_template(
+        LIST_TEMPLATES[current_view()], tasks=tasks, next_cursor=next_cursor
+    ) + render_template(
+        "partials/task_counts.html",
+        counts=queries.task_counts(current_user.id),
+        oob=True,
+    )
+
+
+@app.route("/tasks/page")
+@login_required
+def task_page():
+    """Rows after the before/before_id cursor, for "Load more" and infinite scroll."""
+    try:
+        before = (
+            datetime.fromisoformat(request.args["before"]),
+            int(request.args["before_id"]),
+        )
+    except (KeyError, ValueError):
+        return "Invalid cursor", 400
+    view = current_view()
+    tasks, next_cursor = queries.task_page(
+        current_user.id, before=before, limit=app.config["TASK_PAGE_SIZE"]
+    )
+    return render_template(
+        "partials/task_page.html",
+        tasks=tasks,
+        next_cursor=next_cursor,
+        view=view,
+        row_template=ROW_TEMPLATES[view],
     )
-    return render_template("detailed_index.html", tasks=tasks)
 
 
 @app.route("/tasks", methods=["POST"])
 @login_required
 def add_task():
     title = request.form.get("title")
-    if title:
-        task = Task(title=title, user_id=current_user.id)
-        db.session.add(task)
-        db.session.commit()
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
-    )
-    return render_template("partials/task_list.html", tasks=tasks)
+    if not title:
+        return "", 204
+    task = Task(title=title, user_id=current_user.id)
+    db.session.add(task)
+    db.session.commit()
+    return render_task_insert(task)
 
 
 @app.route("/detailed/tasks", methods=["POST"])
@@ -196,13 +302,8 @@ def add_detailed_task():
         )
         db.session.add(task)
         db.session.commit()
-
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
-    )
-    return render_template("partials/task_list_with_status.html", tasks=tasks)
+        return render_task_insert(task, view="detailed")
+    return "", 204
 
 
 @app.route("/tasks/<int:task_id>/toggle", methods=["POST"])
@@ -213,12 +314,22 @@ def toggle_task(task_id):
         return "Unauthorized", 403
     task.completed = not task.completed
     db.session.commit()
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
-    )
-    return render_template("partials/task_list.html", tasks=tasks)
+    return render_task_patch("replace", task)
+
+
+@app.route("/tasks/<int:task_id>/update-status", methods=["POST"])
+@login_required
+def update_task_status(task_id):
+    task = Task.query.get_or_404(task_id)
+    if task.user_id != current_user.id:
+        return "Unauthorized", 403
+    # Each select on the detailed row posts only its own field
+    if "status" in request.form:
+        task.status = request.form["status"]
+    if "priority" in request.form:
+        task.priority = int(request.form["priority"])
+    db.session.commit()
+    return render_task_patch("replace", task)
 
 
 @app.route("/tasks/<int:task_id>/delete", methods=["DELETE"])
@@ -229,12 +340,16 @@ def delete_task(task_id):
         return "Unauthorized", 403
     db.session.delete(task)
     db.session.commit()
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .order_by(Task.created_at.desc())
-        .all()
-    )
-    return render_template("partials/task_list.html", tasks=tasks)
+    return render_task_patch("delete", task_id=task_id)
+
+
+@app.route("/tasks/<int:task_id>/view")
+@login_required
+def view_task(task_id):
+    task = Task.query.get_or_404(task_id)
+    if task.user_id != current_user.id:
+        return "Unauthorized", 403
+    return render_task_patch("replace", task)
 
 
 @app.route("/tasks/<int:task_id>/edit", methods=["GET", "POST"])
@@ -253,47 +368,39 @@ def edit_task(task_id):
         task.priority = int(request.form.get("priority", 0))
         task.status = request.form.get("status", "pending")
         db.session.commit()
-        return render_template("partials/task_list_with_status.html", tasks=[task])
+        return render_task_patch("replace", task)
 
-    return render_template("partials/edit_task.html", task=task)
+    return render_template("partials/edit_task.html", task=task, view=current_view())
 
 
 @app.route("/tasks/today")
 @login_required
 def today_tasks():
-    today = datetime.now(timezone.utc).date()
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .filter(db.func.date(Task.target_date) == today)
-        .order_by(Task.priority.desc())
-        .all()
+    return render_template(
+        "partials/task_list_with_status.html",
+        tasks=filtered_tasks("today"),
+        list_filter="today",
     )
-    return render_template("partials/task_list_with_status.html", tasks=tasks)
 
 
 @app.route("/tasks/upcoming")
 @login_required
 def upcoming_tasks():
-    today = datetime.now(timezone.utc).date()
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .filter(Task.target_date > today)
-        .order_by(Task.target_date.asc())
-        .all()
+    return render_template(
+        "partials/task_list_with_status.html",
+        tasks=filtered_tasks("upcoming"),
+        list_filter="upcoming",
     )
-    return render_template("partials/task_list_with_status.html", tasks=tasks)
 
 
 @app.route("/tasks/priority")
 @login_required
 def priority_tasks():
-    tasks = (
-        Task.query.filter_by(user_id=current_user.id)
-        .filter(Task.priority > 0)
-        .order_by(Task.priority.desc())
-        .all()
+    return render_template(
+        "partials/task_list_with_status.html",
+        tasks=filtered_tasks("priority"),
+        list_filter="priority",
     )
-    return render_template("partials/task_list_with_status.html", tasks=tasks)
 
 
 # Category routes
@@ -0,0 +1,206 @@
+# Benchmark the task listing queries on a large fixture, with and without indexes.
+#
+#   python benchmark.py                       # 1,000,000 tasks in a temporary database
+#   python benchmark.py --tasks 200000 --fixture bench.db   # keep the fixture for reruns
+#
+# Tasks are spread over --users users, with --power-share of them owned by
+# user 1 (the account every query runs as). Each query runs first against the
+# bare table and again after create_missing_indexes(), and is reported with
+# its p50/p95 time and SQLite's query plan. The "legacy" row is the
+# date(target_date) = ? predicate the today view used before; upcoming keeps
+# its target_date > ? predicate and only gains an index.
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event
+
+import queries
+from database import Task, create_missing_indexes, db
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # how SQLAlchemy stores DateTime in SQLite
+
+
+def legacy_today(user_id, day):
+    return (
+        Task.query.filter_by(user_id=user_id)
+        .filter(db.func.date(Task.target_date) == day)
+        .order_by(Task.priority.desc())
+    )
+
+
+def offset_page(user_id, day):
+    return queries.user_tasks(user_id).offset(1000).limit(51)
+
+
+def keyset_page(user_id, day):
+    # The same page as offset_page, reached from the cursor of the row before it
+    last = queries.user_tasks(user_id).offset(999).first()
+    return queries.tasks_before(user_id, (last.created_at, last.id)).limit(51)
+
+
+QUERIES = {
+    "dashboard (first 50)": lambda user_id, day: queries.user_tasks(user_id).limit(50),
+    "page 21 (offset)": offset_page,
+    "page 21 (keyset)": keyset_page,
+    "today (legacy)": legacy_today,
+    "today": queries.tasks_due_on,
+    "upcoming": queries.upcoming_tasks,
+    "priority": lambda user_id, day: queries.priority_tasks(user_id),
+}
+
+
+def seed(path, tasks, users, power_share, seed=0):
+    """Bulk-insert the fixture with sqlite3; the ORM would take minutes at this size."""
+    rng = random.Random(seed)
+    today = datetime.combine(date.today(), datetime.min.time())
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO user (id, email, name) VALUES (?, ?, ?)",
+        ((n, f"user{n}@example.com", f"User {n}") for n in range(1, users + 1)),
+    )
+
+    def rows():
+        for n in range(tasks):
+            owner = 1 if rng.random() < power_share else rng.randint(2, users)
+            created = today - timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+            target = (
+                today + timedelta(days=rng.randint(-365, 365))
+                if rng.random() < 0.8
+                else None
+            )
+            yield (
+                f"Task {n}",
+                rng.random() < 0.5,
+                created.strftime(DATETIME_FORMAT),
+                target.strftime(DATETIME_FORMAT) if target else None,
+                rng.choice((0, 0, 0, 1, 2)),
+                "pending",
+                owner,
+            )
+
+    conn.executemany(
+        "INSERT INTO task (title, completed, created_at, target_date, priority, status, user_id)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def drop_indexes(path):
+    conn = sqlite3.connect(path)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(int(-(-len(ordered) * pct // 100)) - 1, 0)]
+
+
+def run_query(query, repeat):
+    """Time query without ORM hydration and return (timings, rows, plan)."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    connection = db.session.connection()
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        rows = len(connection.execute(query.statement).fetchall())
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+    statement, parameters = statements[0]
+    plan = [
+        row[-1]
+        for row in connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters
+        )
+    ]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        connection.execute(query.statement).fetchall()
+        timings.append(time.perf_counter() - started)
+    return timings, rows, plan
+
+
+def run_all(repeat):
+    day = date.today()
+    results = {}
+    for name, build in QUERIES.items():
+        timings, rows, plan = run_query(build(1, day), repeat)
+        results[name] = {
+            "rows": rows,
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p95_ms": percentile(timings, 95) * 1000,
+            "plan": "; ".join(plan),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark task listing queries with and without indexes."
+    )
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--power-share", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--fixture", help="reuse or create this database file")
+    args = parser.parse_args()
+
+    path = args.fixture or os.path.join(tempfile.mkdtemp(), "bench.db")
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.abspath(path)}"
+    db.init_app(app)
+
+    with app.app_context():
+        fresh = not os.path.exists(path)
+        db.create_all()
+        db.session.remove()
+        db.engine.dispose()
+        drop_indexes(path)
+        if fresh:
+            started = time.perf_counter()
+            seed(path, args.tasks, args.users, args.power_share)
+            print(f"Seeded {args.tasks} tasks in {time.perf_counter() - started:.1f}s")
+
+        before = run_all(args.repeat)
+        db.session.remove()
+        started = time.perf_counter()
+        create_missing_indexes()
+        print(f"Created indexes in {time.perf_counter() - started:.1f}s\n")
+        after = run_all(args.repeat)
+        db.session.remove()
+
+    print(
+        f"{'query':<22} {'rows':>6} {'no index p50':>13} {'indexed p50':>12} {'p95':>8}"
+    )
+    for name in QUERIES:
+        print(
+            f"{name:<22} {after[name]['rows']:>6} {before[name]['p50_ms']:>10.2f} ms"
+            f" {after[name]['p50_ms']:>9.2f} ms {after[name]['p95_ms']:>5.2f} ms"
+        )
+    print()
+    for name in QUERIES:
+        print(
+            f"{name}:\n  before: {before[name]['plan']}\n  after:  {after[name]['plan']}"
+        )
+    if not args.fixture:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -6,6 +7,14 @@ from werkzeug.security import generate_password_hash, check_password_hash
 db = SQLAlchemy()
 
 class Task(db.Model):
+    # Every listing filters on user_id and sorts or ranges on one other column;
+    # init_db.py adds these to databases created before they were declared
+    __table_args__ = (
+        db.Index('ix_task_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_task_user_target_date', 'user_id', 'target_date'),
+        db.Index('ix_task_user_priority', 'user_id', 'priority'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     completed = db.Column(db.Boolean, default=False)
@@ -55,4 +64,25 @@ class User(UserMixin, db.Model):
             db.session.commit()
         user.last_login = datetime.utcnow()
         db.session.commit()
-        return user
\ No newline at end of file
+        return user
+
+
+def create_missing_indexes():
+    """Create indexes declared on the models that an existing database lacks.
+
+    create_all() only creates missing tables, so indexes added to a table that
+    already exists are created here one by one. Returns the names created.
+    """
+    created = []
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+    if created:
+        # Fresh statistics so the planner picks the new indexes
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    return created
@@ -1,11 +1,16 @@
 from app import app, db
-from database import User, Task, Category
+from database import User, Task, Category, create_missing_indexes
+
 
 def init_db():
     with app.app_context():
         # Create all tables
         db.create_all()
         print("Database tables created successfully!")
+        # Existing tasks.db files only get newly declared indexes this way
+        for name in create_missing_indexes():
+            print(f"Created index {name}")
+
 
 if __name__ == "__main__":
     init_db()
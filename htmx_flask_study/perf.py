@@ -0,0 +1,335 @@
+# Request timing and SQL profiling.
+#
+# Each request gets a RequestTimings that splits its wall time into db,
+# template and handler phases, records every SQL statement SQLAlchemy sends
+# under a normalized fingerprint, and collects stack samples. Requests slower
+# than PERF_PROFILE_THRESHOLD_MS have their samples written as collapsed
+# stacks ("a;b;c 12" per line), the input format of flamegraph.pl and
+# speedscope. Aggregates are served at /_debug/perf.
+#
+# Everything is off unless PERF_ENABLED is set.
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import (
+    Blueprint,
+    abort,
+    before_render_template,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_current = ContextVar("perf_request", default=None)
+
+# Same normalization as invoice_tracker/perf.py; each app directory is deployed on
+# its own, so the two cannot share a module. Change both together.
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+PHASES = ("total", "db", "template", "handler")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize a statement so calls that differ only in literals group together."""
+    sql = _COMMENTS.sub(" ", sql)
+    sql = _STRINGS.sub("?", sql)
+    sql = _NUMBERS.sub("?", sql)
+    sql = _IN_LISTS.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+class RequestTimings:
+    """Phase and statement timings for one request."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.phases = defaultdict(float)
+        self.statements = defaultdict(lambda: [0, 0.0])  # fingerprint -> [calls, seconds]
+        self.samples = Counter()
+        self._stack = []
+
+    def push(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # Phases are exclusive: a lazy load while rendering counts as db, not template
+            parent, since = self._stack[-1]
+            self.phases[parent] += now - since
+        self._stack.append((name, now))
+
+    def pop(self):
+        now = time.perf_counter()
+        name, since = self._stack.pop()
+        self.phases[name] += now - since
+        if self._stack:
+            self._stack[-1] = (self._stack[-1][0], now)
+
+    def finish(self):
+        while self._stack:
+            self.pop()
+        self.elapsed = time.perf_counter() - self.started
+        self.phases["handler"] = max(self.elapsed - sum(self.phases.values()), 0.0)
+        return self.elapsed
+
+
+@contextmanager
+def phase(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings.push(name)
+    try:
+        yield
+    finally:
+        timings.pop()
+
+
+# Listening on the Engine class covers every engine Flask-SQLAlchemy creates
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    if timings is not None:
+        timings.push("db")
+        conn.info.setdefault("perf_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    started = conn.info.get("perf_started")
+    if timings is not None and started:
+        stats = timings.statements[fingerprint(statement)]
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started.pop()
+        timings.pop()
+
+
+def collapse_stack(frame, limit=200):
+    """Return frame's call stack, outermost first, as one collapsed-stack line."""
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler:
+    """Background thread sampling the stacks of the threads serving active requests."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, timings):
+        with self._lock:
+            self._active[timings.thread_id] = timings
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="perf-sampler", daemon=True
+                )
+                self._thread.start()
+
+    def remove(self, timings):
+        with self._lock:
+            if self._active.get(timings.thread_id) is timings:
+                del self._active[timings.thread_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, timings in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    timings.samples[collapse_stack(frame)] += 1
+
+
+def write_profile(directory, timings):
+    """Write timings.samples as a collapsed-stack file and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    name = "{}-{}-{}ms.folded".format(
+        time.strftime("%Y%m%d-%H%M%S"),
+        re.sub(r"[^\w.]+", "_", timings.endpoint),
+        round(timings.elapsed * 1000),
+    )
+    path = os.path.join(directory, name)
+    with open(path, "w") as f:
+        for stack, count in timings.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list, or None when it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(-(-len(ordered) * pct // 100)) - 1, 0)
+    return ordered[index]
+
+
+def _millis(values):
+    return {f"p{pct}": round(percentile(values, pct) * 1000, 2) for pct in (50, 95, 99)}
+
+
+class PerfStats:
+    """Rolling per-endpoint and per-fingerprint timings for the last history requests."""
+
+    def __init__(self, history=1000):
+        self._requests = defaultdict(lambda: deque(maxlen=history))
+        self._statements = defaultdict(lambda: deque(maxlen=history))
+        self._statement_totals = defaultdict(lambda: [0, 0.0])
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        with self._lock:
+            self._requests[timings.endpoint].append(
+                dict(timings.phases, total=timings.elapsed)
+            )
+            for sql, (calls, seconds) in timings.statements.items():
+                # Per-request time of each fingerprint, so N+1 loops show up as one slow row
+                self._statements[sql].append(seconds)
+                totals = self._statement_totals[sql]
+                totals[0] += calls
+                totals[1] += seconds
+
+    def summary(self):
+        with self._lock:
+            requests = {endpoint: list(rows) for endpoint, rows in self._requests.items()}
+            statements = {
+                sql: (list(rows), tuple(self._statement_totals[sql]))
+                for sql, rows in self._statements.items()
+            }
+        endpoints = []
+        for endpoint, rows in requests.items():
+            entry = {"endpoint": endpoint, "requests": len(rows)}
+            for name in PHASES:
+                entry[name] = _millis([row.get(name, 0.0) for row in rows])
+            endpoints.append(entry)
+        endpoints.sort(key=lambda entry: entry["total"]["p95"], reverse=True)
+        queries = [
+            {
+                "sql": sql,
+                "calls": calls,
+                "total_ms": round(seconds * 1000, 2),
+                "per_request": _millis(rows),
+            }
+            for sql, (rows, (calls, seconds)) in statements.items()
+        ]
+        queries.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return {"endpoints": endpoints, "statements": queries}
+
+
+debug = Blueprint("perf", __name__)
+
+
+@debug.route("/_debug/perf")
+def perf_page():
+    if not current_app.config["PERF_ENABLED"]:
+        abort(404)
+    summary = current_app.extensions["perf"].stats.summary()
+    if request.args.get("format") == "json":
+        return jsonify(summary)
+    return render_template("perf.html", phases=PHASES, **summary)
+
+
+class Perf:
+    """Flask extension wiring RequestTimings into the request lifecycle."""
+
+    def __init__(self, app=None):
+        self.stats = None
+        self.sampler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("PERF_ENABLED", os.environ.get("PERF_ENABLED") == "1")
+        app.config.setdefault("PERF_HISTORY", 1000)
+        app.config.setdefault("PERF_PROFILE_THRESHOLD_MS", 500)  # None disables sampling
+        app.config.setdefault("PERF_PROFILE_DIR", "perf_profiles")
+        app.config.setdefault("PERF_SAMPLE_INTERVAL", 0.005)
+        self.stats = PerfStats(app.config["PERF_HISTORY"])
+        self.sampler = Sampler(app.config["PERF_SAMPLE_INTERVAL"])
+        app.extensions["perf"] = self
+        app.register_blueprint(debug)
+        app.before_request(self._start)
+        app.after_request(self._server_timing)
+        app.teardown_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    def _start(self):
+        if not current_app.config["PERF_ENABLED"] or request.endpoint == "perf.perf_page":
+            return
+        timings = RequestTimings(request.endpoint or request.path)
+        _current.set(timings)
+        if current_app.config["PERF_PROFILE_THRESHOLD_MS"] is not None:
+            self.sampler.add(timings)
+
+    def _server_timing(self, response):
+        timings = _current.get()
+        if timings is not None:
+            elapsed = time.perf_counter() - timings.started
+            metrics = [
+                f"{name};dur={seconds * 1000:.1f}"
+                for name, seconds in timings.phases.items()
+            ]
+            metrics.append(f"total;dur={elapsed * 1000:.1f}")
+            response.headers["Server-Timing"] = ", ".join(metrics)
+        return response
+
+    def _finish(self, exc):
+        timings = _current.get()
+        if timings is None:
+            return
+        _current.set(None)
+        self.sampler.remove(timings)
+        timings.finish()
+        self.stats.record(timings)
+        threshold = current_app.config["PERF_PROFILE_THRESHOLD_MS"]
+        if threshold is not None and timings.samples and timings.elapsed * 1000 >= threshold:
+            path = write_profile(current_app.config["PERF_PROFILE_DIR"], timings)
+            current_app.logger.info(
+                "Slow request %s (%.0f ms), profile written to %s",
+                timings.endpoint,
+                timings.elapsed * 1000,
+                path,
+            )
+
+    @staticmethod
+    def _template_started(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is not None:
+            timings.push("template")
+
+    @staticmethod
+    def _template_finished(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is not None and timings._stack:
+            timings.pop()
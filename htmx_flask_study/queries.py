@@ -0,0 +1,148 @@
+# Task queries shared by the views and benchmark.py.
+#
+# Every predicate compares a bare column against a bound value, so SQLite can
+# answer it from the composite (user_id, ...) indexes declared on Task. Dates
+# are half-open [start, end) ranges rather than date(target_date) = ?, which
+# would have to evaluate the function on every one of the user's rows.
+import threading
+import time as clock
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import case, event, func, inspect, tuple_
+from sqlalchemy.orm import Session, joinedload, object_session
+
+from database import Task, db
+
+# Loaded with every listing, so rows that show task.category cost no query each
+LIST_OPTIONS = (joinedload(Task.category),)
+
+# Per-process count cache; other workers' copies are at most this many seconds stale
+COUNTS_TTL = 30
+
+
+def day_range(day):
+    """Return the [start, end) datetimes covering a calendar day."""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def user_tasks(user_id):
+    return (
+        Task.query.options(*LIST_OPTIONS)
+        .filter(Task.user_id == user_id)
+        .order_by(Task.created_at.desc(), Task.id.desc())
+    )
+
+
+def tasks_before(user_id, before):
+    created_at, task_id = before
+    return user_tasks(user_id).filter(
+        tuple_(Task.created_at, Task.id) < tuple_(created_at, task_id)
+    )
+
+
+def task_page(user_id, before=None, limit=50):
+    """Return (tasks, next_cursor) for one page of the user's tasks, newest first.
+
+    before is the (created_at, id) of the last task on the previous page. The
+    row-value comparison lets SQLite seek ix_task_user_created straight to it,
+    where OFFSET would step over every earlier row again on each page.
+    """
+    query = user_tasks(user_id) if before is None else tasks_before(user_id, before)
+    tasks = query.limit(limit + 1).all()
+    if len(tasks) <= limit:
+        return tasks, None
+    last = tasks[limit - 1]
+    return tasks[:limit], (last.created_at, last.id)
+
+
+def tasks_due_on(user_id, day):
+    start, end = day_range(day)
+    return (
+        Task.query.options(*LIST_OPTIONS)
+        .filter(
+            Task.user_id == user_id, Task.target_date >= start, Task.target_date < end
+        )
+        .order_by(Task.priority.desc())
+    )
+
+
+def upcoming_tasks(user_id, day):
+    """Tasks due after the start of day, soonest first.
+
+    As in the original target_date > today, where the date compares as
+    midnight, this includes tasks due later today but not at 00:00.
+    """
+    start, _ = day_range(day)
+    return (
+        Task.query.options(*LIST_OPTIONS)
+        .filter(Task.user_id == user_id, Task.target_date > start)
+        .order_by(Task.target_date.asc())
+    )
+
+
+def priority_tasks(user_id):
+    return (
+        Task.query.options(*LIST_OPTIONS)
+        .filter(Task.user_id == user_id, Task.priority > 0)
+        .order_by(Task.priority.desc())
+    )
+
+
+_counts = {}  # user id -> (expires_at, counts)
+_counts_lock = threading.Lock()
+
+
+def task_counts(user_id):
+    """Return {"total", "completed"} for the user, cached until their tasks change."""
+    now = clock.monotonic()
+    with _counts_lock:
+        entry = _counts.get(user_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    total, completed = (
+        db.session.query(
+            func.count(Task.id),
+            func.coalesce(func.sum(case((Task.completed, 1), else_=0)), 0),
+        )
+        .filter(Task.user_id == user_id)
+        .one()
+    )
+    counts = {"total": total, "completed": completed}
+    with _counts_lock:
+        _counts[user_id] = (now + COUNTS_TTL, counts)
+    return counts
+
+
+@event.listens_for(Task.user_id, "set", active_history=True)
+def _load_previous_owner(target, value, oldvalue, initiator):
+    # Registered for active_history alone: user_id is usually expired after a
+    # commit, and without it the old owner would not be loaded before being
+    # overwritten, leaving history.deleted empty at flush.
+    pass
+
+
+@event.listens_for(Task, "after_insert")
+@event.listens_for(Task, "after_update")
+@event.listens_for(Task, "after_delete")
+def _mark_counts_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        changed = session.info.setdefault("task_counts_changed", set())
+        changed.add(target.user_id)
+        # A task moved to another user also changes its previous owner's counts
+        previous = inspect(target).attrs.user_id.history.deleted
+        changed.update(user_id for user_id in previous if user_id is not None)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed_counts(session):
+    changed = session.info.pop("task_counts_changed", ())
+    with _counts_lock:
+        for user_id in changed:
+            _counts.pop(user_id, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_counts(session):
+    session.info.pop("task_counts_changed", None)
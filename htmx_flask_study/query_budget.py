@@ -0,0 +1,126 @@
+# Per-request query counting, N+1 detection and query budgets.
+#
+# A listener on SQLAlchemy's before_cursor_execute counts the statements each
+# request sends, grouped by perf.fingerprint(). A fingerprint repeated
+# N_PLUS_ONE_THRESHOLD times in one request is almost always a lazy
+# relationship loaded in a loop, and is logged with its count. QUERY_BUDGET caps
+# the total per request: over it the request is logged, or fails with
+# QueryBudgetExceeded when QUERY_BUDGET_RAISE is set, as it should be in tests.
+# query_budget() applies the same check around any block of test code:
+#
+#     with query_budget(3):
+#         client.get("/dashboard")
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from perf import fingerprint
+
+# Counters active in this context; a query_budget() block around a test client
+# call and the request inside it both see the request's statements
+_active = ContextVar("query_counters", default=())
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = Counter()  # fingerprint -> executions
+
+    @property
+    def total(self):
+        return sum(self.statements.values())
+
+    def repeated(self, threshold):
+        """Fingerprints executed at least threshold times, most frequent first."""
+        return [(sql, n) for sql, n in self.statements.most_common() if n >= threshold]
+
+    def describe(self, limit=5):
+        return "; ".join(
+            f"{n} x {sql}" for sql, n in self.statements.most_common(limit)
+        )
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count(conn, cursor, statement, parameters, context, executemany):
+    for counter in _active.get():
+        counter.statements[fingerprint(statement)] += 1
+
+
+def _push(counter):
+    return _active.set(_active.get() + (counter,))
+
+
+@contextmanager
+def query_budget(limit, n_plus_one=None):
+    """Raise QueryBudgetExceeded if the block runs more than limit statements.
+
+    With n_plus_one set, any statement repeated that many times also fails the
+    block, however small the total.
+    """
+    counter = QueryCounter()
+    token = _push(counter)
+    try:
+        yield counter
+    finally:
+        _active.reset(token)
+    if counter.total > limit:
+        raise QueryBudgetExceeded(
+            f"{counter.total} queries, budget {limit}: {counter.describe()}"
+        )
+    if n_plus_one and counter.repeated(n_plus_one):
+        raise QueryBudgetExceeded(f"N+1 query: {counter.describe(1)}")
+
+
+class QueryBudget:
+    """Flask extension counting each request's queries against QUERY_BUDGET."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Statements allowed per request; None counts them without a limit
+        app.config.setdefault("QUERY_BUDGET", None)
+        app.config.setdefault("QUERY_BUDGET_RAISE", False)
+        app.config.setdefault("N_PLUS_ONE_THRESHOLD", 5)
+        app.extensions["query_budget"] = self
+        app.before_request(self._start)
+        app.after_request(self._check)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        g._query_counter = QueryCounter()
+        _push(g._query_counter)
+
+    def _check(self, response):
+        counter = g.get("_query_counter")
+        if counter is None:
+            return response
+        response.headers["X-Query-Count"] = str(counter.total)
+        config = current_app.config
+        for sql, n in counter.repeated(config["N_PLUS_ONE_THRESHOLD"]):
+            current_app.logger.warning(
+                "Possible N+1 in %s: %d x %s", request.endpoint, n, sql
+            )
+        budget = config["QUERY_BUDGET"]
+        if budget is not None and counter.total > budget:
+            message = (
+                f"{request.endpoint} ran {counter.total} queries,"
+                f" budget {budget}: {counter.describe()}"
+            )
+            if config["QUERY_BUDGET_RAISE"]:
+                raise QueryBudgetExceeded(message)
+            current_app.logger.warning(message)
+        return response
+
+    def _finish(self, exc):
+        counter = g.pop("_query_counter", None)
+        if counter is not None:
+            _active.set(tuple(c for c in _active.get() if c is not counter))
@@ -0,0 +1,48 @@
+import os
+import unittest
+
+# The engine is created when app.py is imported, so the URI has to be set first
+os.environ["DATABASE_URL"] = "sqlite://"
+
+import queries  # noqa: E402
+from app import app, user_cache  # noqa: E402
+from database import User, db  # noqa: E402
+
+PASSWORD = "secret"
+
+
+class AppTestCase(unittest.TestCase):
+    """Each test gets an empty in-memory database holding one user, self.user."""
+
+    def setUp(self):
+        self.original_config = dict(app.config)
+        app.config.update(TESTING=True, QUERY_BUDGET_RAISE=True)
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        self.user = User(email="ada@example.com", name="Ada")
+        self.user.set_password(PASSWORD)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        app.config.clear()
+        app.config.update(self.original_config)
+        # Process-wide caches outlive the in-memory database
+        queries._counts.clear()
+        user_cache._local.clear()
+        user_cache._generations.clear()
+        user_cache.stats = dict.fromkeys(user_cache.stats, 0)
+
+    def login(self):
+        """Return a test client signed in as self.user."""
+        client = app.test_client()
+        response = client.post(
+            "/login", data={"email": self.user.email, "password": PASSWORD}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers["Location"].endswith("/dashboard"))
+        return client
@@ -0,0 +1,61 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import inspect, text
+
+import queries
+from app_test_case import AppTestCase
+from benchmark import run_query
+from database import Task, create_missing_indexes, db
+
+TODAY = date(2024, 5, 1)
+LISTINGS = {
+    "today": (queries.tasks_due_on, "ix_task_user_target_date"),
+    "upcoming": (queries.upcoming_tasks, "ix_task_user_target_date"),
+    "priority": (
+        lambda user_id, day: queries.priority_tasks(user_id),
+        "ix_task_user_priority",
+    ),
+}
+
+
+def task_indexes():
+    return {index["name"] for index in inspect(db.engine).get_indexes("task")}
+
+
+class IndexTests(AppTestCase):
+    def test_listings_are_answered_from_their_index(self):
+        for name, (query, index) in LISTINGS.items():
+            with self.subTest(listing=name):
+                _, _, plan = run_query(query(self.user.id, TODAY), repeat=1)
+                self.assertTrue(
+                    any(f"USING INDEX {index}" in step for step in plan), plan
+                )
+
+    def test_upcoming_includes_tasks_later_today(self):
+        midnight = datetime.combine(TODAY, time.min)
+        for title, due in [
+            ("midnight", midnight),
+            ("evening", midnight + timedelta(hours=18)),
+            ("tomorrow", midnight + timedelta(days=1)),
+            ("yesterday", midnight - timedelta(hours=1)),
+        ]:
+            db.session.add(Task(title=title, user_id=self.user.id, target_date=due))
+        db.session.commit()
+        tasks = queries.upcoming_tasks(self.user.id, TODAY)
+        self.assertEqual([task.title for task in tasks], ["evening", "tomorrow"])
+
+    def test_create_missing_indexes_is_idempotent(self):
+        self.assertEqual(create_missing_indexes(), [])
+        db.session.execute(text("DROP INDEX ix_task_user_priority"))
+        db.session.commit()
+        self.assertNotIn("ix_task_user_priority", task_indexes())
+        self.assertEqual(create_missing_indexes(), ["ix_task_user_priority"])
+        self.assertEqual(create_missing_indexes(), [])
+        self.assertLessEqual(
+            {
+                "ix_task_user_created",
+                "ix_task_user_target_date",
+                "ix_task_user_priority",
+            },
+            task_indexes(),
+        )
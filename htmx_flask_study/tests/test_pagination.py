@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import queries
+from app import app
+from app_test_case import AppTestCase
+from database import Task, User, db
+
+CREATED_AT = datetime(2024, 5, 1, 9, 30)
+MALFORMED_CURSORS = [
+    "",
+    "before=2024-05-01T09:30:00",
+    "before_id=3",
+    "before=yesterday&before_id=3",
+    "before=2024-05-01T09:30:00&before_id=three",
+]
+
+
+class TaskPageTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        # Same created_at throughout, so only the id breaks the tie
+        self.tasks = [
+            Task(title=f"Task {i}", user_id=self.user.id, created_at=CREATED_AT)
+            for i in range(5)
+        ]
+        db.session.add_all(self.tasks)
+        db.session.commit()
+
+    def test_cursor_pages_through_created_at_ties(self):
+        seen = []
+        tasks, cursor = queries.task_page(self.user.id, limit=2)
+        while True:
+            seen += [task.id for task in tasks]
+            if cursor is None:
+                break
+            self.assertEqual(cursor, (CREATED_AT, tasks[-1].id))
+            tasks, cursor = queries.task_page(self.user.id, before=cursor, limit=2)
+        self.assertEqual(seen, sorted((task.id for task in self.tasks), reverse=True))
+
+    def test_last_page_has_no_cursor(self):
+        tasks, cursor = queries.task_page(self.user.id, limit=5)
+        self.assertEqual(len(tasks), 5)
+        self.assertIsNone(cursor)
+
+    def test_page_route_renders_rows_and_the_next_cursor(self):
+        app.config["TASK_PAGE_SIZE"] = 2
+        client = self.login()
+        url = "/tasks/page?before={}&before_id={}"
+        response = client.get(url.format(CREATED_AT.isoformat(), self.tasks[-1].id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'id="task-more"', response.data)
+        response = client.get(url.format(CREATED_AT.isoformat(), self.tasks[2].id))
+        self.assertIn(b"Task 1", response.data)
+        self.assertIn(b"Task 0", response.data)
+        self.assertNotIn(b'id="task-more"', response.data)
+
+    def test_malformed_cursor_is_rejected(self):
+        client = self.login()
+        for query in MALFORMED_CURSORS:
+            with self.subTest(query=query):
+                self.assertEqual(client.get("/tasks/page?" + query).status_code, 400)
+
+
+class TaskCountsTests(AppTestCase):
+    def test_counts_are_invalidated_by_each_change(self):
+        client = self.login()
+        self.assertEqual(
+            queries.task_counts(self.user.id), {"total": 0, "completed": 0}
+        )
+        client.post("/tasks", data={"title": "Write tests"})
+        self.assertEqual(
+            queries.task_counts(self.user.id), {"total": 1, "completed": 0}
+        )
+        task_id = Task.query.one().id
+        client.post(f"/tasks/{task_id}/toggle")
+        self.assertEqual(
+            queries.task_counts(self.user.id), {"total": 1, "completed": 1}
+        )
+        client.delete(f"/tasks/{task_id}/delete")
+        self.assertEqual(
+            queries.task_counts(self.user.id), {"total": 0, "completed": 0}
+        )
+
+    def test_moving_a_task_invalidates_both_owners(self):
+        other = User(email="grace@example.com", name="Grace")
+        task = Task(title="Write tests", user_id=self.user.id)
+        db.session.add_all([other, task])
+        db.session.commit()
+        self.assertEqual(queries.task_counts(self.user.id)["total"], 1)
+        self.assertEqual(queries.task_counts(other.id)["total"], 0)
+        task.user_id = other.id
+        db.session.commit()
+        self.assertEqual(queries.task_counts(self.user.id)["total"], 0)
+        self.assertEqual(queries.task_counts(other.id)["total"], 1)
+
+    def test_rollback_keeps_the_cached_counts(self):
+        task = Task(title="Write tests", user_id=self.user.id)
+        db.session.add(task)
+        db.session.commit()
+        counts = queries.task_counts(self.user.id)
+        db.session.delete(task)
+        db.session.flush()
+        db.session.rollback()
+        self.assertIn(self.user.id, queries._counts)
+        self.assertIs(queries.task_counts(self.user.id), counts)
@@ -0,0 +1,50 @@
+from app import app
+from app_test_case import AppTestCase
+from database import Task, db
+from perf import fingerprint
+
+
+class PerfTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config.update(PERF_ENABLED=True, PERF_PROFILE_THRESHOLD_MS=None)
+        db.session.add(Task(title="Write tests", user_id=self.user.id, priority=2))
+        db.session.commit()
+        self.client = self.login()
+
+    def test_requests_report_their_phases(self):
+        response = self.client.get("/tasks/priority")
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers["Server-Timing"]
+        self.assertIn("db;dur=", timing)
+        self.assertIn("template;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+    def test_statements_are_timed_by_fingerprint(self):
+        self.client.get("/tasks/priority")
+        summary = self.client.get("/_debug/perf?format=json").json
+        endpoints = {entry["endpoint"]: entry for entry in summary["endpoints"]}
+        self.assertIn("priority_tasks", endpoints)
+        self.assertGreater(endpoints["priority_tasks"]["db"]["p50"], 0)
+        statements = [entry["sql"] for entry in summary["statements"]]
+        self.assertTrue(any("FROM task" in sql and "?" in sql for sql in statements))
+        self.assertEqual(self.client.get("/_debug/perf").status_code, 200)
+
+    def test_debug_page_is_off_unless_enabled(self):
+        app.config["PERF_ENABLED"] = False
+        response = self.client.get("/tasks/priority")
+        self.assertNotIn("Server-Timing", response.headers)
+        self.assertEqual(self.client.get("/_debug/perf").status_code, 404)
+
+    def test_fingerprint_matches_the_inventory_tracker(self):
+        # The same cases as invoice_tracker/tests/test_perf.py
+        self.assertEqual(
+            fingerprint(
+                "SELECT *  FROM inventory\n WHERE id IN (?, ?, ?)"
+                " AND name = 'it''s' LIMIT 50"
+            ),
+            "SELECT * FROM inventory WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+        self.assertEqual(
+            fingerprint("SELECT 1 -- comment\n FROM idx_2"), "SELECT ? FROM idx_2"
+        )
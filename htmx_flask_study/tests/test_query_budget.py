@@ -0,0 +1,67 @@
+from datetime import datetime, time, timedelta
+from unittest import mock
+
+import queries
+from app import app
+from app_test_case import AppTestCase
+from database import Category, Task, db
+from query_budget import QueryBudgetExceeded, query_budget
+
+CURSOR = "before=2100-01-01T00:00:00&before_id=1000000"
+# Budgets cover the signed-in user (a cache miss right after login), the task
+# counts and the listing itself
+LISTINGS = [
+    ("/dashboard", 3),
+    ("/detailed", 3),
+    ("/tasks/today", 2),
+    ("/tasks/upcoming", 2),
+    ("/tasks/priority", 2),
+    ("/tasks/page?" + CURSOR, 2),
+]
+
+
+class QueryBudgetTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        # Each task has its own category, so loading them lazily costs a query per row
+        now = datetime.utcnow()
+        noon = datetime.combine(now.date(), time(12))
+        for i in range(10):
+            db.session.add(
+                Task(
+                    title=f"Task {i}",
+                    user_id=self.user.id,
+                    priority=1 + i % 2,
+                    target_date=noon + timedelta(days=i % 2),
+                    category=Category(name=f"Category {i}", color="#112233"),
+                    created_at=now - timedelta(minutes=i),
+                )
+            )
+        db.session.commit()
+        self.client = self.login()
+
+    def test_listings_stay_within_budget(self):
+        for path, budget in LISTINGS:
+            with self.subTest(path=path):
+                with query_budget(budget, n_plus_one=2):
+                    response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b"Task ", response.data)
+                self.assertLessEqual(int(response.headers["X-Query-Count"]), budget)
+
+    def test_lazy_category_loads_are_caught(self):
+        with mock.patch.object(queries, "LIST_OPTIONS", ()):
+            with self.assertRaisesRegex(
+                QueryBudgetExceeded, "N\\+1 query: .* FROM category"
+            ):
+                with query_budget(20, n_plus_one=3):
+                    self.client.get("/tasks/priority")
+            with self.assertRaisesRegex(QueryBudgetExceeded, "budget 2"):
+                with query_budget(2):
+                    self.client.get("/tasks/priority")
+
+    def test_request_budget_fails_the_request(self):
+        app.config["QUERY_BUDGET"] = 5
+        with mock.patch.object(queries, "LIST_OPTIONS", ()):
+            with self.assertRaisesRegex(QueryBudgetExceeded, "priority_tasks ran"):
+                self.client.get("/tasks/priority")
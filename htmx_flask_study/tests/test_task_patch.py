@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+from app_test_case import AppTestCase
+from database import Task, db
+
+COUNTS = b'<span id="task-counts" class="text-muted small me-2" hx-swap-oob="true">'
+# (list on screen, days from today it is due, priority, whether it belongs there)
+FILTERED_INSERTS = [
+    ("today", 0, "0", True),
+    ("today", 2, "0", False),
+    ("upcoming", 2, "0", True),
+    ("upcoming", 0, "0", False),
+    ("priority", None, "2", True),
+    ("priority", None, "0", False),
+]
+
+
+def oob_targets(response):
+    """The hx-swap-oob values in a patch, in order."""
+    html = response.get_data(as_text=True)
+    return [part.split('"', 1)[0] for part in html.split('hx-swap-oob="')[1:]]
+
+
+class TaskPatchTests(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = self.login()
+
+    def add_task(self):
+        task = Task(title="Write tests", user_id=self.user.id)
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    def test_empty_list_shows_the_placeholder(self):
+        self.assertIn(b'id="task-empty"', self.client.get("/dashboard").data)
+
+    def test_insert_adds_one_row_and_drops_the_placeholder(self):
+        for path in ("/tasks", "/detailed/tasks"):
+            with self.subTest(path=path):
+                response = self.client.post(path, data={"title": "Write tests"})
+                self.assertEqual(
+                    oob_targets(response), ["afterbegin:#task-rows", "delete", "true"]
+                )
+                self.assertEqual(response.data.count(b"Write tests"), 1)
+                self.assertIn(
+                    b'<div id="task-empty" hx-swap-oob="delete">', response.data
+                )
+                self.assertIn(COUNTS, response.data)
+
+    def test_insert_without_a_title_changes_nothing(self):
+        response = self.client.post("/tasks", data={"title": ""})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Task.query.count(), 0)
+
+    def test_change_replaces_one_row(self):
+        task = self.add_task()
+        for path, data in [
+            ("/tasks/{id}/toggle", {}),
+            ("/tasks/{id}/update-status?view=detailed", {"status": "on_hold"}),
+            ("/tasks/{id}/edit", {"title": "Edited", "priority": "1"}),
+        ]:
+            with self.subTest(path=path):
+                response = self.client.post(path.format(id=task.id), data=data)
+                self.assertEqual(oob_targets(response), ["true", "true"])
+                row = f'id="task-{task.id}"'.encode()
+                self.assertEqual(response.data.count(row), 1)
+                self.assertIn(COUNTS, response.data)
+
+    def test_toggle_updates_the_done_count(self):
+        task = self.add_task()
+        response = self.client.post(f"/tasks/{task.id}/toggle")
+        self.assertIn(b"1 tasks, 1 done", response.data)
+
+    def test_delete_removes_one_row(self):
+        task = self.add_task()
+        response = self.client.delete(f"/tasks/{task.id}/delete")
+        self.assertEqual(oob_targets(response), ["delete", "true"])
+        row = f'<div id="task-{task.id}" hx-swap-oob="delete">'.encode()
+        self.assertIn(row, response.data)
+        self.assertIn(b"0 tasks, 0 done", response.data)
+
+    def test_tasks_of_other_users_are_refused(self):
+        task = self.add_task()
+        task.user_id = self.user.id + 1
+        db.session.commit()
+        self.assertEqual(self.client.post(f"/tasks/{task.id}/toggle").status_code, 403)
+        self.assertEqual(
+            self.client.delete(f"/tasks/{task.id}/delete").status_code, 403
+        )
+
+    def test_insert_reruns_the_filtered_list_on_screen(self):
+        today = datetime.utcnow().date()
+        for list_filter, days, priority, shown in FILTERED_INSERTS:
+            with self.subTest(list=list_filter, days=days, priority=priority):
+                target_date = (
+                    "" if days is None else (today + timedelta(days=days)).isoformat()
+                )
+                response = self.client.post(
+                    "/detailed/tasks",
+                    data={
+                        "title": "Filtered",
+                        "target_date": target_date,
+                        "priority": priority,
+                        "list": list_filter,
+                    },
+                )
+                self.assertEqual(oob_targets(response), ["innerHTML", "true"])
+                self.assertNotIn(b"afterbegin", response.data)
+                self.assertIs(b"Filtered" in response.data, shown)
+                hidden = f'name="list" value="{list_filter}"'.encode()
+                self.assertIn(hidden, response.data)
+                Task.query.delete()
+                db.session.commit()
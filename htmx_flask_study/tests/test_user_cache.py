@@ -0,0 +1,96 @@
+import time
+from unittest import mock
+
+from app import app, user_cache
+from app_test_case import PASSWORD, AppTestCase
+from database import User, db
+
+
+class UserCacheTests(AppTestCase):
+    def test_second_lookup_is_a_hit(self):
+        self.assertEqual(user_cache.get(self.user.id).email, self.user.email)
+        self.assertEqual(user_cache.get(self.user.id).email, self.user.email)
+        self.assertEqual(user_cache.stats["misses"], 1)
+        self.assertEqual(user_cache.stats["hits"], 1)
+
+    def test_unknown_user_is_not_cached(self):
+        self.assertIsNone(user_cache.get(404))
+        self.assertNotIn(404, user_cache._local)
+
+    def test_least_recently_used_user_is_evicted(self):
+        others = [
+            User(email=f"user{i}@example.com", name=f"User {i}") for i in range(2)
+        ]
+        db.session.add_all(others)
+        db.session.commit()
+        first, second, third = self.user.id, others[0].id, others[1].id
+        with mock.patch.object(user_cache, "maxsize", 2):
+            for user_id in (first, second, first, third):
+                user_cache.get(user_id)
+        self.assertEqual(list(user_cache._local), [first, third])
+        self.assertEqual(user_cache.stats["hits"], 1)
+        self.assertEqual(user_cache.stats["misses"], 3)
+
+    def test_entries_expire_after_the_ttl(self):
+        now = [1000.0]
+        with mock.patch.object(time, "monotonic", lambda: now[0]), mock.patch.object(
+            user_cache, "ttl", 60
+        ):
+            user_cache.get(self.user.id)
+            now[0] += 59
+            user_cache.get(self.user.id)
+            now[0] += 2
+            user_cache.get(self.user.id)
+        self.assertEqual(user_cache.stats["hits"], 1)
+        self.assertEqual(user_cache.stats["misses"], 2)
+
+    def test_commit_invalidates_the_user(self):
+        user_cache.get(self.user.id)
+        self.user.name = "Grace"
+        db.session.commit()
+        self.assertNotIn(self.user.id, user_cache._local)
+        self.assertEqual(user_cache.get(self.user.id).name, "Grace")
+
+    def test_rollback_keeps_the_cached_user(self):
+        user_cache.get(self.user.id)
+        self.user.name = "Grace"
+        db.session.flush()
+        db.session.rollback()
+        self.assertIn(self.user.id, user_cache._local)
+        self.assertEqual(user_cache.stats["invalidations"], 0)
+
+    def test_login_invalidates_the_cached_user(self):
+        user_cache.get(self.user.id)
+        app.test_client().post(
+            "/login", data={"email": self.user.email, "password": PASSWORD}
+        )
+        self.assertEqual(user_cache.stats["invalidations"], 1)
+        self.assertIsNotNone(user_cache.get(self.user.id).last_login)
+
+    def test_row_loaded_before_a_commit_is_not_cached(self):
+        # The writer commits between the reader's SELECT and its store
+        load = user_cache._load
+
+        def load_then_write(user_id):
+            snapshot = load(user_id)
+            db.session.get(User, user_id).name = "Grace"
+            db.session.commit()
+            return snapshot
+
+        with mock.patch.object(user_cache, "_load", load_then_write):
+            self.assertEqual(user_cache.get(self.user.id).name, "Ada")
+        self.assertNotIn(self.user.id, user_cache._local)
+        self.assertEqual(user_cache.get(self.user.id).name, "Grace")
+
+    def test_redis_tier_is_off_without_redis_url(self):
+        self.assertIsNone(app.config["REDIS_URL"])
+        self.assertIsNone(user_cache.redis)
+
+    def test_debug_stats_are_opt_in(self):
+        client = self.login()
+        self.assertEqual(client.get("/_debug/user-cache").status_code, 404)
+        app.config["USER_CACHE_DEBUG"] = True
+        response = client.get("/_debug/user-cache")
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.json["redis"], False)
+        self.assertIsNone(response.json["hit_ratio"])
@@ -0,0 +1,227 @@
+# Cached user loader for flask_login.
+#
+# load_user() runs on every authenticated request, so without a cache each
+# request starts with a SELECT on the user table. UserCache keeps detached
+# snapshots of users (plain objects, no session attached) in a process-local
+# LRU with a TTL and, when REDIS_URL is set and redis is installed, in a Redis
+# tier shared by all workers. Writes to a User invalidate both tiers once the
+# transaction commits, and bump a per-user generation so a reader that loaded
+# the old row before the commit does not cache it afterwards. Other workers'
+# local copies expire within USER_CACHE_TTL, which bounds how stale a name or
+# last_login can be.
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import abort, current_app, jsonify
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+try:
+    import redis
+except ImportError:  # optional; only the local tier is used
+    redis = None
+
+SNAPSHOT_FIELDS = (
+    "id",
+    "email",
+    "name",
+    "google_id",
+    "profile_pic",
+    "created_at",
+    "last_login",
+)
+DATETIME_FIELDS = ("created_at", "last_login")
+
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of a User for current_user; holds no password hash."""
+
+    def __init__(self, **fields):
+        for name in SNAPSHOT_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{name: getattr(user, name) for name in SNAPSHOT_FIELDS})
+
+    def to_json(self):
+        fields = {name: getattr(self, name) for name in SNAPSHOT_FIELDS}
+        for name in DATETIME_FIELDS:
+            if fields[name] is not None:
+                fields[name] = fields[name].isoformat()
+        return json.dumps(fields)
+
+    @classmethod
+    def from_json(cls, data):
+        fields = json.loads(data)
+        for name in DATETIME_FIELDS:
+            if fields[name] is not None:
+                fields[name] = datetime.fromisoformat(fields[name])
+        return cls(**fields)
+
+
+class UserCache:
+    """Two-tier TTL cache of UserSnapshots keyed by user id."""
+
+    def __init__(self, app=None, model=None):
+        self.model = model
+        self.ttl = 300
+        self.maxsize = 1024
+        self.redis = None
+        self._local = OrderedDict()  # user id -> (expires_at, snapshot)
+        self._generations = {}  # user id -> invalidation count
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0}
+        if app is not None:
+            self.init_app(app, model)
+
+    def init_app(self, app, model=None):
+        app.config.setdefault("USER_CACHE_TTL", 300)  # seconds; 0 disables the cache
+        app.config.setdefault("USER_CACHE_SIZE", 1024)
+        app.config.setdefault("REDIS_URL", None)
+        app.config.setdefault("USER_CACHE_DEBUG", False)  # serve /_debug/user-cache
+        self.model = model or self.model
+        self.ttl = app.config["USER_CACHE_TTL"]
+        self.maxsize = app.config["USER_CACHE_SIZE"]
+        if app.config["REDIS_URL"] and redis is not None:
+            self.redis = redis.Redis.from_url(
+                app.config["REDIS_URL"], socket_timeout=0.2
+            )
+        elif app.config["REDIS_URL"]:
+            app.logger.warning(
+                "REDIS_URL is set but redis is not installed; user cache is local only"
+            )
+        app.extensions["user_cache"] = self
+        app.add_url_rule("/_debug/user-cache", "user_cache_stats", self.stats_view)
+
+        # Invalidate after commit, so a reader cannot re-cache the old row in between
+        event.listen(self.model, "after_update", self._mark_changed)
+        event.listen(self.model, "after_delete", self._mark_changed)
+        event.listen(Session, "after_commit", self._after_commit)
+        event.listen(Session, "after_rollback", self._after_rollback)
+
+    def _redis_key(self, user_id):
+        return f"user-cache:{user_id}"
+
+    def _redis_generation_key(self, user_id):
+        return f"user-cache-generation:{user_id}"
+
+    def get(self, user_id):
+        """Return the snapshot for user_id, loading it from the database on a miss."""
+        if not self.ttl:
+            return self._load(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return entry[1]
+
+        # Read before the row, so an invalidation committed while it loads is seen
+        generation, redis_generation = self._generation(user_id)
+        snapshot = self._redis_get(user_id)
+        if snapshot is not None:
+            self._count("redis_hits")
+        else:
+            self._count("misses")
+            snapshot = self._load(user_id)
+            if snapshot is None:
+                return None
+            self._redis_set(user_id, snapshot, redis_generation)
+        self._store(user_id, snapshot, now, generation)
+        return snapshot
+
+    def _generation(self, user_id):
+        with self._lock:
+            generation = self._generations.get(user_id, 0)
+        if self.redis is None:
+            return generation, None
+        try:
+            return generation, self.redis.get(self._redis_generation_key(user_id))
+        except redis.RedisError:
+            return generation, None
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _load(self, user_id):
+        user = self.model.query.session.get(self.model, user_id)
+        return UserSnapshot.from_user(user) if user is not None else None
+
+    def _store(self, user_id, snapshot, now, generation):
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return  # invalidated since the snapshot was read
+            self._local[user_id] = (now + self.ttl, snapshot)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _redis_get(self, user_id):
+        if self.redis is None:
+            return None
+        try:
+            data = self.redis.get(self._redis_key(user_id))
+        except redis.RedisError:
+            return None  # the shared tier is an optimization; fall back to the database
+        return UserSnapshot.from_json(data) if data else None
+
+    def _redis_set(self, user_id, snapshot, generation):
+        if self.redis is None:
+            return
+        generation_key = self._redis_generation_key(user_id)
+        try:
+            with self.redis.pipeline() as pipe:
+                # The SET is dropped (WatchError) if any worker invalidates meanwhile
+                pipe.watch(generation_key)
+                if pipe.get(generation_key) != generation:
+                    return
+                pipe.multi()
+                pipe.set(self._redis_key(user_id), snapshot.to_json(), ex=self.ttl)
+                pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.stats["invalidations"] += 1
+        if self.redis is not None:
+            try:
+                with self.redis.pipeline() as pipe:
+                    pipe.incr(self._redis_generation_key(user_id))
+                    pipe.delete(self._redis_key(user_id))
+                    pipe.execute()
+            except redis.RedisError:
+                pass
+
+    def _mark_changed(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("user_cache_changed", set()).add(target.id)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop("user_cache_changed", ()):
+            self.invalidate(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop("user_cache_changed", None)
+
+    def stats_view(self):
+        if not (current_app.debug or current_app.config["USER_CACHE_DEBUG"]):
+            abort(404)
+        with self._lock:
+            size = len(self._local)
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["redis_hits"] + stats["misses"]
+        hit_ratio = (stats["hits"] + stats["redis_hits"]) / lookups if lookups else None
+        return jsonify(
+            dict(stats, size=size, hit_ratio=hit_ratio, redis=self.redis is not None)
+        )
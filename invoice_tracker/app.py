@@ -1,23 +1,34 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, jsonify, g,
+                   make_response, stream_template, stream_with_context)
 import sqlite3
-from datetime import datetime
-import csv
-import io
-from werkzeug.security import generate_password_hash, check_password_hash
+import time
 from functools import wraps
 import json
-from crawl4ai import AsyncWebCrawler  # Correct import
-import asyncio
-from asgiref.wsgi import WsgiToAsgi
-from quart import Quart
+import change_feed
+import queries
+import views
+from config import Config
+import exporter
+from maintenance import connect, enable_incremental_vacuum, run_maintenance
+from passwords import HasherBusy
+from page_cache import data_version, make_etag, tee_body
+from crawl_jobs import PENDING_STATUSES
+from search import highlight
+from rollups import rebuild_rollups
+from perf import Perf, ProfiledConnection, phase
 
 app = Flask(__name__)
-app.secret_key = 'your_secret_key_here'  # Required for flashing messages and sessions
+app.config.from_object(Config)
+Perf(app)
 
 # Add custom Jinja2 filter for JSON parsing
 @app.template_filter('from_json')
 def from_json(value):
-    return json.loads(value)
+    with phase('decode'):
+        return json.loads(value)
+
+app.jinja_env.globals['pending_crawl_statuses'] = PENDING_STATUSES
+app.add_template_filter(highlight)
 
 def login_required(f):
     @wraps(f)
@@ -28,10 +39,116 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def get_pool():
+    factory = ProfiledConnection if app.config['PERF_ENABLED'] else sqlite3.Connection
+    return views.get_pool(app, factory)
+
+def get_hasher():
+    return views.get_hasher(app)
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    # Shed load rather than queue logins behind each other
+    app.logger.warning('Password hashing saturated: %s', e)
+    return views.HASHER_BUSY
+
 def get_db_connection():
-    conn = sqlite3.connect('inventory.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    # The connection is borrowed for the whole app context and returned on teardown
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+def versioned(view):
+    """Answer 304 or replay a cached render until the user's data version moves."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if session.get('_flashes'):
+                # Pending flash messages are part of the page; render it fresh
+                return f(*args, **kwargs)
+            user_id = session['user_id']
+            key = views.page_key(app, request, user_id, view, data_version(get_db_connection(), user_id))
+            etag = make_etag(key)
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                cache = app.extensions['fragment_cache']
+                cached = cache.get(key)
+                if cached is None:
+                    response = make_response(f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if response.is_streamed:
+                        # Keep streaming; the body is cached once sent, if it was small enough
+                        mimetype = response.mimetype
+                        response.response = tee_body(
+                            response.response, lambda body: cache.put(key, (body, mimetype)),
+                            app.config['FRAGMENT_CACHE_MAX_BYTES'])
+                        response.set_etag(etag)
+                        response.headers['Cache-Control'] = 'private, no-cache'
+                        return response
+                    cached = (response.get_data(), response.mimetype)
+                    cache.put(key, cached)
+                response = app.response_class(cached[0], mimetype=cached[1])
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+def coalesce(chunks, size):
+    # Jinja yields a string per template node; write them out in larger pieces
+    buffer, length = [], 0
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield ''.join(buffer)
+                buffer, length = [], 0
+    finally:
+        # Closing the stream_with_context generator is what pops its request context
+        chunks.close()
+    if buffer:
+        yield ''.join(buffer)
+
+def stream_page(template, **context):
+    """Render template while it is sent, so RowStream rows are read as they are written."""
+    if session.get('_flashes'):
+        # The session cookie goes out before a streamed body, so popped flashes would stick
+        return render_template(template, **context)
+    chunks = stream_template(template, **context)
+    return app.response_class(coalesce(chunks, app.config['STREAM_CHUNK_SIZE']), mimetype='text/html')
+
+def respond(result):
+    """Turn a views.py result into a response."""
+    if isinstance(result, views.Redirect):
+        if result.message:
+            flash(result.message)
+        return redirect(url_for(result.endpoint, **result.values))
+    if isinstance(result, views.Json):
+        return jsonify(result.data)
+    if isinstance(result, views.Reply):
+        return result.body, result.status, result.headers
+    if result.message:
+        flash(result.message)
+    if result.stream:
+        response = stream_page(result.template, **result.context)
+    else:
+        response = render_template(result.template, **result.context)
+    response = make_response(response)
+    response.headers.update(result.headers)
+    return response
+
+def run_view(view, *args):
+    # The pooled connection stays checked out until a streamed page is sent
+    return respond(view(get_db_connection(), session['user_id'], *args))
 
 @app.route('/')
 def landing():
@@ -41,30 +158,58 @@ def landing():
 
 @app.route('/dashboard')
 @login_required
+@versioned('dashboard')
 def dashboard():
+    return run_view(views.dashboard, request.args, app.config['INVENTORY_PAGE_SIZE'])
+
+@app.route('/inventory/rows')
+@login_required
+@versioned('inventory_rows')
+def inventory_rows():
+    return run_view(views.inventory_rows, request.args, app.config['INVENTORY_PAGE_SIZE'])
+
+@app.route('/inventory/summary')
+@login_required
+@versioned('inventory_summary')
+def inventory_summary():
+    return run_view(views.inventory_summary, request.accept_mimetypes.best)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute inventory_rollups from inventory and report any drift."""
+    with app.app_context():
+        drift = rebuild_rollups(get_db_connection())
+    for user_id, dimension, value, stored, expected in drift:
+        print(f'user {user_id} {dimension}={value!r}: stored {stored}, expected {expected}')
+    print(f'Rebuilt inventory rollups; {len(drift)} rows had drifted.')
+
+@app.cli.command('maintenance')
+def maintenance_command():
+    """Prune old crawls, compact the database and write a backup."""
+    report = run_maintenance(app.config['DATABASE'],
+                             keep_per_url=app.config['RETENTION_KEEP_PER_URL'],
+                             strip_html_days=app.config['RETENTION_STRIP_HTML_DAYS'],
+                             backup_dir=app.config['BACKUP_DIR'],
+                             backup_keep=app.config['BACKUP_KEEP'],
+                             feed_retention_hours=app.config['CHANGE_FEED_RETENTION_HOURS'])
+    for name, value in report.items():
+        print(f'{name}: {value}')
+
+@app.cli.command('enable-incremental-vacuum')
+def enable_incremental_vacuum_command():
+    """Switch an older database to incremental auto-vacuum; one full VACUUM, blocks writers."""
+    conn = connect(app.config['DATABASE'])
     try:
-        conn = get_db_connection()
-        items = conn.execute('SELECT * FROM inventory WHERE user_id = ? ORDER BY date_added DESC', 
-                           (session['user_id'],)).fetchall()
+        rebuilt = enable_incremental_vacuum(conn)
+    finally:
         conn.close()
-        
-        # Convert items to list of dictionaries for better handling
-        items_list = []
-        for item in items:
-            items_list.append({
-                'id': item['id'],
-                'name': item['name'],
-                'quantity': item['quantity'],
-                'category': item['category'],
-                'sector': item['sector'],
-                'application': item['application'],
-                'date_added': item['date_added']
-            })
-        
-        return render_template('dashboard.html', items=items_list)
-    except Exception as e:
-        flash(f'Error loading dashboard: {str(e)}')
-        return redirect(url_for('login'))
+    print('Switched to incremental auto-vacuum.' if rebuilt else 'Already in incremental auto-vacuum mode.')
+
+@app.route('/search')
+@login_required
+def search():
+    return run_view(views.search, request.args, request.headers.get('HX-Request'),
+                    app.config['SEARCH_PAGE_SIZE'])
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -73,16 +218,18 @@ def login():
         password = request.form['password']
         
         conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        user = queries.get_user_by_username(conn, username)
         
-        if user and check_password_hash(user['password'], password):
+        matches, new_hash = get_hasher().verify(user['password'], password) if user else (False, None)
+        if matches:
+            if new_hash:
+                queries.update_password_hash(conn, user['id'], new_hash)
             session['user_id'] = user['id']
             session['username'] = user['username']
             flash('Welcome back!')
             return redirect(url_for('dashboard'))
         
         flash('Invalid username or password')
-        conn.close()
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -93,15 +240,12 @@ def register():
         email = request.form['email']
         
         conn = get_db_connection()
-        if conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone():
+        if queries.get_user_by_username(conn, username):
             flash('Username already exists')
             return redirect(url_for('register'))
             
-        hashed_password = generate_password_hash(password)
-        conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
-                    (username, hashed_password, email))
-        conn.commit()
-        conn.close()
+        hashed_password = get_hasher().hash(password)
+        queries.create_user(conn, username, hashed_password, email)
         flash('Registration successful! Please log in.')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -116,263 +260,138 @@ def logout():
 @login_required
 def add_item():
     if request.method == 'POST':
-        name = request.form['name']
-        quantity = request.form['quantity']
-        category = request.form['category']
-        sector = request.form['sector']
-        application = request.form['application']
-        
-        if not name or not quantity:
-            flash('Name and quantity are required!')
-        else:
-            conn = get_db_connection()
-            conn.execute('''INSERT INTO inventory 
-                          (name, quantity, category, sector, application, user_id) 
-                          VALUES (?, ?, ?, ?, ?, ?)''',
-                       (name, quantity, category, sector, application, session['user_id']))
-            conn.commit()
-            conn.close()
-            flash('Item successfully added!')
-            return redirect(url_for('dashboard'))
-            
+        return run_view(views.add_item, request.form)
     return render_template('add_item.html')
 
 @app.route('/upload_csv', methods=('GET', 'POST'))
 @login_required
 def upload_csv():
     if request.method == 'POST':
-        if 'file' not in request.files:
-            flash('No file selected')
-            return redirect(url_for('upload_csv'))
-        
-        file = request.files['file']
-        if file.filename == '':
-            flash('No file selected')
-            return redirect(url_for('upload_csv'))
-        
-        if file and file.filename.endswith('.csv'):
-            stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-            csv_data = csv.reader(stream)
-            
-            conn = get_db_connection()
-            success_count = 0
-            error_count = 0
-            
-            for row in csv_data:
-                try:
-                    name, quantity, category, sector, application, *_ = row
-                    conn.execute('''
-                        INSERT INTO inventory (name, quantity, category, sector, application, user_id)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (name.strip(), int(quantity), category.strip(), 
-                         sector.strip(), application.strip(), session['user_id']))
-                    success_count += 1
-                except Exception as e:
-                    error_count += 1
-                    continue
-            
-            conn.commit()
-            conn.close()
-            
-            flash(f'Successfully imported {success_count} items. {error_count} items failed.')
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Please upload a CSV file')
-            return redirect(url_for('upload_csv'))
-            
+        return run_view(views.upload_csv, request.files.get('file'), request.form.get('mode'),
+                        request.accept_mimetypes.best, app.config['IMPORT_CHUNK_SIZE'])
     return render_template('upload_csv.html')
 
 @app.route('/update_quantity/<int:item_id>', methods=['PUT'])
 @login_required
 def update_quantity(item_id):
-    try:
-        quantity = int(request.form.get('value', 0))
-        if quantity < 0:
-            return 'Quantity cannot be negative', 400
-
-        conn = get_db_connection()
-        # Verify the item belongs to the current user
-        item = conn.execute('SELECT * FROM inventory WHERE id = ? AND user_id = ?', 
-                          (item_id, session['user_id'])).fetchone()
-        
-        if not item:
-            conn.close()
-            return 'Item not found', 404
-
-        conn.execute('UPDATE inventory SET quantity = ? WHERE id = ? AND user_id = ?',
-                    (quantity, item_id, session['user_id']))
-        conn.commit()
-        conn.close()
-
-        return render_template('partials/inventory_row.html', 
-                             item={'id': item_id, 'quantity': quantity, 
-                                  'name': item['name'], 'category': item['category'],
-                                  'sector': item['sector'], 'application': item['application'],
-                                  'date_added': item['date_added']})
-    except ValueError:
-        return 'Invalid quantity value', 400
-    except Exception as e:
-        return str(e), 500
+    return run_view(views.update_quantity, item_id, request.form.get('value', 0))
 
 @app.route('/delete_item/<int:item_id>', methods=['DELETE'])
 @login_required
 def delete_item(item_id):
-    try:
-        conn = get_db_connection()
-        # Verify the item belongs to the current user
-        result = conn.execute('DELETE FROM inventory WHERE id = ? AND user_id = ?',
-                            (item_id, session['user_id']))
-        conn.commit()
-        conn.close()
+    return run_view(views.delete_item, item_id)
 
-        if result.rowcount == 0:
-            return 'Item not found', 404
+@app.route('/inventory/bulk', methods=['POST'])
+@login_required
+def bulk_update():
+    try:
+        ids, operations = views.bulk_request(request.get_json(silent=True), request.form)
+    except (AttributeError, TypeError, ValueError) as e:
+        return str(e), 400
+    return run_view(views.bulk_update, ids, operations, request.accept_mimetypes.best)
 
-        return '', 204
-    except Exception as e:
-        return str(e), 500
+@app.route('/export/<any(inventory, crawls):kind>')
+@login_required
+def export(kind):
+    # Rows are streamed a batch at a time; the pooled connection stays checked out
+    # until the generator finishes and the app context is torn down
+    try:
+        options = exporter.parse_export_args(kind, request.args)
+    except ValueError as e:
+        return str(e), 400
+    chunks = exporter.export_chunks(get_db_connection(), kind, session['user_id'],
+                                    batch_size=app.config['EXPORT_BATCH_SIZE'], **options)
+    filename = exporter.export_filename(kind, options['fmt'], options['compress'])
+    return app.response_class(stream_with_context(chunks),
+                              content_type=exporter.content_type(options['fmt'], options['compress']),
+                              headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/crawl', methods=['GET', 'POST'])
 @login_required
 def crawl_website():
     if request.method == 'POST':
-        url = request.form['url']
-        try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            async def perform_crawl():
-                async with AsyncWebCrawler(
-                    verbose=True,
-                    timeout=30,
-                    wait_for_selector='.article-content',
-                    wait_time=2,
-                    browser_type='chromium',
-                    headless=True,
-                    javascript_enabled=True,
-                    ignore_https_errors=True,
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                    html2text={
-                        "escape_dot": False,
-                        "body_width": 0,
-                        "protect_links": True,
-                        "unicode_snob": True
-                    }
-                ) as crawler:
-                    result = await crawler.arun(
-                        url=url,
-                        word_count_threshold=10,        # Minimum words per block
-                        exclude_external_links=True,    # Remove external links
-                        exclude_external_images=True,   # Remove external images
-                        excluded_tags=['form', 'nav'],  # Remove specific HTML tags
-                        include_links_on_markdown=True  # Include links in markdown
-                    )
-                    
-                    # Debug print of all available formats
-                    print("\n=== Crawl Results ===")
-                    print(f"URL: {result.url}")
-                    print(f"Status Code: {result.status_code}")
-                    
-                    print("\n=== Raw HTML (first 200 chars) ===")
-                    print(result.html[:200] if result.html else "No HTML content")
-                    
-                    print("\n=== Cleaned HTML (first 200 chars) ===")
-                    print(result.cleaned_html[:200] if hasattr(result, 'cleaned_html') else "No cleaned HTML")
-                    
-                    print("\n=== Standard Markdown (first 200 chars) ===")
-                    print(result.markdown[:200] if result.markdown else "No markdown content")
-                    
-                    print("\n=== Fit Markdown (most relevant content, first 200 chars) ===")
-                    print(result.fit_markdown[:200] if hasattr(result, 'fit_markdown') else "No fit markdown")
-                    
-                    print("\nFirst 5 links:")
-                    print(list(result.links)[:5] if result.links else "No links found")
-                    
-                    print("\nHeaders:")
-                    print(dict(result.headers) if hasattr(result, 'headers') else "No headers")
-                    print("===================\n")
-                    
-                    return result
-            
-            result = loop.run_until_complete(perform_crawl())
-            loop.close()
-            
-            # Store all available formats
-            crawl_data = {
-                'url': url,
-                'html': result.html,                    # Original HTML
-                'cleaned_html': result.cleaned_html if hasattr(result, 'cleaned_html') else None,  # Sanitized HTML
-                'markdown': result.markdown,            # Standard markdown
-                'fit_markdown': result.fit_markdown if hasattr(result, 'fit_markdown') else None,  # Most relevant content
-                'links': list(result.links) if result.links else [],
-                'status_code': result.status_code if hasattr(result, 'status_code') else None,
-                'headers': dict(result.headers) if hasattr(result, 'headers') else {},
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO crawled_data (user_id, url, crawl_data, status)
-                VALUES (?, ?, ?, ?)
-            ''', (session['user_id'], url, json.dumps(crawl_data), 'completed'))
-            conn.commit()
-            conn.close()
-            
-            flash('Website crawled successfully!')
-            return redirect(url_for('crawl_history'))
-        except Exception as e:
-            print(f"\nError during crawl: {str(e)}\n")
-            flash(f'Error crawling website: {str(e)}')
-            return redirect(url_for('crawl_website'))
-            
+        return run_view(views.start_crawl, request.form, app.config)
     return render_template('crawl.html')
 
+@app.route('/crawl-batch/<int:batch_id>')
+@login_required
+@versioned('crawl_batch')
+def crawl_batch(batch_id):
+    return run_view(views.crawl_batch, batch_id, request.accept_mimetypes.best,
+                    request.headers.get('HX-Request'))
+
 @app.route('/crawl-history')
 @login_required
+@versioned('crawl_history')
 def crawl_history():
-    try:
-        conn = get_db_connection()
-        crawls = conn.execute('''
-            SELECT id, url, crawl_date, status, crawl_data
-            FROM crawled_data 
-            WHERE user_id = ? 
-            ORDER BY crawl_date DESC
-        ''', (session['user_id'],)).fetchall()
-        
-        # Convert rows to dictionaries
-        crawls_list = []
-        for crawl in crawls:
-            crawls_list.append({
-                'id': crawl['id'],
-                'url': crawl['url'],
-                'crawl_date': crawl['crawl_date'],
-                'status': crawl['status'],
-                'crawl_data': json.loads(crawl['crawl_data'])
-            })
-            
-        conn.close()
-        return render_template('crawl_history.html', crawls=crawls_list)
-    except Exception as e:
-        flash(f'Error loading crawl history: {str(e)}')
-        return redirect(url_for('dashboard'))
+    return run_view(views.crawl_history)
+
+@app.route('/events')
+@login_required
+def events():
+    """Server-sent row patches for the user's inventory and crawls (see change_feed.py)."""
+    user_id = session['user_id']
+    # A reconnect sends the last id it saw; a new stream starts from the one its page was rendered at
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    config = app.config
+
+    def stream():
+        # Borrow a pooled connection per poll; holding one for the whole stream
+        # would let a few open tabs exhaust the pool
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            start, reload = change_feed.resume(conn, user_id, last_id)
+        finally:
+            pool.release(conn)
+        if reload:
+            yield change_feed.sse_message('', event='reload', event_id=start)
+        yield change_feed.sse_message(retry=config['SSE_RETRY_MS'], event_id=start)
+
+        # Each open stream holds a server thread, so it is short (see SSE_WSGI_MAX_SECONDS)
+        deadline = time.monotonic() + config['SSE_WSGI_MAX_SECONDS']
+        quiet_since = time.monotonic()
+        while True:
+            conn = pool.acquire()
+            try:
+                start, patches = change_feed.poll(conn, user_id, start,
+                                                  max_patches=config['SSE_MAX_PATCHES'])
+                if patches is None:
+                    messages = [change_feed.sse_message('', event='reload', event_id=start)]
+                else:
+                    messages = [change_feed.sse_message(
+                        render_template('partials/live_patch.html', entity=entity, patches=rows),
+                        event=entity, event_id=start) for entity, rows in patches.items()]
+            finally:
+                pool.release(conn)
+            if messages:
+                yield ''.join(messages)
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= config['SSE_HEARTBEAT']:
+                # A comment line; writing it is how a closed connection is noticed
+                yield ': keepalive\n\n'
+                quiet_since = time.monotonic()
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(config['SSE_POLL_INTERVAL'])
+        # The browser reconnects after SSE_RETRY_MS and resumes from the last event id
+
+    return app.response_class(stream_with_context(stream()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/crawl-status/<int:crawl_id>')
+@login_required
+@versioned('crawl_status')
+def crawl_status(crawl_id):
+    return run_view(views.crawl_status, crawl_id)
 
 @app.route('/crawl-details/<int:crawl_id>')
 @login_required
+@versioned('crawl_details')
 def crawl_details(crawl_id):
-    conn = get_db_connection()
-    crawl = conn.execute('''
-        SELECT * FROM crawled_data 
-        WHERE id = ? AND user_id = ?
-    ''', (crawl_id, session['user_id'])).fetchone()
-    conn.close()
-    
-    if crawl is None:
-        flash('Crawl not found')
-        return redirect(url_for('crawl_history'))
-        
-    return render_template('crawl_details.html', crawl=crawl)
+    return run_view(views.crawl_details, crawl_id)
 
 if __name__ == '__main__':
-    from database import init_db
-    init_db()
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,555 @@
+"""ASGI serving mode.
+
+The same views (views.py), templates and queries as app.py, served from a Quart app:
+
+    hypercorn asgi:app --bind 0.0.0.0:8000
+
+Handlers are coroutines, so one process holds hundreds of slow connections
+without a thread each. sqlite3 calls run on a thread pool the size of the
+connection pool; list pages are streamed, their rows read a batch at a time on
+that pool while the template is sent. The crawl worker runs on the server's
+own event loop (set CRAWL_IN_PROCESS=False to keep using a separate
+crawl_worker.py). With MAINTENANCE_INTERVAL set, maintenance.py also runs on a
+timer.
+"""
+import asyncio
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from quart import (Quart, render_template, request, redirect, url_for, flash, session, jsonify,
+                   make_response, stream_template, stream_with_context)
+from quart.wrappers.response import IterableBody
+
+import change_feed
+import exporter
+import queries
+import views
+from config import Config
+from crawl_jobs import PENDING_STATUSES
+from crawl_worker import CrawlWorker
+from maintenance import run_maintenance
+from passwords import HasherBusy
+from page_cache import data_version, make_etag, tee_body_async
+from queries import RowStream
+from search import highlight
+
+app = Quart(__name__)
+app.config.from_object(Config)
+
+app.add_template_filter(json.loads, 'from_json')
+app.add_template_filter(highlight)
+app.jinja_env.globals['pending_crawl_statuses'] = PENDING_STATUSES
+
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            await flash('Please log in first.')
+            return redirect(url_for('login'))
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def get_pool():
+    return views.get_pool(app)
+
+
+def get_hasher():
+    return views.get_hasher(app)
+
+
+def get_executor():
+    # One thread per pooled connection, so a thread never waits on the pool
+    executor = app.extensions.get('db_executor')
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=app.config['DB_POOL_SIZE'],
+                                      thread_name_prefix='db')
+        app.extensions['db_executor'] = executor
+    return executor
+
+
+async def run_db(func, *args, **kwargs):
+    """Run func(conn, *args, **kwargs) on a pooled connection off the event loop."""
+    def call():
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            return func(conn, *args, **kwargs)
+        finally:
+            pool.release(conn)
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+
+@app.errorhandler(HasherBusy)
+async def hasher_busy(e):
+    app.logger.warning('Password hashing saturated: %s', e)
+    return views.HASHER_BUSY
+
+
+class AsyncRows:
+    """A RowStream a template iterates with async for, reading rows on the DB executor."""
+
+    batch_size = 100
+
+    def __init__(self, rows, executor):
+        self._rows = rows
+        self._executor = executor
+
+    def __bool__(self):
+        # stream_page peeks at the first row before rendering starts
+        return bool(self._rows)
+
+    @property
+    def next_cursor(self):
+        return self._rows.next_cursor
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        rows = iter(self._rows)
+        try:
+            while True:
+                batch = await loop.run_in_executor(self._executor, list,
+                                                   itertools.islice(rows, self.batch_size))
+                for row in batch:
+                    yield row
+                if len(batch) < self.batch_size:
+                    break
+        finally:
+            rows.close()
+
+
+class PageBody:
+    """Body of a streamed page; gives the connection back once sent, closed or dropped."""
+
+    def __init__(self, chunks, release, size):
+        self._chunks = chunks
+        self._release = release
+        self._size = size
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # Jinja yields a string per template node; send them in larger pieces
+        buffer, length = [], 0
+        try:
+            while length < self._size:
+                chunk = await self._chunks.__anext__()
+                buffer.append(chunk)
+                length += len(chunk)
+        except StopAsyncIteration:
+            await self.aclose()
+            if not buffer:
+                raise
+        return ''.join(buffer)
+
+    async def aclose(self):
+        release, self._release = self._release, None
+        if release is not None:
+            try:
+                await self._chunks.aclose()
+            finally:
+                release()
+
+    def __del__(self):
+        # A client that disconnects before the body starts never closes it
+        if self._release is not None:
+            self._release()
+
+
+async def stream_page(page, conn, pool):
+    """Start sending page; the connection is released when the body ends."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    context = {}
+    for name, value in page.context.items():
+        if isinstance(value, RowStream):
+            # Peek at the first row now, so "{% if items %}" does no I/O on the loop
+            await loop.run_in_executor(executor, bool, value)
+            value = AsyncRows(value, executor)
+        context[name] = value
+    chunks = await stream_template(page.template, **context)
+    body = PageBody(chunks, partial(pool.release, conn), app.config['STREAM_CHUNK_SIZE'])
+    response = app.response_class(body, mimetype='text/html')
+    response.headers.update(page.headers)
+    return response
+
+
+async def respond(result):
+    """Turn a views.py result into a response."""
+    if isinstance(result, views.Redirect):
+        if result.message:
+            await flash(result.message)
+        return redirect(url_for(result.endpoint, **result.values))
+    if isinstance(result, views.Json):
+        return jsonify(result.data)
+    if isinstance(result, views.Reply):
+        return result.body, result.status, result.headers
+    if result.message:
+        await flash(result.message)
+    response = await make_response(await render_template(result.template, **result.context))
+    response.headers.update(result.headers)
+    return response
+
+
+async def run_view(view, *args):
+    """Run a views.py view on a pooled connection off the event loop and respond."""
+    user_id = session['user_id']
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    pool = await loop.run_in_executor(executor, get_pool)
+    conn = await loop.run_in_executor(executor, pool.acquire)
+    try:
+        result = await loop.run_in_executor(executor, partial(view, conn, user_id, *args))
+        if isinstance(result, views.Page) and result.stream:
+            if not result.message and not session.get('_flashes'):
+                response = await stream_page(result, conn, pool)
+                conn = None  # the body releases it
+                return response
+            # The session cookie goes out before a streamed body, so flashes need a full render
+            await loop.run_in_executor(executor, result.load)
+    finally:
+        if conn is not None:
+            pool.release(conn)
+    return await respond(result)
+
+
+def versioned(view):
+    """Answer 304 or replay a cached render until the user's data version moves."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            if session.get('_flashes'):
+                return await f(*args, **kwargs)
+            user_id = session['user_id']
+            key = views.page_key(app, request, user_id, view, await run_db(data_version, user_id))
+            etag = make_etag(key)
+            if request.if_none_match.contains(etag):
+                response = app.response_class('', status=304)
+            else:
+                cache = app.extensions['fragment_cache']
+                cached = cache.get(key)
+                if cached is None:
+                    response = await make_response(await f(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if isinstance(response.response, IterableBody):
+                        # Keep streaming; the body is cached once sent, if it was small enough
+                        mimetype = response.mimetype
+                        response.response = IterableBody(tee_body_async(
+                            response.response.__aiter__(), lambda body: cache.put(key, (body, mimetype)),
+                            app.config['FRAGMENT_CACHE_MAX_BYTES']))
+                        response.set_etag(etag)
+                        response.headers['Cache-Control'] = 'private, no-cache'
+                        return response
+                    cached = (await response.get_data(), response.mimetype)
+                    cache.put(key, cached)
+                response = app.response_class(cached[0], mimetype=cached[1])
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+
+@app.before_serving
+async def start_crawl_worker():
+    if not app.config['CRAWL_IN_PROCESS']:
+        return
+    await run_db(lambda conn: None)  # migrate before the worker opens its own pool
+    worker = CrawlWorker(app.config['DATABASE'],
+                         concurrency=app.config['CRAWL_CONCURRENCY'],
+                         per_host=app.config['CRAWL_PER_HOST'],
+                         host_delay=app.config['CRAWL_HOST_DELAY'],
+                         fetch=app.config.get('CRAWL_FETCH'))
+    app.extensions['crawl_worker'] = worker
+    app.extensions['crawl_worker_task'] = asyncio.ensure_future(worker.run())
+
+
+async def run_maintenance_every(interval):
+    maintain = partial(run_maintenance, app.config['DATABASE'],
+                       keep_per_url=app.config['RETENTION_KEEP_PER_URL'],
+                       strip_html_days=app.config['RETENTION_STRIP_HTML_DAYS'],
+                       backup_dir=app.config['BACKUP_DIR'],
+                       backup_keep=app.config['BACKUP_KEEP'],
+                       feed_retention_hours=app.config['CHANGE_FEED_RETENTION_HOURS'])
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The default executor, so a long backup never holds a request's DB thread
+            await loop.run_in_executor(None, maintain)
+        except Exception:
+            app.logger.exception('scheduled maintenance failed')
+
+
+@app.before_serving
+async def start_maintenance():
+    if app.config['MAINTENANCE_INTERVAL'] > 0:
+        app.extensions['maintenance_task'] = asyncio.ensure_future(
+            run_maintenance_every(app.config['MAINTENANCE_INTERVAL']))
+
+
+@app.after_serving
+async def shutdown():
+    hasher = app.extensions.pop('password_hasher', None)
+    if hasher is not None:
+        hasher.close()
+    task = app.extensions.pop('maintenance_task', None)
+    if task is not None:
+        task.cancel()
+    worker = app.extensions.pop('crawl_worker', None)
+    if worker is not None:
+        worker.stop()
+        await app.extensions.pop('crawl_worker_task')
+    executor = app.extensions.pop('db_executor', None)
+    if executor is not None:
+        executor.shutdown()
+    pool = app.extensions.pop('db_pool', None)
+    if pool is not None:
+        pool.close()
+
+
+@app.route('/')
+async def landing():
+    if 'user_id' in session:
+        return redirect(url_for('dashboard'))
+    return await render_template('landing.html')
+
+
+@app.route('/dashboard')
+@login_required
+@versioned('dashboard')
+async def dashboard():
+    return await run_view(views.dashboard, request.args, app.config['INVENTORY_PAGE_SIZE'])
+
+
+@app.route('/inventory/rows')
+@login_required
+@versioned('inventory_rows')
+async def inventory_rows():
+    return await run_view(views.inventory_rows, request.args, app.config['INVENTORY_PAGE_SIZE'])
+
+
+@app.route('/inventory/summary')
+@login_required
+@versioned('inventory_summary')
+async def inventory_summary():
+    return await run_view(views.inventory_summary, request.accept_mimetypes.best)
+
+
+@app.route('/search')
+@login_required
+async def search():
+    return await run_view(views.search, request.args, request.headers.get('HX-Request'),
+                          app.config['SEARCH_PAGE_SIZE'])
+
+
+@app.route('/login', methods=['GET', 'POST'])
+async def login():
+    if request.method == 'POST':
+        form = await request.form
+        user = await run_db(queries.get_user_by_username, form['username'])
+
+        matches, new_hash = (await get_hasher().verify_async(user['password'], form['password'])
+                             if user else (False, None))
+        if matches:
+            if new_hash:
+                await run_db(queries.update_password_hash, user['id'], new_hash)
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            await flash('Welcome back!')
+            return redirect(url_for('dashboard'))
+
+        await flash('Invalid username or password')
+    return await render_template('login.html')
+
+
+@app.route('/register', methods=['GET', 'POST'])
+async def register():
+    if request.method == 'POST':
+        form = await request.form
+        username = form['username']
+
+        if await run_db(queries.get_user_by_username, username):
+            await flash('Username already exists')
+            return redirect(url_for('register'))
+
+        hashed_password = await get_hasher().hash_async(form['password'])
+        await run_db(queries.create_user, username, hashed_password, form['email'])
+        await flash('Registration successful! Please log in.')
+        return redirect(url_for('login'))
+    return await render_template('register.html')
+
+
+@app.route('/logout')
+async def logout():
+    session.clear()
+    await flash('You have been logged out.')
+    return redirect(url_for('landing'))
+
+
+@app.route('/add', methods=('GET', 'POST'))
+@login_required
+async def add_item():
+    if request.method == 'POST':
+        return await run_view(views.add_item, await request.form)
+    return await render_template('add_item.html')
+
+
+@app.route('/upload_csv', methods=('GET', 'POST'))
+@login_required
+async def upload_csv():
+    if request.method == 'POST':
+        files = await request.files
+        form = await request.form
+        return await run_view(views.upload_csv, files.get('file'), form.get('mode'),
+                              request.accept_mimetypes.best, app.config['IMPORT_CHUNK_SIZE'])
+    return await render_template('upload_csv.html')
+
+
+@app.route('/update_quantity/<int:item_id>', methods=['PUT'])
+@login_required
+async def update_quantity(item_id):
+    form = await request.form
+    return await run_view(views.update_quantity, item_id, form.get('value', 0))
+
+
+@app.route('/delete_item/<int:item_id>', methods=['DELETE'])
+@login_required
+async def delete_item(item_id):
+    return await run_view(views.delete_item, item_id)
+
+
+@app.route('/inventory/bulk', methods=['POST'])
+@login_required
+async def bulk_update():
+    try:
+        ids, operations = views.bulk_request(await request.get_json(silent=True), await request.form)
+    except (AttributeError, TypeError, ValueError) as e:
+        return str(e), 400
+    return await run_view(views.bulk_update, ids, operations, request.accept_mimetypes.best)
+
+
+@app.route('/export/<any(inventory, crawls):kind>')
+@login_required
+async def export(kind):
+    try:
+        options = exporter.parse_export_args(kind, request.args)
+    except ValueError as e:
+        return str(e), 400
+    user_id = session['user_id']
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+
+    async def stream():
+        # One connection for the whole export; each batch is fetched and encoded on a
+        # DB thread so the event loop only ever sees finished chunks
+        loop = asyncio.get_running_loop()
+        executor = get_executor()
+        pool = await loop.run_in_executor(executor, get_pool)
+        conn = await loop.run_in_executor(executor, pool.acquire)
+        chunks = exporter.export_chunks(conn, kind, user_id, batch_size=batch_size, **options)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Also reached when the client disconnects mid-download
+            chunks.close()
+            pool.release(conn)
+
+    filename = exporter.export_filename(kind, options['fmt'], options['compress'])
+    return app.response_class(stream(),
+                              content_type=exporter.content_type(options['fmt'], options['compress']),
+                              headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+@app.route('/crawl', methods=['GET', 'POST'])
+@login_required
+async def crawl_website():
+    if request.method == 'POST':
+        return await run_view(views.start_crawl, await request.form, app.config)
+    return await render_template('crawl.html')
+
+
+@app.route('/crawl-batch/<int:batch_id>')
+@login_required
+@versioned('crawl_batch')
+async def crawl_batch(batch_id):
+    return await run_view(views.crawl_batch, batch_id, request.accept_mimetypes.best,
+                          request.headers.get('HX-Request'))
+
+
+@app.route('/crawl-history')
+@login_required
+@versioned('crawl_history')
+async def crawl_history():
+    return await run_view(views.crawl_history)
+
+
+@app.route('/events')
+@login_required
+async def events():
+    """Server-sent row patches for the user's inventory and crawls (see change_feed.py)."""
+    user_id = session['user_id']
+    # A reconnect sends the last id it saw; a new stream starts from the one its page was rendered at
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    config = app.config
+
+    @stream_with_context
+    async def stream():
+        start, reload = await run_db(change_feed.resume, user_id, last_id)
+        if reload:
+            yield change_feed.sse_message('', event='reload', event_id=start)
+        yield change_feed.sse_message(retry=config['SSE_RETRY_MS'], event_id=start)
+
+        deadline = time.monotonic() + config['SSE_MAX_SECONDS']
+        quiet_since = time.monotonic()
+        while time.monotonic() < deadline:
+            start, patches = await run_db(change_feed.poll, user_id, start,
+                                          max_patches=config['SSE_MAX_PATCHES'])
+            if patches is None:
+                messages = [change_feed.sse_message('', event='reload', event_id=start)]
+            else:
+                messages = [change_feed.sse_message(
+                    await render_template('partials/live_patch.html', entity=entity, patches=rows),
+                    event=entity, event_id=start) for entity, rows in patches.items()]
+            if messages:
+                yield ''.join(messages)
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= config['SSE_HEARTBEAT']:
+                yield ': keepalive\n\n'
+                quiet_since = time.monotonic()
+            await asyncio.sleep(config['SSE_POLL_INTERVAL'])
+
+    response = await make_response(stream(), {'Content-Type': 'text/event-stream',
+                                              'Cache-Control': 'no-cache',
+                                              'X-Accel-Buffering': 'no'})
+    response.timeout = None  # the stream ends itself after SSE_MAX_SECONDS
+    return response
+
+
+@app.route('/crawl-status/<int:crawl_id>')
+@login_required
+@versioned('crawl_status')
+async def crawl_status(crawl_id):
+    return await run_view(views.crawl_status, crawl_id)
+
+
+@app.route('/crawl-details/<int:crawl_id>')
+@login_required
+@versioned('crawl_details')
+async def crawl_details(crawl_id):
+    return await run_view(views.crawl_details, crawl_id)
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
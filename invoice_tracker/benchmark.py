@@ -0,0 +1,394 @@
+"""Seeded load test for the inventory tracker.
+
+    python benchmark.py --users 20 --items 2000 --crawls 50 --requests 500 \\
+        --driver client --driver server --output bench.json
+    python benchmark.py ... --compare bench-main.json   # exit 1 on regressions
+
+Seeds a throwaway database (items are variations on data_bulk.csv), then runs
+each scenario through the Flask test client and/or a threaded WSGI server
+and reports p50/p95/p99 latency, requests per second and memory.
+
+dashboard and scroll are mostly answered from the fragment cache; their
+_cold variants bump the user's data version before every request, so each
+one runs its queries and renders its template.
+"""
+import argparse
+import csv
+import http.cookiejar
+import io
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import crawl_jobs
+from config import Config
+from database import init_db
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_CSV = os.path.join(HERE, 'data_bulk.csv')
+PASSWORD = 'benchmark'
+SCENARIOS = ('dashboard', 'dashboard_cold', 'scroll', 'scroll_cold', 'update', 'bulk_import', 'crawl_history')
+DRIVERS = ('client', 'server')
+# Metrics compared by --compare, and whether bigger is worse
+COMPARED_METRICS = {'p50_ms': True, 'p95_ms': True, 'p99_ms': True, 'rps': False}
+
+
+def load_template(path=TEMPLATE_CSV):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [row[:5] for row in csv.reader(f) if row]
+
+
+def generate_items(template, count, rng, start=datetime(2024, 1, 1)):
+    """Yield (name, quantity, category, sector, application, date_added) rows."""
+    for i in range(count):
+        name, _, category, sector, application = template[i % len(template)]
+        date_added = start + timedelta(minutes=rng.randrange(525600))
+        yield (f'{name} #{i}', rng.randrange(500), category, sector, application,
+               date_added.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def seed_database(path, users=10, items=1000, crawls=20, seed=0, template_path=TEMPLATE_CSV):
+    """Create users bench0..benchN-1, each with `items` items and `crawls` crawl records."""
+    rng = random.Random(seed)
+    template = load_template(template_path)
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        # Hashed once, it is deliberately slow; the app's method so logins skip the rehash
+        password_hash = generate_password_hash(PASSWORD, Config.PASSWORD_HASH_METHOD)
+        for n in range(users):
+            user_id = conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                                   (f'bench{n}', password_hash, f'bench{n}@example.com')).lastrowid
+            with conn:
+                conn.executemany('''
+                    INSERT INTO inventory (name, quantity, category, sector, application, date_added, user_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (row + (user_id,) for row in generate_items(template, items, rng)))
+            for c in range(crawls):
+                url = f'https://example.test/{n}/page-{c}'
+                job_id = crawl_jobs.enqueue_crawl(conn, user_id, url)
+                markdown = '\n'.join(f'- {row[0]}: {row[4]}' for row in rng.sample(template, len(template)))
+                crawl_jobs.complete_job(conn, job_id, {
+                    'url': url, 'html': f'<html><body>{markdown}</body></html>',
+                    'markdown': markdown, 'links': [url + '/next'], 'status_code': 200,
+                    'headers': {'ETag': f'"{n}-{c}"'},
+                })
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+
+
+def import_payload(template, rows, rng):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(generate_items(template, rows, rng))
+    return buffer.getvalue().encode('utf-8')
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def peak_rss_kb():
+    """The process's resident set high-water mark so far, not this scenario's."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == 'Darwin' else peak  # macOS reports bytes
+
+
+def summarize(latencies, errors, elapsed, rss_before=None):
+    """Latency percentiles and throughput of one run.
+
+    ru_maxrss only ever grows, so memory is reported as the process peak
+    after the run plus how far this run raised it (0 when an earlier
+    scenario had already used more).
+    """
+    ordered = sorted(latencies)
+    peak = peak_rss_kb()
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': ms(percentile(ordered, 50)),
+        'p95_ms': ms(percentile(ordered, 95)),
+        'p99_ms': ms(percentile(ordered, 99)),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'process_peak_rss_kb': peak,
+        'peak_rss_growth_kb': peak - rss_before if peak is not None and rss_before is not None else None,
+    }
+
+
+def bump_data_version(database, user_id):
+    # Moves the user's fragment cache keys and ETags on, as any write would
+    conn = sqlite3.connect(database)
+    try:
+        with conn:
+            conn.execute('''
+                INSERT INTO user_data_versions (user_id, version) VALUES (?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+            ''', (user_id,))
+    finally:
+        conn.close()
+
+
+class Scenario:
+    """Builds the requests for one scenario: (method, path, body, headers) tuples."""
+
+    def __init__(self, name, conn, users, rng, import_rows=200, database=None):
+        self.name = name
+        self.database = database
+        self.rng = rng
+        self.template = load_template()
+        self.import_rows = import_rows
+        self.usernames = dict(conn.execute('SELECT id, username FROM users'))
+        self.item_ids = {}
+        self.cursors = {}
+        for user_id in users:
+            self.item_ids[user_id] = [row[0] for row in conn.execute(
+                'SELECT id FROM inventory WHERE user_id = ?', (user_id,))]
+            # A mid-table cursor so scrolling exercises the keyset range scan
+            self.cursors[user_id] = conn.execute('''
+                SELECT date_added, id FROM inventory WHERE user_id = ?
+                ORDER BY date_added DESC, id DESC LIMIT 1 OFFSET ?
+            ''', (user_id, len(self.item_ids[user_id]) // 2)).fetchone()
+
+    def request(self, user_id):
+        # Called before each request is timed
+        if self.name.endswith('_cold'):
+            bump_data_version(self.database, user_id)
+        name = self.name[:-len('_cold')] if self.name.endswith('_cold') else self.name
+        if name == 'dashboard':
+            return 'GET', '/dashboard', None, {}
+        if name == 'scroll':
+            cursor = self.cursors[user_id]
+            query = urllib.parse.urlencode({'cursor_date': cursor[0], 'cursor_id': cursor[1]}) if cursor else ''
+            return 'GET', f'/inventory/rows?{query}', None, {'HX-Request': 'true'}
+        if name == 'update':
+            item_id = self.rng.choice(self.item_ids[user_id])
+            return ('PUT', f'/update_quantity/{item_id}', {'value': str(self.rng.randrange(500))},
+                    {'HX-Request': 'true'})
+        if name == 'bulk_import':
+            payload = import_payload(self.template, self.import_rows, self.rng)
+            return 'POST', '/upload_csv', {'file': payload}, {'Accept': 'application/json'}
+        if name == 'crawl_history':
+            return 'GET', '/crawl-history', None, {}
+        raise ValueError(f'unknown scenario {self.name!r}')
+
+
+def run_client(app, scenario, users, requests):
+    """Drive the Flask test client from this thread."""
+    clients = {}
+    for user_id in users:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        clients[user_id] = client
+
+    latencies, errors = [], 0
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    for i in range(requests):
+        user_id = users[i % len(users)]
+        method, path, body, headers = scenario.request(user_id)
+        if body and 'file' in body:
+            body = {'file': (io.BytesIO(body['file']), 'bench.csv')}
+        t0 = time.perf_counter()
+        response = clients[user_id].open(path, method=method, data=body, headers=headers)
+        # Streamed pages are only rendered as the body is read
+        response.get_data()
+        response.close()
+        latencies.append(time.perf_counter() - t0)
+        errors += response.status_code >= 400
+    return summarize(latencies, errors, time.perf_counter() - started, rss_before)
+
+
+def _encode_body(body):
+    if body is None:
+        return None, {}
+    if 'file' in body:
+        boundary = 'benchmarkboundary'
+        data = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.csv"\r\n'
+                f'Content-Type: text/csv\r\n\r\n').encode() + body['file'] + f'\r\n--{boundary}--\r\n'.encode()
+        return data, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    return urllib.parse.urlencode(body).encode(), {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_server(app, scenario, users, requests, concurrency=8):
+    """Drive a threaded WSGI server over real sockets with `concurrency` client threads."""
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    base = f'http://127.0.0.1:{server.server_port}'
+    serving = threading.Thread(target=server.serve_forever, daemon=True)
+    serving.start()
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client(worker):
+        user_id = users[worker % len(users)]
+        try:
+            opener = urllib.request.build_opener(
+                urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            opener.open(base + '/login', urllib.parse.urlencode(
+                {'username': scenario.usernames[user_id], 'password': PASSWORD}).encode()).read()
+            for _ in counter:
+                method, path, body, headers = scenario.request(user_id)
+                data, extra_headers = _encode_body(body)
+                req = urllib.request.Request(base + path, data=data, method=method,
+                                             headers=dict(headers, **extra_headers))
+                t0 = time.perf_counter()
+                try:
+                    opener.open(req).read()
+                    failed = False
+                except Exception:
+                    # HTTP errors, refused or reset connections and timeouts all count
+                    failed = True
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += failed
+        except Exception:
+            # A failed login or request setup stops this client; count it rather than lose it
+            with lock:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(concurrency)]
+    rss_before = peak_rss_kb()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+    return summarize(latencies, errors[0], elapsed, rss_before)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(database, scenarios=SCENARIOS, drivers=('client',), requests=200,
+                   concurrency=8, seed=0):
+    """Run every scenario with every driver against an already seeded database."""
+    from app import app  # imported late so DATABASE can point at the seeded copy
+
+    app.config.update(DATABASE=database, TESTING=False)
+    conn = sqlite3.connect(database)
+    try:
+        users = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+        rng = random.Random(seed)
+        results = {}
+        for name in scenarios:
+            scenario = Scenario(name, conn, users, rng, database=database)
+            for driver in drivers:
+                run = run_client if driver == 'client' else run_server
+                kwargs = {'concurrency': concurrency} if driver == 'server' else {}
+                results[f'{name}/{driver}'] = run(app, scenario, users, requests, **kwargs)
+    finally:
+        conn.close()
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return (key, metric, baseline, current) for metrics worse than baseline by > threshold."""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric, bigger_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old if bigger_is_worse else (old - new) / old
+            if change > threshold:
+                regressions.append((key, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database and load test the inventory tracker.')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--items', type=int, default=1000, help='items per user')
+    parser.add_argument('--crawls', type=int, default=20, help='crawl records per user')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and driver')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for the server driver')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios')
+    parser.add_argument('--driver', action='append', choices=DRIVERS, dest='drivers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='inventory-bench-')
+    database = os.path.join(workdir, 'bench.db')
+    t0 = time.perf_counter()
+    seed_database(database, args.users, args.items, args.crawls, args.seed)
+    seed_seconds = time.perf_counter() - t0
+
+    results = run_benchmarks(database, args.scenarios or SCENARIOS, args.drivers or ('client',),
+                             args.requests, args.concurrency, args.seed)
+    report = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'params': {key: getattr(args, key) for key in ('users', 'items', 'crawls', 'requests',
+                                                      'concurrency', 'seed')},
+        'seed_seconds': round(seed_seconds, 2),
+        'results': results,
+    }
+
+    for key, metrics in results.items():
+        print(f"{key:28} p50 {metrics['p50_ms']:>8} ms  p95 {metrics['p95_ms']:>8} ms  "
+              f"p99 {metrics['p99_ms']:>8} ms  {metrics['rps']:>8} req/s  errors {metrics['errors']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for key, metric, old, new in regressions:
+            print(f'REGRESSION {key} {metric}: {old} -> {new}')
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
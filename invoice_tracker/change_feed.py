@@ -0,0 +1,115 @@
+# Row-level change feed behind the /events server-sent events stream.
+#
+# Triggers (migration 12) append one change_feed row per inventory or crawl
+# write, whichever process made it, so the crawl worker's completions reach
+# the browser as well. Each open stream polls for rows past the last id it
+# sent, coalesces them per entity row and pushes rendered row patches; the
+# change_feed id doubles as the SSE event id, so a reconnecting EventSource
+# resumes from Last-Event-ID; a new one resumes from the id its page was
+# rendered at.
+import json
+
+ENTITIES = ('inventory', 'crawl')
+
+# Rows a patch is rendered from, restricted to one user
+PATCH_QUERIES = {
+    'inventory': 'SELECT * FROM inventory WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))',
+    'crawl': '''
+        SELECT id, url, crawl_date, status, error, cache_status, status_code, link_count, html_bytes
+        FROM crawled_data
+        WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))
+    ''',
+}
+
+
+def latest_change_id(conn, user_id):
+    row = conn.execute('SELECT MAX(id) FROM change_feed WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] or 0
+
+
+def missed_changes(conn, after_id):
+    """True if rows after after_id may already have been pruned."""
+    oldest = conn.execute('SELECT MIN(id) FROM change_feed').fetchone()[0]
+    return oldest is not None and oldest > after_id + 1
+
+
+def coalesce(changes):
+    """Return {(entity, entity_id): op}, one entry per row in first-seen order.
+
+    The last op wins, except that an update after an insert is still an insert,
+    so the client adds the row instead of looking for one to replace.
+    """
+    ops = {}
+    for _, entity, entity_id, op in changes:
+        key = (entity, entity_id)
+        if ops.get(key) == 'insert' and op == 'update':
+            continue
+        ops[key] = op
+    return ops
+
+
+def poll(conn, user_id, after_id, limit=500, max_patches=50):
+    """Return (last_id, patches) for the user's changes after after_id.
+
+    patches maps entity to a list of (op, entity_id, row) where row is None
+    once the row is gone. patches is None when more rows changed than are
+    worth patching one by one (a bulk import, say); the client reloads instead.
+    """
+    changes = conn.execute('''
+        SELECT id, entity, entity_id, op FROM change_feed
+        WHERE user_id = ? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (user_id, after_id, limit)).fetchall()
+    if not changes:
+        return after_id, {}
+    if len(changes) == limit:
+        return latest_change_id(conn, user_id), None
+    ops = coalesce(changes)
+    if len(ops) > max_patches:
+        return changes[-1][0], None
+
+    patches = {}
+    for entity in ENTITIES:
+        ids = [entity_id for kind, entity_id in ops if kind == entity]
+        if not ids:
+            continue
+        rows = {row['id']: row for row in conn.execute(PATCH_QUERIES[entity], (user_id, json.dumps(ids)))}
+        patches[entity] = [(ops[(entity, entity_id)], entity_id, rows.get(entity_id)) for entity_id in ids]
+    return changes[-1][0], patches
+
+
+def prune_change_feed(conn, max_age_hours):
+    """Delete feed rows older than max_age_hours (caller commits); returns how many."""
+    cursor = conn.execute("DELETE FROM change_feed WHERE changed_at < datetime('now', ?)",
+                          (f'-{int(max_age_hours)} hours',))
+    return cursor.rowcount
+
+
+def sse_message(data=None, event=None, event_id=None, retry=None):
+    """Format one server-sent event; data may span several lines."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    if retry is not None:
+        lines.append(f'retry: {int(retry)}')
+    if data is not None:
+        lines.extend(f'data: {line}' for line in data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+def resume(conn, user_id, last_id):
+    """Return (start_id, reload) for a stream resuming after change last_id.
+
+    last_id is the Last-Event-ID of a reconnect, or the change id the page
+    was rendered at (the ?after= of its sse-connect URL). Without either the
+    stream starts at the user's latest change. A client whose last id may
+    have been pruned since starts there too, and must reload first.
+    """
+    if last_id is None:
+        return latest_change_id(conn, user_id), False
+    if missed_changes(conn, last_id):
+        return latest_change_id(conn, user_id), True
+    return last_id, False
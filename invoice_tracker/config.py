@@ -0,0 +1,67 @@
+import os
+
+
+def optional_int(name, default):
+    """Read an integer setting from the environment; '' or 'off' means None (disabled)."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if value.strip().lower() in ('', 'off'):
+        return None
+    return int(value)
+
+
+class Config:
+    # Shared by the WSGI app (app.py) and the ASGI app (asgi.py)
+    SECRET_KEY = 'your_secret_key_here'  # Required for flashing messages and sessions
+    DATABASE = os.environ.get('INVENTORY_DB', 'inventory.db')
+    DB_POOL_SIZE = int(os.environ.get('INVENTORY_DB_POOL_SIZE', 8))
+    DB_POOL_TIMEOUT = 10.0
+    # Password hashing runs in a process pool (see passwords.py). Changing the
+    # method rehashes each user's password at their next login.
+    PASSWORD_HASH_METHOD = os.environ.get('INVENTORY_PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('INVENTORY_PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = 16  # hashes queued or running; more are answered with 503
+    PASSWORD_HASH_TIMEOUT = 10.0
+    IMPORT_CHUNK_SIZE = 1000
+    EXPORT_BATCH_SIZE = 1000
+    INVENTORY_PAGE_SIZE = 50
+    SEARCH_PAGE_SIZE = 20
+    CRAWL_CACHE_TTL = int(os.environ.get('INVENTORY_CRAWL_CACHE_TTL', 3600))  # seconds, 0 disables
+    CRAWL_BATCH_MAX_URLS = 1000  # per URL list or sitemap submitted to /crawl
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('INVENTORY_FRAGMENT_CACHE_SIZE', 256))  # rendered pages, 0 disables
+    # Part of every ETag and cached page key; unset, a digest of the modules and templates
+    BUILD_ID = os.environ.get('INVENTORY_BUILD_ID')
+    FRAGMENT_CACHE_MAX_BYTES = 256 * 1024  # streamed pages larger than this are not cached
+    STREAM_CHUNK_SIZE = 8192  # characters of streamed HTML gathered per write
+    # ASGI mode only: run the crawl worker on the server's event loop
+    CRAWL_IN_PROCESS = os.environ.get('INVENTORY_CRAWL_IN_PROCESS', '1') == '1'
+    CRAWL_CONCURRENCY = int(os.environ.get('INVENTORY_CRAWL_CONCURRENCY', 4))
+    CRAWL_PER_HOST = int(os.environ.get('INVENTORY_CRAWL_PER_HOST', 2))
+    CRAWL_HOST_DELAY = float(os.environ.get('INVENTORY_CRAWL_HOST_DELAY', 0.5))  # seconds
+    # Request timing, SQL fingerprints and /_debug/perf (see perf.py); off by default
+    PERF_IGNORE_ENDPOINTS = ('events',)  # long-lived streams would swamp the percentiles
+    PERF_ENABLED = os.environ.get('INVENTORY_PERF', '0') == '1'
+    PERF_HISTORY = 1000  # requests kept per endpoint and per statement fingerprint
+    PERF_PROFILE_THRESHOLD_MS = optional_int('INVENTORY_PERF_PROFILE_MS', 500)  # '' or 'off' disables sampling
+    PERF_PROFILE_DIR = os.environ.get('INVENTORY_PERF_PROFILE_DIR', 'perf_profiles')
+    PERF_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+    # Retention, compaction and backups (see maintenance.py)
+    RETENTION_KEEP_PER_URL = int(os.environ.get('INVENTORY_KEEP_PER_URL', 5))  # finished crawls per URL, 0 keeps all
+    RETENTION_STRIP_HTML_DAYS = int(os.environ.get('INVENTORY_STRIP_HTML_DAYS', 30))  # 0 keeps raw HTML
+    BACKUP_DIR = os.environ.get('INVENTORY_BACKUP_DIR', 'backups')
+    BACKUP_KEEP = 7
+    # ASGI mode only: seconds between in-process maintenance runs, 0 disables
+    MAINTENANCE_INTERVAL = float(os.environ.get('INVENTORY_MAINTENANCE_INTERVAL', 0))
+    CHANGE_FEED_RETENTION_HOURS = 24  # /events clients further behind than this reload
+    # Live updates over /events (see change_feed.py)
+    SSE_POLL_INTERVAL = 1.0  # seconds between change_feed reads per open stream
+    SSE_HEARTBEAT = 15  # seconds of silence before a keepalive comment
+    SSE_MAX_SECONDS = 300  # asgi.py streams end after this; the browser reconnects and resumes
+    # Under app.py an open stream holds a request thread (a threaded or gunicorn sync
+    # worker) for its whole length, so a few tabs would use up the pool. There a stream
+    # answers one poll and closes by default, and the browser polls every SSE_RETRY_MS.
+    # Raise this only with a worker per open tab to spare; asgi.py has no such limit.
+    SSE_WSGI_MAX_SECONDS = float(os.environ.get('INVENTORY_SSE_WSGI_MAX_SECONDS', 0))
+    SSE_RETRY_MS = 2000
+    SSE_MAX_PATCHES = 50  # more changed rows than this in one poll sends a reload instead
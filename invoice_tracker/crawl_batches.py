@@ -0,0 +1,91 @@
+# Turning batch crawl input (a pasted URL list or a sitemap.xml) into the
+# list of URLs queued by crawl_jobs. URL lists are parsed in the request;
+# sitemaps are network I/O, so the crawl worker reads them (read_sitemap).
+import http.client
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+import zlib
+from urllib.parse import urlsplit
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+# The sitemap protocol's own limit on one uncompressed file
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024
+# Everything fetching, decompressing or parsing a sitemap can raise
+SITEMAP_ERRORS = (OSError, ValueError, EOFError, zlib.error, http.client.HTTPException,
+                  ElementTree.ParseError)
+
+
+def is_http_url(url):
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and bool(parts.hostname)
+
+
+def parse_url_list(text):
+    """Return the http(s) URLs in text, one per line or whitespace separated, in order."""
+    return [token for token in text.split() if is_http_url(token)]
+
+
+def decompress(content, max_bytes=SITEMAP_MAX_BYTES):
+    """Gunzip content, refusing to produce more than max_bytes."""
+    data = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16).decompress(content, max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f'more than {max_bytes} bytes once decompressed')
+    return data
+
+
+def parse_sitemap(content, max_bytes=SITEMAP_MAX_BYTES):
+    """Return (page_urls, child_sitemap_urls) from a sitemap or sitemap index document."""
+    if content[:2] == b'\x1f\x8b':
+        content = decompress(content, max_bytes)
+    root = ElementTree.fromstring(content)
+    # Tolerate sitemaps written without the namespace
+    tag = root.tag.replace(SITEMAP_NS, '')
+    locs = [loc.text.strip() for loc in root.iter()
+            if loc.tag in (SITEMAP_NS + 'loc', 'loc') and loc.text and is_http_url(loc.text.strip())]
+    if tag == 'sitemapindex':
+        return [], locs
+    return locs, []
+
+
+def fetch(url, timeout, max_bytes=SITEMAP_MAX_BYTES):
+    request = urllib.request.Request(url, headers={'User-Agent': 'inventory-tracker-crawler'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        content = response.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ValueError(f'more than {max_bytes} bytes')
+    return content
+
+
+def sitemap_urls(url, limit=1000, timeout=10, max_depth=2, max_sitemaps=50,
+                 max_bytes=SITEMAP_MAX_BYTES, fetch=fetch):
+    """Collect up to limit page URLs from a sitemap, following sitemap indexes max_depth deep.
+
+    At most max_sitemaps documents are fetched, each capped at max_bytes
+    before and after decompression.
+    """
+    urls = []
+    pending = [(url, 0)]
+    seen = set()
+    while pending and len(urls) < limit and len(seen) < max_sitemaps:
+        sitemap, depth = pending.pop(0)
+        if sitemap in seen:
+            continue
+        seen.add(sitemap)
+        pages, children = parse_sitemap(fetch(sitemap, timeout, max_bytes), max_bytes)
+        urls.extend(pages[:limit - len(urls)])
+        if depth < max_depth:
+            pending.extend((child, depth + 1) for child in children)
+    return urls
+
+
+def read_sitemap(url, limit=1000, timeout=10, max_bytes=SITEMAP_MAX_BYTES):
+    """Return the page URLs listed by a sitemap, or raise ValueError with a message for the user."""
+    if not is_http_url(url):
+        raise ValueError(f'{url!r} is not an http(s) URL')
+    try:
+        urls = sitemap_urls(url, limit=limit, timeout=timeout, max_bytes=max_bytes)
+    except SITEMAP_ERRORS as e:
+        raise ValueError(f'could not read sitemap {url}: {e}') from e
+    if not urls:
+        raise ValueError(f'no http(s) URLs found in sitemap {url}')
+    return urls
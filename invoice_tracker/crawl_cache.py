@@ -0,0 +1,64 @@
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Canonical form used as the crawl cache key.
+
+    Lower-cases scheme and host, drops default ports and fragments, sorts
+    query parameters and gives bare hosts a '/' path.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    path = parts.path or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def latest_crawl(conn, user_id, normalized_url, max_age=None):
+    """The user's most recent completed crawl of a URL, optionally no older than max_age seconds.
+
+    Scoped per user: one account's crawls never answer, or reveal, another's.
+    """
+    params = [normalized_url, user_id]
+    freshness = ''
+    if max_age is not None:
+        freshness = "AND finished_at >= datetime('now', ?)"
+        params.append(f'-{int(max_age)} seconds')
+    return conn.execute(f'''
+        SELECT id, etag, last_modified, finished_at
+        FROM crawled_data
+        WHERE normalized_url = ? AND user_id = ? AND status = 'completed' AND content_hash IS NOT NULL
+          AND html_stripped_at IS NULL
+        {freshness}
+        ORDER BY finished_at DESC
+        LIMIT 1
+    ''', params).fetchone()
+
+
+def is_not_modified(url, etag=None, last_modified=None, timeout=10):
+    """Ask the origin whether a previously crawled page changed.
+
+    Sends a conditional GET with the stored validators; only a 304 counts as
+    unchanged. Any error is treated as "changed" so the caller re-crawls.
+    """
+    if not etag and not last_modified:
+        return False
+    request = urllib.request.Request(url, method='GET')
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status == 304
+    except urllib.error.HTTPError as e:
+        return e.code == 304
+    except (urllib.error.URLError, OSError, ValueError):
+        return False
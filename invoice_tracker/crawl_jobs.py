@@ -0,0 +1,289 @@
+from urllib.parse import urlsplit
+
+from crawl_cache import latest_crawl, normalize_url
+from crawl_store import copy_crawl_content, store_crawl_data
+
+# Rows in crawled_data double as crawl jobs. The status column moves
+# queued -> running -> completed | failed; the result itself is written by
+# crawl_store.store_crawl_data or shared from an earlier crawl of the same URL.
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+# crawl_batches rows move queued -> running -> ready | failed while the worker
+# reads a sitemap; URL-list batches start out ready
+READY = 'ready'
+PENDING_STATUSES = (QUEUED, RUNNING)
+
+
+def crawl_host(normalized_url):
+    # Politeness limits are applied per netloc (host plus any non-default port)
+    return urlsplit(normalized_url).netloc
+
+
+def _insert_job(conn, user_id, url, cache_ttl=None, batch_id=None):
+    normalized_url = normalize_url(url)
+    cursor = conn.execute('''
+        INSERT INTO crawled_data (user_id, url, normalized_url, host, batch_id, crawl_data, status)
+        VALUES (?, ?, ?, ?, ?, '{}', ?)
+    ''', (user_id, url, normalized_url, crawl_host(normalized_url), batch_id, QUEUED))
+    job_id = cursor.lastrowid
+
+    cached = latest_crawl(conn, user_id, normalized_url, max_age=cache_ttl) if cache_ttl else None
+    if cached is not None:
+        _complete_from(conn, job_id, cached['id'], 'hit')
+    return job_id
+
+
+def enqueue_crawl(conn, user_id, url, cache_ttl=None):
+    """Queue a crawl of url, or complete it at once from a crawl younger than cache_ttl seconds."""
+    job_id = _insert_job(conn, user_id, url, cache_ttl)
+    conn.commit()
+    return job_id
+
+
+def distinct_urls(urls):
+    """Drop URLs that normalize to the same key as an earlier one, keeping order."""
+    seen = set()
+    distinct = []
+    for url in urls:
+        key = normalize_url(url)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(url)
+    return distinct
+
+
+def enqueue_batch(conn, user_id, urls, source, cache_ttl=None):
+    """Queue one job per distinct URL under a new crawl_batches row, in one transaction.
+
+    Returns the batch id. URLs that normalize to the same key are queued once.
+    """
+    distinct = distinct_urls(urls)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        batch_id = conn.execute('INSERT INTO crawl_batches (user_id, source, total) VALUES (?, ?, ?)',
+                                (user_id, source, len(distinct))).lastrowid
+        for url in distinct:
+            _insert_job(conn, user_id, url, cache_ttl, batch_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return batch_id
+
+
+def enqueue_sitemap(conn, user_id, sitemap, max_urls, cache_ttl=None):
+    """Queue a batch whose pages the crawl worker reads from sitemap (see expand_batch).
+
+    Returns the batch id; the request that submits it does no network I/O.
+    """
+    batch_id = conn.execute('''
+        INSERT INTO crawl_batches (user_id, source, total, status, sitemap, max_urls, cache_ttl)
+        VALUES (?, ?, 0, ?, ?, ?, ?)
+    ''', (user_id, f'sitemap {sitemap}', QUEUED, sitemap, max_urls, cache_ttl)).lastrowid
+    conn.commit()
+    return batch_id
+
+
+def claim_sitemap_batch(conn):
+    """Atomically move the oldest queued sitemap batch to running and return it, or None."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        batch = conn.execute('''
+            SELECT id, user_id, sitemap, max_urls, cache_ttl FROM crawl_batches
+            WHERE status = ?
+            ORDER BY id
+            LIMIT 1
+        ''', (QUEUED,)).fetchone()
+        if batch is not None:
+            conn.execute('UPDATE crawl_batches SET status = ?, started_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (RUNNING, batch['id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return batch
+
+
+def expand_batch(conn, batch_id, urls):
+    """Queue the pages read from a claimed sitemap batch and mark it ready."""
+    distinct = distinct_urls(urls)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        batch = conn.execute('SELECT user_id, cache_ttl FROM crawl_batches WHERE id = ?',
+                             (batch_id,)).fetchone()
+        for url in distinct:
+            _insert_job(conn, batch['user_id'], url, batch['cache_ttl'], batch_id)
+        conn.execute('UPDATE crawl_batches SET status = ?, total = ?, error = NULL WHERE id = ?',
+                     (READY, len(distinct), batch_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def fail_batch(conn, batch_id, error):
+    conn.execute('UPDATE crawl_batches SET status = ?, error = ? WHERE id = ?', (FAILED, error, batch_id))
+    conn.commit()
+
+
+def claim_job(conn, exclude_hosts=()):
+    """Atomically move the oldest queued job to running and return it, or None.
+
+    Jobs for hosts in exclude_hosts are skipped, so a worker that is already at
+    its per-host limit can pick up work for other sites instead.
+    """
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+    # never select the same row
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        exclude_hosts = list(exclude_hosts)
+        host_filter = (f"AND (host IS NULL OR host NOT IN ({', '.join('?' * len(exclude_hosts))}))"
+                       if exclude_hosts else '')
+        job = conn.execute(f'''
+            SELECT id, user_id, url, normalized_url, host FROM crawled_data
+            WHERE status = ? {host_filter}
+            ORDER BY id
+            LIMIT 1
+        ''', [QUEUED] + exclude_hosts).fetchone()
+        if job is not None:
+            conn.execute('''
+                UPDATE crawled_data
+                SET status = ?, started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                WHERE id = ?
+            ''', (RUNNING, job['id']))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return job
+
+
+def complete_job(conn, job_id, crawl_data, commit=True):
+    store_crawl_data(conn, job_id, crawl_data)
+    conn.execute('''
+        UPDATE crawled_data
+        SET status = ?, finished_at = CURRENT_TIMESTAMP, error = NULL, cache_status = 'miss'
+        WHERE id = ?
+    ''', (COMPLETED, job_id))
+    if commit:
+        conn.commit()
+
+
+def _complete_from(conn, job_id, source_id, cache_status):
+    copy_crawl_content(conn, job_id, source_id)
+    conn.execute('''
+        UPDATE crawled_data
+        SET status = ?, finished_at = CURRENT_TIMESTAMP, error = NULL, cache_status = ?
+        WHERE id = ?
+    ''', (COMPLETED, cache_status, job_id))
+
+
+def complete_from_cache(conn, job_id, source_id, cache_status='revalidated', commit=True):
+    """Finish a job by reusing the stored content of an earlier crawl of the same URL."""
+    _complete_from(conn, job_id, source_id, cache_status)
+    if commit:
+        conn.commit()
+
+
+def fail_job(conn, job_id, error, commit=True):
+    conn.execute('''
+        UPDATE crawled_data
+        SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (FAILED, error, job_id))
+    if commit:
+        conn.commit()
+
+
+# Outcomes accepted by record_results, mapped to the function that applies them
+RESULT_HANDLERS = {
+    COMPLETED: complete_job,
+    'revalidated': complete_from_cache,
+    FAILED: fail_job,
+}
+
+
+def record_results(conn, results):
+    """Apply finished jobs as (job_id, outcome, value) in a single transaction.
+
+    value is the crawl_data dict, the source crawl id or the error message
+    depending on the outcome (see RESULT_HANDLERS).
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for job_id, outcome, value in results:
+            RESULT_HANDLERS[outcome](conn, job_id, value, commit=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def requeue_stale_jobs(conn, older_than_seconds=600, max_attempts=3):
+    """Put jobs orphaned by a dead worker back in the queue, or fail them after max_attempts.
+
+    Sitemap batches a dead worker was reading are queued to be read again.
+    """
+    cutoff = f'-{int(older_than_seconds)} seconds'
+    cursor = conn.execute('''
+        UPDATE crawled_data
+        SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+            error = CASE WHEN attempts >= ? THEN 'worker stopped responding' ELSE error END
+        WHERE status = ? AND started_at < datetime('now', ?)
+    ''', (max_attempts, FAILED, QUEUED, max_attempts, RUNNING, cutoff))
+    conn.execute('''
+        UPDATE crawl_batches SET status = ?
+        WHERE status = ? AND started_at < datetime('now', ?)
+    ''', (QUEUED, RUNNING, cutoff))
+    conn.commit()
+    return cursor.rowcount
+
+
+def batch_progress(conn, batch_id, user_id, failure_limit=20):
+    """Return the batch row with per-status counts and recent failures, or None.
+
+    A sitemap batch is pending until the worker has read it and every page is done.
+    Progress counts the jobs still queued or running against the recorded total,
+    since maintenance.prune_crawls may delete finished pages of a batch; the
+    finished pages it removed are reported as pruned.
+    """
+    batch = conn.execute('''
+        SELECT id, source, total, status, error, created_at FROM crawl_batches WHERE id = ? AND user_id = ?
+    ''', (batch_id, user_id)).fetchone()
+    if batch is None:
+        return None
+    counts = dict.fromkeys((QUEUED, RUNNING, COMPLETED, FAILED), 0)
+    counts.update(conn.execute('''
+        SELECT status, COUNT(*) FROM crawled_data WHERE batch_id = ? GROUP BY status
+    ''', (batch_id,)).fetchall())
+    failures = conn.execute('''
+        SELECT id, url, error FROM crawled_data
+        WHERE batch_id = ? AND status = ?
+        ORDER BY id DESC LIMIT ?
+    ''', (batch_id, FAILED, failure_limit)).fetchall()
+    done = batch['total'] - counts[QUEUED] - counts[RUNNING]
+    counts['pruned'] = max(done - counts[COMPLETED] - counts[FAILED], 0)
+    expanding = batch['status'] in PENDING_STATUSES
+    return {
+        'id': batch['id'],
+        'source': batch['source'],
+        'created_at': batch['created_at'],
+        'status': batch['status'],
+        'error': batch['error'],
+        'total': batch['total'],
+        'counts': counts,
+        'done': done,
+        'pending': expanding or done < batch['total'],
+        'percent': int(100 * done / batch['total']) if batch['total'] else (0 if expanding else 100),
+        'failures': [dict(row) for row in failures],
+    }
+
+
+def get_job(conn, job_id, user_id):
+    return conn.execute('''
+        SELECT id, url, crawl_date, status, error, cache_status
+        FROM crawled_data
+        WHERE id = ? AND user_id = ?
+    ''', (job_id, user_id)).fetchone()
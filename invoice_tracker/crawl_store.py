@@ -0,0 +1,133 @@
+import hashlib
+import json
+import zlib
+
+from perf import phase
+from search import index_crawl
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib from the stdlib is always available
+    zstandard = None
+
+# Heavy crawl bodies (raw/cleaned HTML, both markdown variants and links) live
+# compressed in crawl_blobs, keyed by the SHA-256 of their content, so a page
+# that has not changed between crawls is stored once. crawled_data keeps the
+# narrow columns the history page needs, the blob hash, and a small JSON
+# envelope (url, status_code, headers, timestamp) in its crawl_data column.
+BODY_FIELDS = ('html', 'cleaned_html', 'markdown', 'fit_markdown', 'links')
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+
+def compress(data):
+    raw = json.dumps(data).encode('utf-8')
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), len(raw)
+    return 'zlib', zlib.compress(raw, ZLIB_LEVEL), len(raw)
+
+
+def decompress(codec, payload):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('crawl payload is zstd-compressed but zstandard is not installed')
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    elif codec == 'zlib':
+        raw = zlib.decompress(payload)
+    else:
+        raise ValueError(f'unknown crawl payload codec {codec!r}')
+    return json.loads(raw)
+
+
+def _text_bytes(value):
+    return len(value.encode('utf-8')) if value else 0
+
+
+def crawl_metadata(crawl_data):
+    return {
+        'status_code': crawl_data.get('status_code'),
+        'html_bytes': _text_bytes(crawl_data.get('html')),
+        'markdown_bytes': _text_bytes(crawl_data.get('markdown')),
+        'link_count': len(crawl_data.get('links') or []),
+    }
+
+
+def header(headers, name):
+    # Response header names are case-insensitive
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def split_crawl_data(crawl_data):
+    """Split a crawl result into its per-crawl envelope and its shareable bodies."""
+    bodies = {field: crawl_data.get(field) for field in BODY_FIELDS}
+    envelope = {key: value for key, value in crawl_data.items() if key not in BODY_FIELDS}
+    return envelope, bodies
+
+
+def content_hash(bodies):
+    canonical = json.dumps(bodies, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def store_blob(conn, bodies):
+    digest = content_hash(bodies)
+    exists = conn.execute('SELECT 1 FROM crawl_blobs WHERE hash = ?', (digest,)).fetchone()
+    if exists is None:
+        codec, payload, raw_bytes = compress(bodies)
+        conn.execute('''
+            INSERT OR IGNORE INTO crawl_blobs (hash, codec, payload, raw_bytes)
+            VALUES (?, ?, ?, ?)
+        ''', (digest, codec, payload, raw_bytes))
+    return digest
+
+
+def store_crawl_data(conn, crawl_id, crawl_data):
+    """Write metadata columns, envelope and (deduplicated) bodies for one crawl (caller commits)."""
+    envelope, bodies = split_crawl_data(crawl_data)
+    digest = store_blob(conn, bodies)
+    meta = crawl_metadata(crawl_data)
+    headers = crawl_data.get('headers')
+    conn.execute('''
+        UPDATE crawled_data
+        SET status_code = ?, html_bytes = ?, markdown_bytes = ?, link_count = ?,
+            content_hash = ?, etag = ?, last_modified = ?, crawl_data = ?
+        WHERE id = ?
+    ''', (meta['status_code'], meta['html_bytes'], meta['markdown_bytes'], meta['link_count'],
+          digest, header(headers, 'etag'), header(headers, 'last-modified'),
+          json.dumps(envelope), crawl_id))
+    index_crawl(conn, crawl_id, crawl_data)
+    return digest
+
+
+def copy_crawl_content(conn, crawl_id, source_id):
+    """Point crawl_id at the stored content of an earlier crawl (caller commits)."""
+    conn.execute('''
+        UPDATE crawled_data
+        SET (status_code, html_bytes, markdown_bytes, link_count,
+             content_hash, etag, last_modified, crawl_data) =
+            (SELECT status_code, html_bytes, markdown_bytes, link_count,
+                    content_hash, etag, last_modified, crawl_data
+             FROM crawled_data WHERE id = ?)
+        WHERE id = ?
+    ''', (source_id, crawl_id))
+    index_crawl(conn, crawl_id, source_id=source_id)
+
+
+def load_crawl_data(conn, crawl_id):
+    """Rebuild the full crawl result, or return {} if the crawl has none yet."""
+    row = conn.execute('''
+        SELECT c.crawl_data, b.codec, b.payload
+        FROM crawled_data c
+        LEFT JOIN crawl_blobs b ON b.hash = c.content_hash
+        WHERE c.id = ?
+    ''', (crawl_id,)).fetchone()
+    if row is None or row[1] is None:
+        return {}
+    with phase('decode'):
+        crawl_data = json.loads(row[0])
+        crawl_data.update(decompress(row[1], row[2]))
+    return crawl_data
@@ -0,0 +1,295 @@
+"""Background crawl worker.
+
+Runs as its own process next to the web app:
+
+    python crawl_worker.py --database inventory.db --concurrency 4
+
+It keeps one headless browser open for its whole lifetime and crawls up to
+--concurrency queued jobs from crawled_data at a time.
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from collections import Counter
+from datetime import datetime
+
+from crawl4ai import AsyncWebCrawler
+
+import crawl_jobs
+from crawl_batches import read_sitemap
+from crawl_cache import is_not_modified, latest_crawl
+from database import ConnectionPool, init_db
+
+logger = logging.getLogger('crawl_worker')
+
+CRAWLER_OPTIONS = dict(
+    verbose=False,
+    timeout=30,
+    wait_for_selector='.article-content',
+    wait_time=2,
+    browser_type='chromium',
+    headless=True,
+    javascript_enabled=True,
+    ignore_https_errors=True,
+    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    html2text={
+        "escape_dot": False,
+        "body_width": 0,
+        "protect_links": True,
+        "unicode_snob": True
+    }
+)
+
+RUN_OPTIONS = dict(
+    word_count_threshold=10,        # Minimum words per block
+    exclude_external_links=True,    # Remove external links
+    exclude_external_images=True,   # Remove external images
+    excluded_tags=['form', 'nav'],  # Remove specific HTML tags
+    include_links_on_markdown=True  # Include links in markdown
+)
+
+
+def result_to_crawl_data(url, result):
+    # Store all available formats
+    return {
+        'url': url,
+        'html': result.html,                    # Original HTML
+        'cleaned_html': result.cleaned_html if hasattr(result, 'cleaned_html') else None,  # Sanitized HTML
+        'markdown': result.markdown,            # Standard markdown
+        'fit_markdown': result.fit_markdown if hasattr(result, 'fit_markdown') else None,  # Most relevant content
+        'links': list(result.links) if result.links else [],
+        'status_code': result.status_code if hasattr(result, 'status_code') else None,
+        'headers': dict(result.headers) if hasattr(result, 'headers') else {},
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+async def crawl_url(crawler, url):
+    result = await crawler.arun(url=url, **RUN_OPTIONS)
+    if hasattr(result, 'success') and not result.success:
+        raise RuntimeError(getattr(result, 'error_message', None) or 'crawl failed')
+    return result_to_crawl_data(url, result)
+
+
+class CrawlWorker:
+    """Claims queued crawl jobs and runs up to `concurrency` of them at once.
+
+    `fetch` is an async callable taking a URL and returning the crawl_data
+    dict; by default it is bound to a long-lived AsyncWebCrawler in run(), so
+    every page reuses the same browser. Before fetching, a URL crawled earlier
+    is revalidated with its stored ETag / Last-Modified and reused if the
+    origin answers 304.
+
+    Politeness: at most `per_host` jobs for one host run at once, and requests
+    to a host start at least `host_delay` seconds apart. Finished jobs are
+    written back in batches of up to `write_batch_size`, or every
+    `write_interval` seconds, one transaction per batch.
+
+    Sitemap batches queued by the web app are read here too, with
+    `read_sitemap` (a blocking callable run in the executor), and their pages
+    queued as jobs.
+    """
+
+    def __init__(self, database, concurrency=4, poll_interval=1.0, fetch=None,
+                 revalidate=is_not_modified, per_host=2, host_delay=0.0,
+                 write_batch_size=20, write_interval=0.2, read_sitemap=read_sitemap):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.fetch = fetch
+        self.revalidate = revalidate
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.read_sitemap = read_sitemap
+        # One connection per in-flight job, one for claiming and one for writing results
+        self.pool = ConnectionPool(database, size=concurrency + 2)
+        self.stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+        self._host_active = Counter()
+        self._host_next_start = {}
+        self._results = []
+
+    async def _db(self, func, *args):
+        # sqlite3 calls are blocking; keep them off the event loop
+        def call():
+            conn = self.pool.acquire()
+            try:
+                return func(conn, *args)
+            finally:
+                self.pool.release(conn)
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+    async def _unchanged_since(self, job):
+        # Returns the id of an earlier crawl whose content is still current, or None
+        previous = await self._db(latest_crawl, job['user_id'], job['normalized_url'])
+        if previous is None or not (previous['etag'] or previous['last_modified']):
+            return None
+        loop = asyncio.get_running_loop()
+        not_modified = await loop.run_in_executor(
+            None, self.revalidate, job['url'], previous['etag'], previous['last_modified'])
+        return previous['id'] if not_modified else None
+
+    async def _polite(self, host):
+        # Reserve the next start time for this host, then sleep until it arrives
+        if not self.host_delay:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, self._host_next_start.get(host, now))
+        self._host_next_start[host] = start + self.host_delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _process(self, job):
+        host = job['host']
+        try:
+            await self._polite(host)
+            source_id = await self._unchanged_since(job)
+            if source_id is not None:
+                logger.info('crawl %s of %s revalidated against crawl %s', job['id'], job['url'], source_id)
+                await self._record(job['id'], 'revalidated', source_id)
+                return
+            crawl_data = await self.fetch(job['url'])
+        except Exception as e:
+            logger.warning('crawl %s of %s failed: %s', job['id'], job['url'], e)
+            await self._record(job['id'], crawl_jobs.FAILED, str(e))
+        else:
+            logger.info('crawl %s of %s completed', job['id'], job['url'])
+            await self._record(job['id'], crawl_jobs.COMPLETED, crawl_data)
+        finally:
+            self._host_active[host] -= 1
+            self._wakeup.set()
+
+    async def _record(self, job_id, outcome, value):
+        self._results.append((job_id, outcome, value))
+        if len(self._results) >= self.write_batch_size:
+            await self._flush()
+
+    async def _flush(self):
+        results, self._results = self._results, []
+        if not results:
+            return
+        try:
+            await self._db(crawl_jobs.record_results, results)
+        except Exception:
+            # One bad result must not lose the rest of the batch
+            logger.exception('batched write of %d crawl results failed; writing one by one', len(results))
+            for job_id, outcome, value in results:
+                try:
+                    await self._db(crawl_jobs.record_results, [(job_id, outcome, value)])
+                except Exception as e:
+                    await self._db(crawl_jobs.fail_job, job_id, f'could not store result: {e}')
+
+    async def _write_results(self):
+        while not self.stopping.is_set():
+            await self._wait(self.write_interval, self.stopping)
+            await self._flush()
+
+    async def _expand_sitemaps(self):
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            batch = await self._db(crawl_jobs.claim_sitemap_batch)
+            if batch is None:
+                await self._wait(self.poll_interval, self.stopping)
+                continue
+            try:
+                urls = await loop.run_in_executor(None, self.read_sitemap, batch['sitemap'], batch['max_urls'])
+            except ValueError as e:
+                logger.warning('sitemap batch %s: %s', batch['id'], e)
+                await self._db(crawl_jobs.fail_batch, batch['id'], str(e))
+                continue
+            except Exception as e:
+                logger.exception('sitemap batch %s could not be read', batch['id'])
+                await self._db(crawl_jobs.fail_batch, batch['id'], f'could not read sitemap: {e}')
+                continue
+            try:
+                await self._db(crawl_jobs.expand_batch, batch['id'], urls)
+            except Exception as e:
+                logger.exception('sitemap batch %s could not be queued', batch['id'])
+                await self._db(crawl_jobs.fail_batch, batch['id'], f'could not queue pages: {e}')
+                continue
+            logger.info('sitemap batch %s queued %d pages', batch['id'], len(urls))
+            self._wakeup.set()
+
+    async def _wait(self, seconds, event=None):
+        event = event or self._wakeup
+        try:
+            await asyncio.wait_for(event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def _busy_hosts(self):
+        return [host for host, active in self._host_active.items() if active >= self.per_host]
+
+    async def serve(self):
+        """Claim and run jobs until stop() is called, then drain in-flight ones."""
+        requeued = await self._db(crawl_jobs.requeue_stale_jobs)
+        if requeued:
+            logger.info('requeued %d stale crawl jobs', requeued)
+
+        writer = asyncio.ensure_future(self._write_results())
+        expander = asyncio.ensure_future(self._expand_sitemaps())
+        slots = asyncio.Semaphore(self.concurrency)
+        while not self.stopping.is_set():
+            await slots.acquire()
+            self._wakeup.clear()
+            job = await self._db(crawl_jobs.claim_job, self._busy_hosts())
+            if job is None:
+                slots.release()
+                # Woken early when a job finishes and frees a host
+                await self._wait(self.poll_interval)
+                continue
+            self._host_active[job['host']] += 1
+            task = asyncio.ensure_future(self._process(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(writer, expander)
+        await self._flush()
+        self.pool.close()
+
+    def stop(self):
+        self.stopping.set()
+        self._wakeup.set()
+
+    async def run(self):
+        if self.fetch is not None:
+            return await self.serve()
+        async with AsyncWebCrawler(**CRAWLER_OPTIONS) as crawler:
+            self.fetch = lambda url: crawl_url(crawler, url)
+            await self.serve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued inventory tracker crawls.')
+    parser.add_argument('--database', default='inventory.db')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--per-host', type=int, default=2, help='concurrent crawls per host')
+    parser.add_argument('--host-delay', type=float, default=0.5,
+                        help='minimum seconds between crawl starts on one host')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    init_db(args.database)
+
+    async def run():
+        worker = CrawlWorker(args.database, concurrency=args.concurrency,
+                             poll_interval=args.poll_interval, per_host=args.per_host,
+                             host_delay=args.host_delay)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,102 @@
+import hashlib
+import json
+import os
+import queue
 import sqlite3
+import threading
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-def init_db():
-    conn = sqlite3.connect('inventory.db')
+try:
+    import zstandard
+except ImportError:  # only needed to upgrade databases that were written with it
+    zstandard = None
+
+# Pragmas applied to every pooled connection. WAL lets readers keep going
+# while a writer holds the lock, and NORMAL sync is safe under WAL.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,       # negative value = KiB, so ~20MB page cache
+    'mmap_size': 268435456,     # 256MB memory-mapped I/O
+    'busy_timeout': 5000,       # ms to wait on a locked database
+    'temp_store': 'MEMORY',
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded pool of sqlite3 connections shared by the worker threads of one process."""
+
+    def __init__(self, database, size=5, timeout=10.0, pragmas=None, factory=sqlite3.Connection):
+        self.database = database
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f'No database connection free after {self.timeout}s')
+
+    def release(self, conn):
+        # Never hand the next request a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        conn.close()
+        with self._lock:
+            self._created -= 1
+
+    def close(self):
+        # Only idle connections are closed; checked-out ones go when released
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+
+def create_base_tables(conn):
     c = conn.cursor()
     
     # Create table for electronics inventory
@@ -42,6 +137,508 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+
+# Data steps of migrations 5-7. Like the SQL around them they are frozen:
+# an old database must upgrade the same way however crawl_store, crawl_cache
+# or search change later, so these use only the stdlib and the schema of
+# their own version. Blobs are written with zlib, which crawl_store reads.
+
+# crawl_store.BODY_FIELDS as of migration 6
+_BLOB_FIELDS = ('html', 'cleaned_html', 'markdown', 'fit_markdown', 'links')
+
+
+def _compress_json(data):
+    raw = json.dumps(data).encode('utf-8')
+    return 'zlib', zlib.compress(raw, 6), len(raw)
+
+
+def _decompress_json(codec, payload):
+    # Databases upgraded before this code was frozen may hold zstd payloads
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('crawl payload is zstd-compressed but zstandard is not installed')
+        return json.loads(zstandard.ZstdDecompressor().decompress(payload))
+    return json.loads(zlib.decompress(payload))
+
+
+def _move_inline_payloads(conn):
+    # Migration 5: compress crawl_data JSON written before crawl_payloads existed.
+    # The metadata columns were filled by the SQL step before this one.
+    ids = [row[0] for row in conn.execute("SELECT id FROM crawled_data WHERE crawl_data <> '{}'")]
+    for crawl_id in ids:
+        crawl_data = json.loads(conn.execute('SELECT crawl_data FROM crawled_data WHERE id = ?',
+                                             (crawl_id,)).fetchone()[0])
+        codec, payload, raw_bytes = _compress_json(crawl_data)
+        conn.execute('INSERT INTO crawl_payloads (crawl_id, codec, payload, raw_bytes) VALUES (?, ?, ?, ?)',
+                     (crawl_id, codec, payload, raw_bytes))
+        conn.execute("UPDATE crawled_data SET crawl_data = '{}' WHERE id = ?", (crawl_id,))
+
+
+def _normalized_url(url):
+    # crawl_cache.normalize_url as of migration 6
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != {'http': 80, 'https': 443}.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def _header(headers, name):
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _payloads_to_blobs(conn):
+    # Migration 6: re-store per-crawl payloads as content-addressed blobs
+    rows = conn.execute('SELECT crawl_id, codec FROM crawl_payloads').fetchall()
+    for crawl_id, codec in rows:
+        payload = conn.execute('SELECT payload FROM crawl_payloads WHERE crawl_id = ?',
+                               (crawl_id,)).fetchone()[0]
+        crawl_data = _decompress_json(codec, payload)
+        bodies = {field: crawl_data.get(field) for field in _BLOB_FIELDS}
+        envelope = {key: value for key, value in crawl_data.items() if key not in _BLOB_FIELDS}
+        canonical = json.dumps(bodies, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha256(canonical).hexdigest()
+        codec, blob, raw_bytes = _compress_json(bodies)
+        conn.execute('INSERT OR IGNORE INTO crawl_blobs (hash, codec, payload, raw_bytes) VALUES (?, ?, ?, ?)',
+                     (digest, codec, blob, raw_bytes))
+        headers = crawl_data.get('headers')
+        conn.execute('''
+            UPDATE crawled_data
+            SET content_hash = ?, etag = ?, last_modified = ?, crawl_data = ?
+            WHERE id = ?
+        ''', (digest, _header(headers, 'etag'), _header(headers, 'last-modified'),
+              json.dumps(envelope), crawl_id))
+    for crawl_id, url in conn.execute('SELECT id, url FROM crawled_data').fetchall():
+        conn.execute('UPDATE crawled_data SET normalized_url = ? WHERE id = ?',
+                     (_normalized_url(url), crawl_id))
+
+
+def _index_existing_crawls(conn):
+    # Migration 7: crawl bodies are compressed, so crawl_fts is backfilled from Python
+    rows = conn.execute('''
+        SELECT c.id, b.codec FROM crawled_data c JOIN crawl_blobs b ON b.hash = c.content_hash
+    ''').fetchall()
+    for crawl_id, codec in rows:
+        payload = conn.execute('''
+            SELECT b.payload FROM crawled_data c JOIN crawl_blobs b ON b.hash = c.content_hash
+            WHERE c.id = ?
+        ''', (crawl_id,)).fetchone()[0]
+        bodies = _decompress_json(codec, payload)
+        conn.execute('''
+            INSERT INTO crawl_fts (rowid, owner, url, markdown, fit_markdown)
+            SELECT id, 'u' || user_id, url, ?, ? FROM crawled_data WHERE id = ?
+        ''', (bodies.get('markdown'), bodies.get('fit_markdown'), crawl_id))
+
+
+# Ordered schema migrations: (version, description, steps). A step is either an
+# SQL statement or a callable taking the connection. Each migration runs in its
+# own transaction and is recorded in schema_version once applied.
+MIGRATIONS = [
+    (1, 'base tables', [create_base_tables]),
+    (2, 'indexes for dashboard, crawl history and upsert lookups', [
+        # Dashboard: WHERE user_id = ? ORDER BY date_added DESC, id DESC
+        'CREATE INDEX IF NOT EXISTS idx_inventory_user_date ON inventory (user_id, date_added, id)',
+        # CSV upsert matches items on (user_id, name)
+        'CREATE INDEX IF NOT EXISTS idx_inventory_user_name ON inventory (user_id, name)',
+        # Crawl history: WHERE user_id = ? ORDER BY crawl_date DESC
+        'CREATE INDEX IF NOT EXISTS idx_crawled_data_user_date ON crawled_data (user_id, crawl_date, id)',
+        # users.username is UNIQUE, so login lookups already use sqlite_autoindex_users_1
+    ]),
+    (3, 'indexes for filtered dashboard pages', [
+        # Keyset pages filtered by category or sector keep the (date_added, id) order
+        'CREATE INDEX IF NOT EXISTS idx_inventory_user_category ON inventory (user_id, category, date_added, id)',
+        'CREATE INDEX IF NOT EXISTS idx_inventory_user_sector ON inventory (user_id, sector, date_added, id)',
+    ]),
+    (4, 'crawl job queue columns on crawled_data', [
+        'ALTER TABLE crawled_data ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE crawled_data ADD COLUMN started_at TIMESTAMP',
+        'ALTER TABLE crawled_data ADD COLUMN finished_at TIMESTAMP',
+        'ALTER TABLE crawled_data ADD COLUMN error TEXT',
+        # Workers claim the oldest queued row
+        'CREATE INDEX IF NOT EXISTS idx_crawled_data_status ON crawled_data (status, id)',
+    ]),
+    (5, 'split crawl metadata from compressed crawl payloads', [
+        'ALTER TABLE crawled_data ADD COLUMN status_code INTEGER',
+        'ALTER TABLE crawled_data ADD COLUMN html_bytes INTEGER',
+        'ALTER TABLE crawled_data ADD COLUMN markdown_bytes INTEGER',
+        'ALTER TABLE crawled_data ADD COLUMN link_count INTEGER',
+        '''
+        CREATE TABLE IF NOT EXISTS crawl_payloads (
+            crawl_id INTEGER PRIMARY KEY,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            raw_bytes INTEGER NOT NULL,
+            FOREIGN KEY (crawl_id) REFERENCES crawled_data (id)
+        )
+        ''',
+        # Metadata columns straight from the inline JSON; byte counts are UTF-8
+        '''
+        UPDATE crawled_data
+        SET status_code = json_extract(crawl_data, '$.status_code'),
+            html_bytes = COALESCE(length(CAST(json_extract(crawl_data, '$.html') AS BLOB)), 0),
+            markdown_bytes = COALESCE(length(CAST(json_extract(crawl_data, '$.markdown') AS BLOB)), 0),
+            link_count = COALESCE(json_array_length(crawl_data, '$.links'), 0)
+        WHERE crawl_data <> '{}'
+        ''',
+        # crawled_data.crawl_data is left as '{}' once its contents have moved
+        _move_inline_payloads,
+    ]),
+    (6, 'content-addressed crawl blobs and crawl cache keys', [
+        'ALTER TABLE crawled_data ADD COLUMN normalized_url TEXT',
+        'ALTER TABLE crawled_data ADD COLUMN content_hash TEXT',
+        'ALTER TABLE crawled_data ADD COLUMN etag TEXT',
+        'ALTER TABLE crawled_data ADD COLUMN last_modified TEXT',
+        # miss = crawled, hit = served from cache within the TTL,
+        # revalidated = origin answered 304 to a conditional request
+        'ALTER TABLE crawled_data ADD COLUMN cache_status TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS crawl_blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            raw_bytes INTEGER NOT NULL
+        )
+        ''',
+        _payloads_to_blobs,
+        'DROP TABLE crawl_payloads',
+        "UPDATE crawled_data SET finished_at = crawl_date WHERE status = 'completed' AND finished_at IS NULL",
+        'CREATE INDEX IF NOT EXISTS idx_crawled_data_normalized_url ON crawled_data (normalized_url, finished_at)',
+        'CREATE INDEX IF NOT EXISTS idx_crawled_data_content_hash ON crawled_data (content_hash)',
+    ]),
+    (7, 'full-text search over inventory and crawled markdown', [
+        # owner holds 'u<user_id>' so searches are restricted to one tenant inside the index
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5(
+            owner, name, category, sector, application,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory BEGIN
+            INSERT INTO inventory_fts (rowid, owner, name, category, sector, application)
+            VALUES (new.id, 'u' || new.user_id, new.name, new.category, new.sector, new.application);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory BEGIN
+            DELETE FROM inventory_fts WHERE rowid = old.id;
+        END
+        ''',
+        # Quantity edits are the most common write and do not touch indexed text
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_fts_update
+        AFTER UPDATE OF name, category, sector, application, user_id ON inventory BEGIN
+            DELETE FROM inventory_fts WHERE rowid = old.id;
+            INSERT INTO inventory_fts (rowid, owner, name, category, sector, application)
+            VALUES (new.id, 'u' || new.user_id, new.name, new.category, new.sector, new.application);
+        END
+        ''',
+        '''
+        INSERT INTO inventory_fts (rowid, owner, name, category, sector, application)
+        SELECT id, 'u' || user_id, name, category, sector, application FROM inventory
+        ''',
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS crawl_fts USING fts5(
+            owner, url, markdown, fit_markdown,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+        ''',
+        # Rows are added by search.index_crawl when a crawl result is stored
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawl_fts_delete AFTER DELETE ON crawled_data BEGIN
+            DELETE FROM crawl_fts WHERE rowid = old.id;
+        END
+        ''',
+        _index_existing_crawls,
+    ]),
+    (8, 'trigger-maintained per-user inventory rollups', [
+        '''
+        CREATE TABLE IF NOT EXISTS inventory_rollups (
+            user_id INTEGER NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            item_count INTEGER NOT NULL,
+            total_quantity INTEGER NOT NULL,
+            PRIMARY KEY (user_id, dimension, value)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_rollup_insert
+        AFTER INSERT ON inventory WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO inventory_rollups (user_id, dimension, value, item_count, total_quantity)
+            VALUES (new.user_id, 'category', new.category, 1, new.quantity),
+                   (new.user_id, 'sector', new.sector, 1, new.quantity),
+                   (new.user_id, 'application', new.application, 1, new.quantity)
+            ON CONFLICT (user_id, dimension, value) DO UPDATE SET
+                item_count = item_count + excluded.item_count,
+                total_quantity = total_quantity + excluded.total_quantity;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_rollup_delete
+        AFTER DELETE ON inventory WHEN old.user_id IS NOT NULL BEGIN
+            UPDATE inventory_rollups
+            SET item_count = item_count - 1, total_quantity = total_quantity - old.quantity
+            WHERE user_id = old.user_id
+              AND ((dimension = 'category' AND value = old.category)
+                OR (dimension = 'sector' AND value = old.sector)
+                OR (dimension = 'application' AND value = old.application));
+            DELETE FROM inventory_rollups WHERE user_id = old.user_id AND item_count <= 0;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_rollup_update
+        AFTER UPDATE OF quantity, category, sector, application, user_id ON inventory BEGIN
+            UPDATE inventory_rollups
+            SET item_count = item_count - 1, total_quantity = total_quantity - old.quantity
+            WHERE old.user_id IS NOT NULL AND user_id = old.user_id
+              AND ((dimension = 'category' AND value = old.category)
+                OR (dimension = 'sector' AND value = old.sector)
+                OR (dimension = 'application' AND value = old.application));
+            DELETE FROM inventory_rollups WHERE user_id = old.user_id AND item_count <= 0;
+            INSERT INTO inventory_rollups (user_id, dimension, value, item_count, total_quantity)
+            SELECT new.user_id, dimension, value, 1, new.quantity
+            FROM (SELECT 'category' AS dimension, new.category AS value
+                  UNION ALL SELECT 'sector', new.sector
+                  UNION ALL SELECT 'application', new.application)
+            WHERE new.user_id IS NOT NULL
+            ON CONFLICT (user_id, dimension, value) DO UPDATE SET
+                item_count = item_count + excluded.item_count,
+                total_quantity = total_quantity + excluded.total_quantity;
+        END
+        ''',
+        # rollups.ROLLUP_QUERY as of migration 8
+        '''
+        INSERT INTO inventory_rollups (user_id, dimension, value, item_count, total_quantity)
+        SELECT i.user_id, d.dimension,
+               CASE d.dimension WHEN 'category' THEN i.category
+                                WHEN 'sector' THEN i.sector
+                                ELSE i.application END AS value,
+               COUNT(*), SUM(i.quantity)
+        FROM inventory i,
+             (SELECT 'category' AS dimension UNION ALL SELECT 'sector' UNION ALL SELECT 'application') d
+        WHERE i.user_id IS NOT NULL
+        GROUP BY i.user_id, d.dimension, value
+        ''',
+    ]),
+    (9, 'per-user data versions bumped on every inventory and crawl write', [
+        '''
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_version_insert
+        AFTER INSERT ON inventory WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO user_data_versions (user_id, version) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_version_delete
+        AFTER DELETE ON inventory WHEN old.user_id IS NOT NULL BEGIN
+            INSERT INTO user_data_versions (user_id, version) VALUES (old.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_version_update
+        AFTER UPDATE ON inventory BEGIN
+            INSERT INTO user_data_versions (user_id, version) SELECT new.user_id, 1 WHERE new.user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            INSERT INTO user_data_versions (user_id, version) SELECT old.user_id, 1 WHERE old.user_id IS NOT NULL AND old.user_id IS NOT new.user_id
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_version_insert
+        AFTER INSERT ON crawled_data WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO user_data_versions (user_id, version) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_version_delete
+        AFTER DELETE ON crawled_data WHEN old.user_id IS NOT NULL BEGIN
+            INSERT INTO user_data_versions (user_id, version) VALUES (old.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_version_update
+        AFTER UPDATE ON crawled_data BEGIN
+            INSERT INTO user_data_versions (user_id, version) SELECT new.user_id, 1 WHERE new.user_id IS NOT NULL
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            INSERT INTO user_data_versions (user_id, version) SELECT old.user_id, 1 WHERE old.user_id IS NOT NULL AND old.user_id IS NOT new.user_id
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+    ]),
+    (10, 'crawl batches and per-host crawl scheduling', [
+        '''
+        CREATE TABLE IF NOT EXISTS crawl_batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        'ALTER TABLE crawled_data ADD COLUMN batch_id INTEGER REFERENCES crawl_batches (id)',
+        'ALTER TABLE crawled_data ADD COLUMN host TEXT',
+        # host is the scheme-less netloc of normalized_url
+        '''
+        UPDATE crawled_data
+        SET host = substr(substr(normalized_url, instr(normalized_url, '://') + 3), 1,
+                          instr(substr(normalized_url, instr(normalized_url, '://') + 3) || '/', '/') - 1)
+        WHERE normalized_url IS NOT NULL
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_crawled_data_batch ON crawled_data (batch_id, status)',
+    ]),
+    (11, 'crawl retention bookkeeping', [
+        # Set by maintenance.strip_html once a crawl's raw HTML has been dropped
+        'ALTER TABLE crawled_data ADD COLUMN html_stripped_at TIMESTAMP',
+    ]),
+    (12, 'row-level change feed for the live /events stream', [
+        # AUTOINCREMENT so ids are never reused once maintenance prunes old rows;
+        # they are the SSE event ids clients resume from
+        '''
+        CREATE TABLE IF NOT EXISTS change_feed (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_change_feed_user ON change_feed (user_id, id)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_feed_insert
+        AFTER INSERT ON inventory WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op) VALUES (new.user_id, 'inventory', new.id, 'insert');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_feed_delete
+        AFTER DELETE ON inventory WHEN old.user_id IS NOT NULL BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op) VALUES (old.user_id, 'inventory', old.id, 'delete');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS inventory_feed_update
+        AFTER UPDATE ON inventory BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op)
+            SELECT new.user_id, 'inventory', new.id, 'update' WHERE new.user_id IS NOT NULL;
+            INSERT INTO change_feed (user_id, entity, entity_id, op)
+            SELECT old.user_id, 'inventory', old.id, 'delete' WHERE old.user_id IS NOT NULL AND old.user_id IS NOT new.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_feed_insert
+        AFTER INSERT ON crawled_data WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op) VALUES (new.user_id, 'crawl', new.id, 'insert');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_feed_delete
+        AFTER DELETE ON crawled_data WHEN old.user_id IS NOT NULL BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op) VALUES (old.user_id, 'crawl', old.id, 'delete');
+        END
+        ''',
+        # Only the columns the history row shows; blob and retention updates stay quiet
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawled_data_feed_update
+        AFTER UPDATE OF status, error, cache_status, link_count, html_bytes ON crawled_data
+        WHEN new.user_id IS NOT NULL BEGIN
+            INSERT INTO change_feed (user_id, entity, entity_id, op) VALUES (new.user_id, 'crawl', new.id, 'update');
+        END
+        ''',
+    ]),
+    (13, 'sitemap batches expanded by the crawl worker', [
+        # queued -> running while the worker reads the sitemap, then ready or failed;
+        # URL-list batches are inserted ready
+        "ALTER TABLE crawl_batches ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'",
+        'ALTER TABLE crawl_batches ADD COLUMN sitemap TEXT',
+        'ALTER TABLE crawl_batches ADD COLUMN max_urls INTEGER',
+        'ALTER TABLE crawl_batches ADD COLUMN cache_ttl INTEGER',
+        'ALTER TABLE crawl_batches ADD COLUMN error TEXT',
+        'ALTER TABLE crawl_batches ADD COLUMN started_at TIMESTAMP',
+        'CREATE INDEX IF NOT EXISTS idx_crawl_batches_status ON crawl_batches (status, id)',
+        # A failed sitemap queues no jobs, so the batch page's cached copy needs its own bump
+        '''
+        CREATE TRIGGER IF NOT EXISTS crawl_batches_version_update
+        AFTER UPDATE OF status, total, error ON crawl_batches BEGIN
+            INSERT INTO user_data_versions (user_id, version) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        ''',
+    ]),
+]
+
+
+def schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply pending migrations and return the versions that were applied.
+
+    Safe to call on every startup and from several processes at once: each
+    migration takes the write lock with BEGIN IMMEDIATE and re-checks the
+    version before running.
+    """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage transactions explicitly so DDL is included
+    applied = []
+    try:
+        for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+            if version <= schema_version(conn):
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version <= schema_version(conn):
+                    conn.execute('ROLLBACK')
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (version, description))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            applied.append(version)
+        if applied:
+            conn.execute('PRAGMA optimize')
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def init_db(database='inventory.db'):
+    conn = sqlite3.connect(database)
+    try:
+        # Only takes effect on a new, empty file; maintenance.py converts older ones
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        migrate(conn)
+    finally:
+        conn.close()
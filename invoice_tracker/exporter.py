@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from crawl_store import decompress
+
+FORMATS = ('csv', 'jsonl')
+
+# Exportable columns per dataset; the first tuple is the default selection.
+# date_column drives the since/until filter and the (user_id, date, id) index order.
+EXPORTS = {
+    'inventory': {
+        'table': 'inventory',
+        'date_column': 'date_added',
+        'columns': ('id', 'name', 'quantity', 'category', 'sector', 'application', 'date_added'),
+        'extra_columns': (),
+    },
+    'crawls': {
+        'table': 'crawled_data',
+        'date_column': 'crawl_date',
+        'columns': ('id', 'url', 'crawl_date', 'status', 'status_code', 'cache_status',
+                    'link_count', 'html_bytes', 'markdown_bytes', 'error'),
+        # Bodies are decompressed one row at a time, only when asked for
+        'extra_columns': ('markdown', 'fit_markdown'),
+    },
+}
+
+
+def parse_columns(kind, value):
+    """Return the requested columns in the order given, or raise ValueError."""
+    spec = EXPORTS[kind]
+    if not value:
+        return spec['columns']
+    columns = tuple(column.strip() for column in value.split(',') if column.strip())
+    allowed = spec['columns'] + spec['extra_columns']
+    unknown = [column for column in columns if column not in allowed]
+    if unknown or not columns:
+        raise ValueError(f'Unknown columns: {", ".join(unknown)}; choose from {", ".join(allowed)}')
+    return columns
+
+
+def parse_day(value):
+    if not value:
+        return None
+    return datetime.strptime(value.strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def parse_export_args(kind, args):
+    """Read format, columns, since, until and gzip from query args; raises ValueError."""
+    fmt = args.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}; choose from {", ".join(FORMATS)}')
+    return {
+        'fmt': fmt,
+        'columns': parse_columns(kind, args.get('columns')),
+        'since': parse_day(args.get('since')),
+        'until': parse_day(args.get('until')),
+        'compress': args.get('gzip', '').lower() in ('1', 'true', 'yes'),
+    }
+
+
+def iter_rows(conn, kind, user_id, columns, since=None, until=None, batch_size=1000):
+    """Yield lists of row tuples, batch_size at a time, in (date, id) order.
+
+    The cursor is stepped with fetchmany, so only one batch is ever held in
+    memory however many rows match. since/until are inclusive YYYY-MM-DD days.
+    """
+    spec = EXPORTS[kind]
+    date_column = spec['date_column']
+    body_columns = [column for column in columns if column in spec['extra_columns']]
+    select = [f't.{column}' for column in columns if column not in body_columns]
+    if body_columns:
+        select += ['b.codec', 'b.payload']
+
+    clauses = ['t.user_id = ?']
+    params = [user_id]
+    if since:
+        clauses.append(f't.{date_column} >= ?')
+        params.append(since)
+    if until:
+        clauses.append(f"t.{date_column} < date(?, '+1 day')")
+        params.append(until)
+
+    cursor = conn.execute(f'''
+        SELECT {', '.join(select)}
+        FROM {spec['table']} t
+        {'LEFT JOIN crawl_blobs b ON b.hash = t.content_hash' if body_columns else ''}
+        WHERE {' AND '.join(clauses)}
+        ORDER BY t.{date_column}, t.id
+    ''', params)
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            if body_columns:
+                batch = [_with_bodies(row, columns, body_columns) for row in batch]
+            else:
+                batch = [tuple(row) for row in batch]
+            yield batch
+    finally:
+        cursor.close()
+
+
+def _with_bodies(row, columns, body_columns):
+    values = iter(row[:-2])
+    body = decompress(row[-2], row[-1]) if row[-2] is not None else {}
+    return tuple(body.get(column) if column in body_columns else next(values) for column in columns)
+
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def encode_jsonl(columns, batches):
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n'
+                      for row in batch).encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(conn, kind, user_id, fmt='csv', columns=None, since=None, until=None,
+                  compress=False, batch_size=1000):
+    """Yield the encoded export as bytes, one chunk per batch of rows."""
+    columns = columns or EXPORTS[kind]['columns']
+    batches = iter_rows(conn, kind, user_id, columns, since, until, batch_size)
+    encode = encode_csv if fmt == 'csv' else encode_jsonl
+    chunks = encode(columns, batches)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(kind, fmt, compress):
+    return f'{kind}-export.{fmt}' + ('.gz' if compress else '')
+
+
+def content_type(fmt, compress):
+    if compress:
+        return 'application/gzip'
+    return 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson'
@@ -0,0 +1,154 @@
+import codecs
+import csv
+from datetime import datetime
+
+# Column order of the bulk CSV format (see data_bulk.csv); date_added is optional
+CSV_COLUMNS = ('name', 'quantity', 'category', 'sector', 'application', 'date_added')
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+INSERT_SQL = '''
+    INSERT INTO inventory (name, quantity, category, sector, application, date_added, user_id)
+    VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+'''
+
+# Upsert matches on (user_id, name): existing items are updated in place,
+# the rest are inserted. There is no unique constraint to hang ON CONFLICT on,
+# so this is an UPDATE pass followed by a guarded INSERT pass.
+UPSERT_UPDATE_SQL = '''
+    UPDATE inventory
+    SET quantity = ?, category = ?, sector = ?, application = ?,
+        date_added = COALESCE(?, date_added)
+    WHERE user_id = ? AND name = ?
+'''
+UPSERT_INSERT_SQL = '''
+    INSERT INTO inventory (name, quantity, category, sector, application, date_added, user_id)
+    SELECT ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?
+    WHERE NOT EXISTS (SELECT 1 FROM inventory WHERE user_id = ? AND name = ?)
+'''
+
+
+class ImportReport:
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.imported = 0  # new items
+        self.updated = 0   # existing items overwritten by an upsert
+        self.failed = 0
+        self.errors = []   # (line number, message), capped at max_errors
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+    @property
+    def truncated(self):
+        return self.failed > len(self.errors)
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+            'truncated': self.truncated,
+        }
+
+
+def parse_date(value):
+    value = value.strip()
+    if not value:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f'unrecognised date_added {value!r}')
+
+
+def validate_row(row):
+    """Return the cleaned (name, quantity, category, sector, application, date_added) tuple."""
+    if len(row) < 5:
+        raise ValueError(f'expected at least 5 columns, got {len(row)}')
+    name, quantity, category, sector, application = (field.strip() for field in row[:5])
+    if not name:
+        raise ValueError('name is required')
+    try:
+        quantity = int(quantity)
+    except ValueError:
+        raise ValueError(f'quantity {quantity!r} is not an integer')
+    if quantity < 0:
+        raise ValueError('quantity cannot be negative')
+    date_added = parse_date(row[5]) if len(row) > 5 else None
+    return name, quantity, category, sector, application, date_added
+
+
+def is_header(row):
+    return bool(row) and row[0].strip().lower() == 'name'
+
+
+def read_rows(binary_stream, encoding='utf-8-sig'):
+    """Yield (line number, row) from an uploaded file without reading it into memory."""
+    reader = csv.reader(codecs.iterdecode(binary_stream, encoding))
+    for row in reader:
+        if not row or not any(field.strip() for field in row):
+            continue
+        yield reader.line_num, row
+
+
+def _write_chunk(conn, chunk, user_id, upsert):
+    """Write one chunk and return (inserted, updated) row counts."""
+    if upsert:
+        # Last occurrence of a name within the chunk wins
+        latest = {}
+        for row in chunk:
+            latest[row[0]] = row
+        rows = list(latest.values())
+        # rowcount of executemany sums the rows each statement changed; trigger
+        # writes are not included
+        updated = conn.executemany(UPSERT_UPDATE_SQL,
+                                   [(q, c, s, a, d, user_id, n) for n, q, c, s, a, d in rows]).rowcount
+        inserted = conn.executemany(UPSERT_INSERT_SQL,
+                                    [(n, q, c, s, a, d, user_id, user_id, n)
+                                     for n, q, c, s, a, d in rows]).rowcount
+        return inserted, updated
+    conn.executemany(INSERT_SQL, [row + (user_id,) for row in chunk])
+    return len(chunk), 0
+
+
+def import_csv(conn, binary_stream, user_id, upsert=False, chunk_size=1000, report=None):
+    """Stream a bulk CSV upload into inventory, one transaction per chunk of rows.
+
+    Bad rows are recorded in the returned ImportReport and skipped; good rows
+    from the same chunk are still written.
+    """
+    report = report or ImportReport()
+    chunk = []
+
+    def flush():
+        with conn:
+            inserted, updated = _write_chunk(conn, chunk, user_id, upsert)
+        report.imported += inserted
+        report.updated += updated
+        chunk.clear()
+
+    rows = read_rows(binary_stream)
+    try:
+        for line, row in rows:
+            if line == 1 and is_header(row):
+                continue
+            try:
+                chunk.append(validate_row(row))
+            except ValueError as e:
+                report.add_error(line, str(e))
+                continue
+            if len(chunk) >= chunk_size:
+                flush()
+    except UnicodeDecodeError:
+        report.add_error(None, 'file is not valid UTF-8; import stopped')
+    except csv.Error as e:
+        report.add_error(None, f'malformed CSV: {e}; import stopped')
+
+    if chunk:
+        flush()
+    return report
@@ -0,0 +1,259 @@
+# Database housekeeping: crawl retention, incremental VACUUM and online backups.
+#
+# Every step works in short transactions or page-sized increments so the web
+# app and the crawl worker keep running while it does. Run it from cron with
+# `flask maintenance`, as a loop with `python maintenance.py --interval 86400`,
+# or in-process under asgi.py by setting MAINTENANCE_INTERVAL.
+#
+# Files created before auto_vacuum=INCREMENTAL need one full VACUUM to switch.
+# That blocks writers, so it is never part of a scheduled run; do it once, at a
+# quiet time, with `python maintenance.py --enable-incremental-vacuum` or
+# `flask enable-incremental-vacuum`.
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+from change_feed import prune_change_feed
+from crawl_jobs import PENDING_STATUSES
+from crawl_store import decompress, store_blob
+from database import init_db
+
+logger = logging.getLogger('maintenance')
+
+# Raw markup is by far the largest part of a crawl body; markdown and links are kept
+HTML_FIELDS = ('html', 'cleaned_html')
+
+
+def connect(database):
+    conn = sqlite3.connect(database, timeout=30)
+    conn.execute('PRAGMA journal_mode = WAL')
+    return conn
+
+
+def _delete_in_chunks(conn, table, column, ids, chunk_size):
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        conn.execute(f'DELETE FROM {table} WHERE {column} IN (SELECT value FROM json_each(?))',
+                     (json.dumps(chunk),))
+        conn.commit()
+
+
+def prune_crawls(conn, keep_per_url, chunk_size=500):
+    """Delete all but the newest keep_per_url finished crawls of each user's URL; returns the count."""
+    if keep_per_url < 1:
+        raise ValueError('keep_per_url must be at least 1; the newest crawl backs the crawl cache')
+    placeholders = ', '.join('?' for _ in PENDING_STATUSES)
+    ids = [row[0] for row in conn.execute(f'''
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id, COALESCE(normalized_url, url)
+                ORDER BY COALESCE(finished_at, crawl_date) DESC, id DESC
+            ) AS newest
+            FROM crawled_data
+            WHERE status NOT IN ({placeholders})
+        )
+        WHERE newest > ?
+    ''', (*PENDING_STATUSES, keep_per_url))]
+    # Triggers keep crawl_fts and the per-user data versions in step
+    _delete_in_chunks(conn, 'crawled_data', 'id', ids, chunk_size)
+    return len(ids)
+
+
+def strip_html(conn, older_than_days, batch_size=200):
+    """Drop raw HTML from crawls older than older_than_days; returns how many were stripped.
+
+    Bodies are content-addressed and may be shared with newer crawls, so the
+    old crawl is pointed at a new blob without HTML rather than editing the
+    shared one in place. Orphaned blobs are removed by delete_orphan_blobs.
+    """
+    stripped = 0
+    while True:
+        rows = conn.execute('''
+            SELECT c.id, c.content_hash, b.codec, b.payload
+            FROM crawled_data c
+            JOIN crawl_blobs b ON b.hash = c.content_hash
+            WHERE c.html_stripped_at IS NULL AND c.crawl_date < datetime('now', ?)
+            LIMIT ?
+        ''', (f'-{int(older_than_days)} days', batch_size)).fetchall()
+        if not rows:
+            return stripped
+        replacements = {}
+        for crawl_id, digest, codec, payload in rows:
+            if digest not in replacements:
+                bodies = decompress(codec, payload)
+                if any(bodies.get(field) for field in HTML_FIELDS):
+                    bodies.update(dict.fromkeys(HTML_FIELDS))
+                    replacements[digest] = store_blob(conn, bodies)
+                else:
+                    replacements[digest] = digest
+            conn.execute('''
+                UPDATE crawled_data SET content_hash = ?, html_stripped_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (replacements[digest], crawl_id))
+        conn.commit()
+        stripped += len(rows)
+
+
+def delete_orphan_blobs(conn):
+    cursor = conn.execute('''
+        DELETE FROM crawl_blobs
+        WHERE NOT EXISTS (SELECT 1 FROM crawled_data WHERE content_hash = crawl_blobs.hash)
+    ''')
+    conn.commit()
+    return cursor.rowcount
+
+
+def pragma(conn, name):
+    return conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+def enable_incremental_vacuum(conn):
+    """Switch an existing file to auto_vacuum=INCREMENTAL; returns True if it had to.
+
+    New databases get the mode from init_db. Older files need one full VACUUM
+    to change it, which holds the write lock for its duration, so this is a
+    one-off command and run_maintenance never calls it.
+    """
+    if pragma(conn, 'auto_vacuum') == 2:
+        return False
+    conn.commit()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    logger.info('switched %s to incremental auto_vacuum', database_path(conn))
+    return True
+
+
+def incremental_vacuum(conn, step_pages=1000, pause=0.05):
+    """Return free pages to the filesystem step_pages at a time; returns pages released.
+
+    Does nothing unless the file is in auto_vacuum=INCREMENTAL mode.
+    """
+    if pragma(conn, 'auto_vacuum') != 2:
+        return 0
+    released = 0
+    while True:
+        free = pragma(conn, 'freelist_count')
+        if not free:
+            break
+        conn.execute(f'PRAGMA incremental_vacuum({int(step_pages)})').fetchall()
+        step = free - pragma(conn, 'freelist_count')
+        if not step:
+            break
+        released += step
+        time.sleep(pause)
+    # The file only shrinks once the truncation has been checkpointed out of the WAL
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return released
+
+
+def database_path(conn):
+    # database_list rows are (seq, name, file); seq 0 is the main database
+    return conn.execute('PRAGMA database_list').fetchone()[2] or 'memory'
+
+
+def backup(conn, directory, keep=7, pages=256, pause=0.05):
+    """Copy the database to directory with the online backup API; returns the backup path.
+
+    pages are copied per step and the source is only read-locked during a
+    step; the progress callback sleeps pause seconds between steps. (The
+    sleep argument of Connection.backup only applies after BUSY or LOCKED, and
+    a backup cannot be resumed across calls, so the pause has to go there.)
+    The newest keep backups are retained.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.splitext(os.path.basename(database_path(conn)))[0]
+    path = os.path.join(directory, f'{name}-{datetime.now():%Y%m%d-%H%M%S}.db')
+    partial = path + '.partial'
+    target = sqlite3.connect(partial)
+    try:
+        def between_steps(status, remaining, total):
+            if remaining:
+                time.sleep(pause)
+
+        conn.backup(target, pages=pages, progress=between_steps, sleep=pause)
+    finally:
+        target.close()
+    os.replace(partial, path)
+
+    for old in sorted(glob.glob(os.path.join(directory, f'{name}-*.db')))[:-max(keep, 1)]:
+        os.remove(old)
+    return path
+
+
+def run_maintenance(database, keep_per_url=5, strip_html_days=30, backup_dir=None, backup_keep=7,
+                    feed_retention_hours=24):
+    """Run every maintenance step once and return a report of what it did."""
+    started = time.perf_counter()
+    init_db(database)
+    conn = connect(database)
+    try:
+        page_size = pragma(conn, 'page_size')
+        pages_before = pragma(conn, 'page_count')
+        report = {'database': database}
+        if keep_per_url:
+            report['crawls_deleted'] = prune_crawls(conn, keep_per_url)
+        if strip_html_days:
+            report['html_stripped'] = strip_html(conn, strip_html_days)
+        report['blobs_deleted'] = delete_orphan_blobs(conn)
+        if feed_retention_hours:
+            report['feed_rows_deleted'] = prune_change_feed(conn, feed_retention_hours)
+            conn.commit()
+        if pragma(conn, 'auto_vacuum') != 2:
+            logger.warning('%s is not in incremental auto_vacuum mode; free pages are kept until '
+                           'python maintenance.py --enable-incremental-vacuum is run once', database)
+        report['pages_released'] = incremental_vacuum(conn)
+        report['reclaimed_bytes'] = max(pages_before - pragma(conn, 'page_count'), 0) * page_size
+        report['size_bytes'] = pragma(conn, 'page_count') * page_size
+        if backup_dir:
+            report['backup'] = backup(conn, backup_dir, keep=backup_keep)
+    finally:
+        conn.close()
+    report['seconds'] = round(time.perf_counter() - started, 2)
+    logger.info('maintenance of %s reclaimed %d bytes: %s', database, report['reclaimed_bytes'], report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prune, compact and back up the inventory database.')
+    parser.add_argument('--database', default='inventory.db')
+    parser.add_argument('--keep-per-url', type=int, default=5,
+                        help='finished crawls kept per user and URL; 0 keeps all')
+    parser.add_argument('--strip-html-days', type=int, default=30,
+                        help='drop raw HTML from crawls older than this many days; 0 keeps it')
+    parser.add_argument('--backup-dir', default='backups', help="'' skips the backup")
+    parser.add_argument('--backup-keep', type=int, default=7)
+    parser.add_argument('--feed-retention-hours', type=int, default=24,
+                        help='change feed rows kept for reconnecting /events clients; 0 keeps all')
+    parser.add_argument('--interval', type=float, default=0,
+                        help='seconds between runs; 0 runs once and exits')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='switch an older file to incremental auto_vacuum with one full VACUUM, '
+                             'which blocks writers while it runs, and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    if args.enable_incremental_vacuum:
+        conn = connect(args.database)
+        try:
+            print(json.dumps({'database': args.database, 'vacuum_rebuilt': enable_incremental_vacuum(conn)}))
+        finally:
+            conn.close()
+        return
+    while True:
+        report = run_maintenance(args.database, keep_per_url=args.keep_per_url,
+                                 strip_html_days=args.strip_html_days,
+                                 backup_dir=args.backup_dir, backup_keep=args.backup_keep,
+                                 feed_retention_hours=args.feed_retention_hours)
+        print(json.dumps(report), flush=True)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Conditional GETs and rendered-fragment caching keyed by a per-user data
+# version. user_data_versions is bumped by triggers on inventory and
+# crawled_data (migration 9), so writes from the crawl worker process count
+# too. Checking the version is one primary-key read; the page's own queries
+# and template rendering are skipped whenever it has not moved. A build id
+# is part of every key, so a deploy does not answer 304 with old templates.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def data_version(conn, user_id):
+    row = conn.execute('SELECT version FROM user_data_versions WHERE user_id = ?',
+                       (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def cache_key(user_id, view, path, variant, version, build):
+    # variant covers request headers that change the body, e.g. HX-Request or Accept
+    return (user_id, view, path, variant, version, build)
+
+
+def source_digest(root, template_folder='templates'):
+    """Short hash of the app's modules and templates, used as the default build id."""
+    paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith('.py')]
+    for folder, dirs, files in os.walk(os.path.join(root, template_folder)):
+        paths.extend(os.path.join(folder, name) for name in files)
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, root).encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def make_etag(key):
+    """Strong validator: the same key always renders byte-identical output."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+class _Capture:
+    """Keeps a copy of the chunks passing through until they exceed limit bytes."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+
+    def add(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if self.parts is not None:
+            self.size += len(chunk)
+            if self.size <= self.limit:
+                self.parts.append(chunk)
+            else:
+                self.parts = None
+        return chunk
+
+    def store(self, store):
+        if self.parts is not None:
+            store(b''.join(self.parts))
+
+
+def tee_body(chunks, store, limit):
+    """Pass a streamed body through, then store(body) if it ended within limit bytes.
+
+    Large pages are streamed without being kept; the original iterable is
+    closed when the client stops reading, so stream_with_context can clean up.
+    """
+    capture = _Capture(limit)
+    try:
+        for chunk in chunks:
+            yield capture.add(chunk)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+    capture.store(store)
+
+
+async def tee_body_async(chunks, store, limit):
+    """tee_body for an async iterable, as the ASGI app streams pages."""
+    capture = _Capture(limit)
+    try:
+        async for chunk in chunks:
+            yield capture.add(chunk)
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+    capture.store(store)
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered responses, stored as (body, mimetype)."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,126 @@
+# Password hashing off the request threads.
+#
+# PBKDF2 and scrypt are slow on purpose and hold the GIL while they run, so a
+# burst of logins hashed inline stalls every other request the process serves.
+# PasswordHasher runs them in a small process pool instead, admits at most
+# max_pending jobs at a time and raises HasherBusy straight away beyond that;
+# the apps answer 503 with Retry-After rather than queueing logins behind
+# each other. A successful login whose stored hash was made with other
+# parameters than PASSWORD_HASH_METHOD gets a new hash in the same job, so
+# cost changes roll out as users sign in.
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+@lru_cache(maxsize=8)
+def method_prefix(method):
+    # What werkzeug stores before the first '$' for method, with its defaults filled in
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(stored, method):
+    return stored.split('$', 1)[0] != method_prefix(method)
+
+
+def hash_password(password, method):
+    return generate_password_hash(password, method)
+
+
+def verify_password(stored, password, method):
+    """Return (matches, new_hash); new_hash is set when stored used other parameters."""
+    if not check_password_hash(stored, password):
+        return False, None
+    if needs_rehash(stored, method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    """Bounded process pool for password hashing, shared by the threads of one process."""
+
+    def __init__(self, method='scrypt', workers=2, max_pending=16, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._futures = set()  # submitted and not yet done, cancelled on close()
+        self._lock = threading.Lock()
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy(f'{self.max_pending} password hashes already pending')
+        try:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: the parent has database and server threads running
+                    self._executor = ProcessPoolExecutor(
+                        self.workers, mp_context=multiprocessing.get_context('spawn'))
+                future = self._executor.submit(func, *args, self.method)
+                self._futures.add(future)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        # Runs on completion and again on timeout; only the first call frees the slot
+        with self._lock:
+            if future not in self._futures:
+                return
+            self._futures.discard(future)
+        self._slots.release()
+
+    def _give_up(self, future):
+        # A queued job is dropped. A running one cannot be stopped and finishes in
+        # its worker; the slot is freed now anyway, so one slow hash does not turn
+        # every later login away with HasherBusy until it ends.
+        future.cancel()
+        self._release(future)
+        return HasherBusy(f'password hash not done after {self.timeout}s')
+
+    def _result(self, future):
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise self._give_up(future)
+
+    def hash(self, password):
+        return self._result(self._submit(hash_password, password))
+
+    def verify(self, stored, password):
+        return self._result(self._submit(verify_password, stored, password))
+
+    async def hash_async(self, password):
+        return await self._wait(self._submit(hash_password, password))
+
+    async def verify_async(self, stored, password):
+        return await self._wait(self._submit(verify_password, stored, password))
+
+    async def _wait(self, future):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._give_up(future)
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures = list(self._futures)
+        if executor is not None:
+            # shutdown(cancel_futures=True) needs Python 3.9 and CI runs 3.8.
+            # Cancelling runs _release, so it happens outside the lock.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
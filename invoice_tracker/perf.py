@@ -0,0 +1,357 @@
+# Request timing and SQL profiling for the Flask app.
+#
+# Each request gets a RequestTimings that splits its wall time into phases
+# (db, template, decode; whatever is left is the handler), records every SQL
+# statement under a normalized fingerprint, and, when a sampler is running,
+# collects stack samples. Requests slower than PERF_PROFILE_THRESHOLD_MS have
+# their samples written as collapsed stacks ("a;b;c 12" per line), the input
+# format of flamegraph.pl and speedscope. Aggregates are served at /_debug/perf.
+#
+# Everything is off unless PERF_ENABLED is set; instrumented code calls
+# phase() unconditionally and it costs one context variable lookup when off.
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from flask import (Blueprint, abort, before_render_template, current_app, jsonify,
+                   render_template, request, template_rendered)
+
+_current = ContextVar('perf_request', default=None)
+
+# Same normalization as htmx_flask_study/perf.py; each app directory is deployed
+# on its own, so the two cannot share a module. Change both together.
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize a statement so calls that differ only in literals group together."""
+    sql = _COMMENTS.sub(' ', sql)
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _IN_LISTS.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class RequestTimings:
+    """Phase and statement timings for one request, filled in by the thread serving it."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.phases = defaultdict(float)
+        # fingerprint -> [calls, seconds]; fetch time is added to the statement's total
+        self.statements = defaultdict(lambda: [0, 0.0])
+        self.samples = Counter()
+        self._stack = []
+
+    def push(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            # Phases are exclusive: a query run while rendering counts as db, not template
+            parent, since = self._stack[-1]
+            self.phases[parent] += now - since
+        self._stack.append((name, now))
+
+    def pop(self):
+        now = time.perf_counter()
+        name, since = self._stack.pop()
+        self.phases[name] += now - since
+        if self._stack:
+            self._stack[-1] = (self._stack[-1][0], now)
+
+    def statement(self, sql, seconds, call=True):
+        stats = self.statements[fingerprint(sql)]
+        stats[0] += call
+        stats[1] += seconds
+
+    def finish(self):
+        while self._stack:
+            self.pop()
+        self.elapsed = time.perf_counter() - self.started
+        self.phases['handler'] = max(self.elapsed - sum(self.phases.values()), 0.0)
+        return self.elapsed
+
+
+@contextmanager
+def phase(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings.push(name)
+    try:
+        yield
+    finally:
+        timings.pop()
+
+
+@contextmanager
+def timed_statement(sql, call=True):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    timings.push('db')
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.statement(sql, time.perf_counter() - started, call)
+        timings.pop()
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the statement's fingerprint."""
+
+    _sql = ''
+
+    def execute(self, sql, parameters=()):
+        self._sql = sql
+        with timed_statement(sql):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sql = sql
+        with timed_statement(sql):
+            return super().executemany(sql, seq_of_parameters)
+
+    # SQLite steps rows lazily, so most of a SELECT's time is spent here
+    def fetchone(self):
+        with timed_statement(self._sql, call=False):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with timed_statement(self._sql, call=False):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        with timed_statement(self._sql, call=False):
+            return super().fetchall()
+
+    def __next__(self):
+        with timed_statement(self._sql, call=False):
+            return super().__next__()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection factory for ConnectionPool that routes statements through ProfiledCursor."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with timed_statement('COMMIT'):
+            super().commit()
+
+
+def collapse_stack(frame, limit=200):
+    """Return frame's call stack, outermost first, as one collapsed-stack line."""
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """Background thread sampling the stacks of the threads serving active requests."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, timings):
+        with self._lock:
+            self._active[timings.thread_id] = timings
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='perf-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self, timings):
+        with self._lock:
+            if self._active.get(timings.thread_id) is timings:
+                del self._active[timings.thread_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, timings in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    timings.samples[collapse_stack(frame)] += 1
+
+
+def write_profile(directory, timings):
+    """Write timings.samples as a collapsed-stack file and return its path."""
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{}ms.folded'.format(time.strftime('%Y%m%d-%H%M%S'),
+                                      re.sub(r'[^\w.]+', '_', timings.endpoint),
+                                      round(timings.elapsed * 1000))
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        for stack, count in timings.samples.most_common():
+            f.write(f'{stack} {count}\n')
+    return path
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list, or None when it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(-(-len(ordered) * pct // 100)) - 1, 0)
+    return ordered[index]
+
+
+def _millis(values):
+    return {f'p{pct}': round(percentile(values, pct) * 1000, 2) for pct in (50, 95, 99)}
+
+
+class PerfStats:
+    """Rolling per-endpoint and per-fingerprint timings for the last history requests."""
+
+    def __init__(self, history=1000):
+        self._requests = defaultdict(lambda: deque(maxlen=history))
+        self._statements = defaultdict(lambda: deque(maxlen=history))
+        self._statement_totals = defaultdict(lambda: [0, 0.0])
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        with self._lock:
+            self._requests[timings.endpoint].append(dict(timings.phases, total=timings.elapsed))
+            for sql, (calls, seconds) in timings.statements.items():
+                # Per-request time of each fingerprint, so N+1 loops show up as one slow row
+                self._statements[sql].append(seconds)
+                totals = self._statement_totals[sql]
+                totals[0] += calls
+                totals[1] += seconds
+
+    def summary(self):
+        with self._lock:
+            requests = {endpoint: list(rows) for endpoint, rows in self._requests.items()}
+            statements = {sql: (list(rows), tuple(self._statement_totals[sql]))
+                          for sql, rows in self._statements.items()}
+        endpoints = []
+        for endpoint, rows in requests.items():
+            entry = {'endpoint': endpoint, 'requests': len(rows)}
+            for name in ('total', 'db', 'template', 'decode', 'handler'):
+                entry[name] = _millis([row.get(name, 0.0) for row in rows])
+            endpoints.append(entry)
+        endpoints.sort(key=lambda entry: entry['total']['p95'], reverse=True)
+        queries = [{'sql': sql, 'calls': calls, 'total_ms': round(seconds * 1000, 2),
+                    'per_request': _millis(rows)}
+                   for sql, (rows, (calls, seconds)) in statements.items()]
+        queries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return {'endpoints': endpoints, 'statements': queries}
+
+
+debug = Blueprint('perf', __name__)
+
+
+@debug.route('/_debug/perf')
+def perf_page():
+    if not current_app.config['PERF_ENABLED']:
+        abort(404)
+    summary = current_app.extensions['perf'].stats.summary()
+    if request.args.get('format') == 'json':
+        return jsonify(summary)
+    return render_template('perf.html', **summary)
+
+
+class Perf:
+    """Flask extension wiring RequestTimings into the request lifecycle."""
+
+    def __init__(self, app=None):
+        self.stats = None
+        self.sampler = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PERF_ENABLED', False)
+        app.config.setdefault('PERF_IGNORE_ENDPOINTS', ())
+        app.config.setdefault('PERF_HISTORY', 1000)
+        app.config.setdefault('PERF_PROFILE_THRESHOLD_MS', 500)
+        app.config.setdefault('PERF_PROFILE_DIR', 'perf_profiles')
+        app.config.setdefault('PERF_SAMPLE_INTERVAL', 0.005)
+        self.stats = PerfStats(app.config['PERF_HISTORY'])
+        self.sampler = Sampler(app.config['PERF_SAMPLE_INTERVAL'])
+        app.extensions['perf'] = self
+        app.register_blueprint(debug)
+        app.before_request(self._start)
+        app.after_request(self._server_timing)
+        app.teardown_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+
+    def _start(self):
+        if (not current_app.config['PERF_ENABLED'] or request.endpoint == 'perf.perf_page'
+                or request.endpoint in current_app.config['PERF_IGNORE_ENDPOINTS']):
+            return
+        timings = RequestTimings(request.endpoint or request.path)
+        _current.set(timings)
+        if current_app.config['PERF_PROFILE_THRESHOLD_MS'] is not None:
+            self.sampler.add(timings)
+
+    def _server_timing(self, response):
+        timings = _current.get()
+        if timings is not None:
+            elapsed = time.perf_counter() - timings.started
+            metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.phases.items()]
+            metrics.append(f'total;dur={elapsed * 1000:.1f}')
+            response.headers['Server-Timing'] = ', '.join(metrics)
+        return response
+
+    def _finish(self, exc):
+        timings = _current.get()
+        if timings is None:
+            return
+        _current.set(None)
+        self.sampler.remove(timings)
+        timings.finish()
+        self.stats.record(timings)
+        threshold = current_app.config['PERF_PROFILE_THRESHOLD_MS']
+        if threshold is not None and timings.samples and timings.elapsed * 1000 >= threshold:
+            path = write_profile(current_app.config['PERF_PROFILE_DIR'], timings)
+            current_app.logger.info('Slow request %s (%.0f ms), profile written to %s',
+                                    timings.endpoint, timings.elapsed * 1000, path)
+
+    @staticmethod
+    def _template_started(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is not None:
+            timings.push('template')
+
+    @staticmethod
+    def _template_finished(sender, template, context, **extra):
+        timings = _current.get()
+        if timings is not None and timings._stack:
+            timings.pop()
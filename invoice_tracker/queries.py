@@ -0,0 +1,204 @@
+# SQL used by both the WSGI views (app.py) and the ASGI views (asgi.py).
+# Every function takes an open connection; writers commit before returning.
+import json
+
+
+def get_user_by_username(conn, username):
+    return conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+
+def create_user(conn, username, password_hash, email):
+    conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                 (username, password_hash, email))
+    conn.commit()
+
+
+def update_password_hash(conn, user_id, password_hash):
+    conn.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
+    conn.commit()
+
+
+class RowStream:
+    """Rows read from a cursor as they are iterated instead of fetched up front.
+
+    Truthiness peeks at the first row. With a limit, one row past it is read to
+    tell whether another page follows; next_cursor holds key(last row shown)
+    once iteration has reached the end of the page.
+    """
+
+    def __init__(self, cursor, limit=None, key=None):
+        self.next_cursor = None
+        self._cursor = cursor
+        self._limit = limit
+        self._key = key
+        self._peeked = []
+        self._rows = None
+        self._done = False
+
+    def _next_row(self):
+        if self._peeked:
+            return self._peeked.pop()
+        if self._done:
+            return None
+        return next(self._cursor, None)
+
+    def __bool__(self):
+        if self._rows is not None:
+            return bool(self._rows)
+        if not self._peeked:
+            row = self._next_row()
+            if row is None:
+                return False
+            self._peeked.append(row)
+        return True
+
+    def __iter__(self):
+        if self._rows is not None:
+            yield from self._rows
+            return
+        count, last = 0, None
+        try:
+            while True:
+                row = self._next_row()
+                if row is None:
+                    break
+                if self._limit is not None and count == self._limit:
+                    self.next_cursor = self._key(last)
+                    break
+                count, last = count + 1, row
+                yield row
+        finally:
+            self._done = True
+            self._cursor.close()
+
+    def load(self):
+        """Read the remaining rows now, e.g. before handing the page to another thread."""
+        if self._rows is None:
+            self._rows = list(self)
+        return self
+
+
+def iter_inventory_page(conn, user_id, category=None, sector=None, cursor=None, limit=50):
+    """Return a RowStream over one keyset page ordered newest first.
+
+    The cursor is the (date_added, id) of the last row already shown, so every
+    page is an index range scan no matter how deep the user has scrolled.
+    """
+    clauses = ['user_id = ?']
+    params = [user_id]
+    if category:
+        clauses.append('category = ?')
+        params.append(category)
+    if sector:
+        clauses.append('sector = ?')
+        params.append(sector)
+    if cursor:
+        clauses.append('(date_added, id) < (?, ?)')
+        params.extend(cursor)
+
+    result = conn.execute(f'''
+        SELECT * FROM inventory
+        WHERE {' AND '.join(clauses)}
+        ORDER BY date_added DESC, id DESC
+        LIMIT ?
+    ''', params + [limit + 1])
+    return RowStream(result, limit, key=lambda row: (row['date_added'], row['id']))
+
+
+def add_item(conn, user_id, name, quantity, category, sector, application):
+    conn.execute('''INSERT INTO inventory 
+                  (name, quantity, category, sector, application, user_id) 
+                  VALUES (?, ?, ?, ?, ?, ?)''',
+                 (name, quantity, category, sector, application, user_id))
+    conn.commit()
+
+
+def set_item_quantity(conn, item_id, user_id, quantity):
+    """Update one item the user owns and return the updated row, or None."""
+    result = conn.execute('UPDATE inventory SET quantity = ? WHERE id = ? AND user_id = ?',
+                          (quantity, item_id, user_id))
+    conn.commit()
+    if result.rowcount == 0:
+        return None
+    return conn.execute('SELECT * FROM inventory WHERE id = ?', (item_id,)).fetchone()
+
+
+def delete_item(conn, item_id, user_id):
+    """Delete one item the user owns; returns False if there was no such item."""
+    result = conn.execute('DELETE FROM inventory WHERE id = ? AND user_id = ?',
+                          (item_id, user_id))
+    conn.commit()
+    return result.rowcount > 0
+
+
+def iter_crawls(conn, user_id):
+    # Only the narrow metadata columns; bodies stay compressed in crawl_blobs
+    return RowStream(conn.execute('''
+        SELECT id, url, crawl_date, status, error, cache_status, status_code, link_count, html_bytes
+        FROM crawled_data 
+        WHERE user_id = ? 
+        ORDER BY crawl_date DESC, id DESC
+    ''', (user_id,)))
+
+
+def get_crawl(conn, crawl_id, user_id):
+    return conn.execute('''
+        SELECT id, url, crawl_date, status, error, cache_status, status_code, link_count
+        FROM crawled_data 
+        WHERE id = ? AND user_id = ?
+    ''', (crawl_id, user_id)).fetchone()
+
+
+# Batch operations on a selection of items: op name -> (SET clause, value check)
+BULK_OPERATIONS = {
+    'set_quantity': ('quantity = ?', lambda v: int(v) if int(v) >= 0 else None),
+    'adjust_quantity': ('quantity = MAX(quantity + ?, 0)', int),
+    'set_category': ('category = ?', lambda v: str(v).strip() or None),
+    'delete': (None, None),
+}
+
+
+def parse_bulk_operation(op, value=None):
+    """Return (op, value) with the value coerced, or raise ValueError."""
+    if op not in BULK_OPERATIONS:
+        raise ValueError(f'Unknown operation: {op}')
+    check = BULK_OPERATIONS[op][1]
+    if check is None:
+        return op, None
+    try:
+        coerced = check(value)
+    except (TypeError, ValueError):
+        coerced = None
+    if coerced is None:
+        raise ValueError(f'Invalid value for {op}: {value!r}')
+    return op, coerced
+
+
+def bulk_update(conn, user_id, item_ids, operations):
+    """Apply operations, in order, to the items in item_ids that the user owns.
+
+    Runs in one transaction with one statement per operation, each limited
+    to the user's rows. Returns (updated_rows, deleted_ids).
+    """
+    ids_json = json.dumps([int(item_id) for item_id in item_ids])
+    selection = 'user_id = ? AND id IN (SELECT value FROM json_each(?))'
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        owned = [row[0] for row in conn.execute(
+            f'SELECT id FROM inventory WHERE {selection}', (user_id, ids_json))]
+        if owned:
+            for op, value in operations:
+                assignment = BULK_OPERATIONS[op][0]
+                if assignment is None:
+                    conn.execute(f'DELETE FROM inventory WHERE {selection}', (user_id, ids_json))
+                else:
+                    conn.execute(f'UPDATE inventory SET {assignment} WHERE {selection}',
+                                 (value, user_id, ids_json))
+        rows = conn.execute(f'SELECT * FROM inventory WHERE {selection} ORDER BY date_added DESC, id DESC',
+                            (user_id, ids_json)).fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    remaining = {row['id'] for row in rows}
+    return rows, [item_id for item_id in owned if item_id not in remaining]
@@ -0,0 +1,73 @@
+# Per-user inventory totals by category, sector and application. The
+# inventory_rollups table is kept current by triggers on inventory (migration 8),
+# so reading a summary costs O(distinct values) instead of a GROUP BY over
+# every item the user owns.
+DIMENSIONS = ('category', 'sector', 'application')
+
+# One scan of inventory, fanned out to the three dimensions
+ROLLUP_QUERY = '''
+    SELECT i.user_id, d.dimension,
+           CASE d.dimension WHEN 'category' THEN i.category
+                            WHEN 'sector' THEN i.sector
+                            ELSE i.application END AS value,
+           COUNT(*) AS item_count,
+           SUM(i.quantity) AS total_quantity
+    FROM inventory i,
+         (SELECT 'category' AS dimension UNION ALL SELECT 'sector' UNION ALL SELECT 'application') d
+    WHERE i.user_id IS NOT NULL
+    GROUP BY i.user_id, d.dimension, value
+'''
+
+
+def fetch_summary(conn, user_id):
+    """Return {'items': n, 'quantity': n, 'category': [...], 'sector': [...], 'application': [...]}."""
+    summary = {dimension: [] for dimension in DIMENSIONS}
+    rows = conn.execute('''
+        SELECT dimension, value, item_count, total_quantity
+        FROM inventory_rollups
+        WHERE user_id = ?
+        ORDER BY dimension, total_quantity DESC, value
+    ''', (user_id,))
+    for dimension, value, item_count, total_quantity in rows:
+        summary[dimension].append({'value': value, 'items': item_count, 'quantity': total_quantity})
+    # Every item has exactly one category, so the category rows add up to the totals
+    summary['items'] = sum(row['items'] for row in summary['category'])
+    summary['quantity'] = sum(row['quantity'] for row in summary['category'])
+    return summary
+
+
+def rebuild_rollups(conn):
+    """Recompute inventory_rollups from scratch and return the rows that had drifted.
+
+    Each drift entry is (user_id, dimension, value, stored (count, quantity),
+    expected (count, quantity)); None stands for a missing row.
+    """
+    conn.execute('DROP TABLE IF EXISTS temp.expected_rollups')
+    conn.execute(f'CREATE TEMP TABLE expected_rollups AS {ROLLUP_QUERY}')
+    drift = conn.execute('''
+        SELECT e.user_id, e.dimension, e.value, r.item_count, r.total_quantity,
+               e.item_count, e.total_quantity
+        FROM expected_rollups e
+        LEFT JOIN inventory_rollups r
+               ON r.user_id = e.user_id AND r.dimension = e.dimension AND r.value = e.value
+        WHERE r.item_count IS NOT e.item_count OR r.total_quantity IS NOT e.total_quantity
+        UNION ALL
+        SELECT r.user_id, r.dimension, r.value, r.item_count, r.total_quantity, NULL, NULL
+        FROM inventory_rollups r
+        WHERE NOT EXISTS (SELECT 1 FROM expected_rollups e
+                          WHERE e.user_id = r.user_id AND e.dimension = r.dimension AND e.value = r.value)
+    ''').fetchall()
+
+    with conn:
+        conn.execute('DELETE FROM inventory_rollups')
+        conn.execute('''
+            INSERT INTO inventory_rollups (user_id, dimension, value, item_count, total_quantity)
+            SELECT user_id, dimension, value, item_count, total_quantity FROM expected_rollups
+        ''')
+    conn.execute('DROP TABLE temp.expected_rollups')
+
+    return [(user_id, dimension, value,
+             None if stored_count is None else (stored_count, stored_quantity),
+             None if expected_count is None else (expected_count, expected_quantity))
+            for user_id, dimension, value, stored_count, stored_quantity, expected_count, expected_quantity
+            in drift]
@@ -0,0 +1,91 @@
+import re
+
+from markupsafe import Markup, escape
+
+# Full-text search over inventory_fts and crawl_fts (see migration 7).
+# Both tables carry an `owner` column holding a 'u<user_id>' token so the
+# per-user restriction is part of the FTS index lookup rather than a join
+# filter applied to every tenant's matches.
+INVENTORY_COLUMNS = ('name', 'category', 'sector', 'application')
+CRAWL_COLUMNS = ('url', 'markdown', 'fit_markdown')
+
+# Highlight markers that cannot occur in user text; swapped for <mark> after escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+
+def owner_token(user_id):
+    return f'u{user_id}'
+
+
+def build_match_query(text, columns):
+    """Turn free text into an FTS5 query: every word is a prefix match, all must occur."""
+    words = re.findall(r'\w+', text or '', flags=re.UNICODE)
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"*' for word in words)
+    return '{%s}: (%s)' % (' '.join(columns), terms)
+
+
+def highlight(value):
+    """Jinja filter: escape an FTS highlight/snippet and render its markers as <mark>."""
+    if value is None:
+        return ''
+    return Markup(str(escape(value)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_inventory(conn, user_id, text, limit=20, offset=0):
+    query = build_match_query(text, INVENTORY_COLUMNS)
+    if query is None:
+        return []
+    # bm25 weights: owner 0, name 10, category/sector 2, application 1
+    return conn.execute(f'''
+        SELECT i.id, i.quantity, i.date_added,
+               highlight(inventory_fts, 1, '{MARK_START}', '{MARK_END}') AS name,
+               highlight(inventory_fts, 2, '{MARK_START}', '{MARK_END}') AS category,
+               highlight(inventory_fts, 3, '{MARK_START}', '{MARK_END}') AS sector,
+               highlight(inventory_fts, 4, '{MARK_START}', '{MARK_END}') AS application
+        FROM inventory_fts
+        JOIN inventory i ON i.id = inventory_fts.rowid
+        WHERE inventory_fts MATCH ?
+        ORDER BY bm25(inventory_fts, 0.0, 10.0, 2.0, 2.0, 1.0)
+        LIMIT ? OFFSET ?
+    ''', (f'owner:{owner_token(user_id)} AND {query}', limit, offset)).fetchall()
+
+
+def search_crawls(conn, user_id, text, limit=20, offset=0):
+    query = build_match_query(text, CRAWL_COLUMNS)
+    if query is None:
+        return []
+    # bm25 weights: owner 0, url 5, markdown 1, fit_markdown 2
+    return conn.execute(f'''
+        SELECT c.id, c.url, c.crawl_date,
+               snippet(crawl_fts, 2, '{MARK_START}', '{MARK_END}', '...', 24) AS snippet
+        FROM crawl_fts
+        JOIN crawled_data c ON c.id = crawl_fts.rowid
+        WHERE crawl_fts MATCH ?
+        ORDER BY bm25(crawl_fts, 0.0, 5.0, 1.0, 2.0)
+        LIMIT ? OFFSET ?
+    ''', (f'owner:{owner_token(user_id)} AND {query}', limit, offset)).fetchall()
+
+
+def index_crawl(conn, crawl_id, crawl_data=None, source_id=None):
+    """Refresh crawl_fts for one crawl from its result, or copy the entry of source_id.
+
+    Crawl bodies are stored compressed, so unlike inventory_fts this side
+    cannot be maintained by an SQL trigger; crawl_store calls it on write.
+    """
+    conn.execute('DELETE FROM crawl_fts WHERE rowid = ?', (crawl_id,))
+    if source_id is not None:
+        conn.execute('''
+            INSERT INTO crawl_fts (rowid, owner, url, markdown, fit_markdown)
+            SELECT c.id, 'u' || c.user_id, c.url, f.markdown, f.fit_markdown
+            FROM crawled_data c, crawl_fts f
+            WHERE c.id = ? AND f.rowid = ?
+        ''', (crawl_id, source_id))
+    elif crawl_data is not None:
+        conn.execute('''
+            INSERT INTO crawl_fts (rowid, owner, url, markdown, fit_markdown)
+            SELECT id, 'u' || user_id, url, ?, ?
+            FROM crawled_data WHERE id = ?
+        ''', (crawl_data.get('markdown'), crawl_data.get('fit_markdown'), crawl_id))
@@ -1,3 +1,4 @@
+import io
 import unittest
 from app import app
 
@@ -80,8 +81,19 @@ class FlaskAppTests(unittest.TestCase):
         self.assertIn(b'Item successfully added!', response.data)
 
     def test_upload_csv(self):
-        # This test would require a valid CSV file to be uploaded
-        pass  # Implement CSV upload test
+        self.app.post('/login', data={
+            'username': self.test_username,
+            'password': self.test_password
+        })
+        csv_file = io.BytesIO(b'Widget,5,tools,Garage,Repair,2024-12-21 16:16:53\n'
+                              b'Broken,not-a-number,tools,Garage,Repair\n')
+        response = self.app.post('/upload_csv', data={'file': (csv_file, 'items.csv')},
+                                 headers={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        report = response.get_json()
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['failed'], 1)
+        self.assertEqual(report['errors'][0]['line'], 2)
 
     def test_logout(self):
         self.app.post('/login', data={
@@ -0,0 +1,227 @@
+import asyncio
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import FileStorage
+
+import asgi
+from asgi import app
+from database import init_db
+from queries import RowStream
+
+
+class AsgiAppTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True, CRAWL_IN_PROCESS=False)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        conn.executemany('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES (?, 1, 'tools', 'lab', 'app', ?)
+        ''', [('hammer', 1), ('wrench', 1), ('other-user', 2)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        executor = app.extensions.pop('db_executor', None)
+        if executor is not None:
+            executor.shutdown()
+        pool = app.extensions.pop('db_pool', None)
+        if pool is not None:
+            pool.close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    async def logged_in_client(self):
+        client = app.test_client()
+        async with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+        return client
+
+    def test_login_required_redirects(self):
+        async def run():
+            response = await app.test_client().get('/dashboard')
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('/login', response.headers['Location'])
+        asyncio.run(run())
+
+    def test_register_and_login(self):
+        async def run():
+            client = app.test_client()
+            response = await client.post('/register', form={
+                'username': 'new', 'password': 'secret', 'email': 'new@example.com'})
+            self.assertEqual(response.status_code, 302)
+            response = await client.post('/login', form={'username': 'new', 'password': 'secret'})
+            self.assertEqual(response.status_code, 302)
+            self.assertIn('/dashboard', response.headers['Location'])
+        asyncio.run(run())
+
+    def test_dashboard_lists_only_own_items(self):
+        async def run():
+            client = await self.logged_in_client()
+            response = await client.get('/dashboard')
+            body = await response.get_data(as_text=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('hammer', body)
+            self.assertNotIn('other-user', body)
+        asyncio.run(run())
+
+    def test_events_resume_from_the_rendered_change_id(self):
+        app.config.update(SSE_MAX_SECONDS=0.2, SSE_POLL_INTERVAL=0.01)
+
+        async def run():
+            client = await self.logged_in_client()
+            body = await (await client.get('/dashboard')).get_data(as_text=True)
+            self.assertIn('sse-connect="/events?after=2"', body)
+            await client.put('/update_quantity/1', form={'value': '7'})
+            body = await (await client.get('/events?after=2')).get_data(as_text=True)
+            self.assertIn('event: inventory', body)
+            self.assertIn('hammer', body)
+        asyncio.run(run())
+
+    def test_update_and_delete_item(self):
+        async def run():
+            client = await self.logged_in_client()
+            response = await client.put('/update_quantity/1', form={'value': '7'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('7', await response.get_data(as_text=True))
+            self.assertEqual((await client.put('/update_quantity/3', form={'value': '7'})).status_code, 404)
+            self.assertEqual((await client.delete('/delete_item/2')).status_code, 204)
+            self.assertEqual((await client.delete('/delete_item/2')).status_code, 404)
+        asyncio.run(run())
+
+    def test_unchanged_partial_is_revalidated(self):
+        async def run():
+            client = await self.logged_in_client()
+            etag = (await client.get('/inventory/rows')).headers['ETag']
+            response = await client.get('/inventory/rows', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            await client.delete('/delete_item/1')
+            response = await client.get('/inventory/rows', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('hammer', await response.get_data(as_text=True))
+        asyncio.run(run())
+
+    def test_bulk_update_returns_oob_rows(self):
+        async def run():
+            client = await self.logged_in_client()
+            response = await client.post('/inventory/bulk', form={'ids': '1', 'op': 'adjust_quantity', 'value': '4'})
+            body = await response.get_data(as_text=True)
+            self.assertIn('hx-swap-oob="true"', body)
+            self.assertIn('5', body)
+            self.assertEqual(response.headers['HX-Trigger'], 'inventory-changed')
+        asyncio.run(run())
+
+    def test_export_streams_csv(self):
+        async def run():
+            client = await self.logged_in_client()
+            response = await client.get('/export/inventory?columns=name')
+            self.assertEqual((await response.get_data(as_text=True)).split(), ['name', 'hammer', 'wrench'])
+        asyncio.run(run())
+
+    def test_url_list_queues_a_batch(self):
+        async def run():
+            client = await self.logged_in_client()
+            response = await client.post('/crawl', form={'urls': 'http://a.test/1\nhttp://b.test/2'})
+            progress = await client.get(response.headers['Location'], headers={'Accept': 'application/json'})
+            self.assertEqual((await progress.get_json())['counts']['queued'], 2)
+        asyncio.run(run())
+
+    def test_upload_csv_returns_json_report(self):
+        async def run():
+            client = await self.logged_in_client()
+            data = b'name,quantity,category,sector,application\nsaw,3,tools,lab,cut\nbad,x,tools,lab,cut\n'
+            response = await client.post('/upload_csv', headers={'Accept': 'application/json'},
+                                          files={'file': FileStorage(io.BytesIO(data), filename='items.csv')})
+            report = await response.get_json()
+            self.assertEqual(report['imported'], 1)
+            self.assertEqual(report['failed'], 1)
+        asyncio.run(run())
+
+    def test_list_pages_stream_and_return_their_connection(self):
+        async def run():
+            app.config['INVENTORY_PAGE_SIZE'] = 1
+            client = await self.logged_in_client()
+            response = await client.get('/dashboard')
+            body = await response.get_data(as_text=True)
+            self.assertIn('wrench', body)
+            self.assertNotIn('hammer', body)
+            # next_cursor is only known once the rows have been iterated
+            self.assertIn('cursor_id=2', body)
+            pool = app.extensions['db_pool']
+            self.assertEqual(pool._idle.qsize(), pool._created)
+
+            etag = response.headers['ETag']
+            cached = await client.get('/dashboard')
+            self.assertEqual(await cached.get_data(as_text=True), body)
+            self.assertEqual((await client.get('/dashboard', headers={'If-None-Match': etag})).status_code, 304)
+        asyncio.run(run())
+
+    def test_async_rows_read_batches_on_the_executor(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.execute('CREATE TABLE t (n INTEGER)')
+        conn.executemany('INSERT INTO t VALUES (?)', [(n,) for n in range(250)])
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+        async def run():
+            rows = RowStream(conn.execute('SELECT n FROM t ORDER BY n'), limit=200, key=lambda row: row[0])
+            await asyncio.get_running_loop().run_in_executor(executor, bool, rows)
+            stream = asgi.AsyncRows(rows, executor)
+            self.assertTrue(stream)
+            seen = [row[0] async for row in stream]
+            self.assertEqual(seen, list(range(200)))
+            self.assertEqual(stream.next_cursor, 199)
+        try:
+            asyncio.run(run())
+        finally:
+            executor.shutdown()
+            conn.close()
+
+    def test_pool_and_hasher_follow_pid_and_settings(self):
+        async def run():
+            pool = await asyncio.get_running_loop().run_in_executor(None, asgi.get_pool)
+            pool.pid = -1  # as if inherited from a parent process
+            self.assertIsNot(asgi.get_pool(), pool)
+            hasher = asgi.get_hasher()
+            self.assertIs(asgi.get_hasher(), hasher)
+            app.config['PASSWORD_HASH_MAX_PENDING'] += 1
+            self.assertIsNot(asgi.get_hasher(), hasher)
+            app.extensions.pop('password_hasher').close()
+        asyncio.run(run())
+
+    def test_in_process_worker_completes_queued_crawls(self):
+        async def fetch(url):
+            return {'url': url, 'markdown': '# hi', 'links': []}
+
+        async def run():
+            app.config.update(CRAWL_IN_PROCESS=True, CRAWL_FETCH=fetch, CRAWL_CACHE_TTL=0)
+            async with app.test_app() as test_app:
+                client = test_app.test_client()
+                async with client.session_transaction() as sess:
+                    sess['user_id'] = 1
+                await client.post('/crawl', form={'url': 'http://example.test/'})
+                for _ in range(500):
+                    response = await client.get('/crawl-status/1')
+                    if 'completed' in await response.get_data(as_text=True):
+                        break
+                    await asyncio.sleep(0.01)
+                else:
+                    self.fail('crawl was not completed by the in-process worker')
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import urllib.request
+from unittest import mock
+
+import benchmark
+from app import app
+
+
+class BenchmarkTests(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, 'bench.db')
+        self.original_config = dict(app.config)
+
+    def tearDown(self):
+        pool = app.extensions.get('db_pool')
+        if pool is not None:
+            pool.close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for name in os.listdir(self.workdir):
+            os.remove(os.path.join(self.workdir, name))
+        os.rmdir(self.workdir)
+
+    def test_seed_database_is_deterministic(self):
+        benchmark.seed_database(self.db_path, users=2, items=30, crawls=3, seed=7)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            counts = conn.execute('''
+                SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM inventory),
+                       (SELECT COUNT(*) FROM crawled_data WHERE status = 'completed')
+            ''').fetchone()
+            first_item = conn.execute('SELECT name, quantity FROM inventory ORDER BY id LIMIT 1').fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(counts, (2, 60, 6))
+        self.assertEqual(first_item[0], 'LED TV Samsung #0')
+
+    def test_scenarios_report_latency_percentiles(self):
+        benchmark.seed_database(self.db_path, users=2, items=30, crawls=2)
+        results = benchmark.run_benchmarks(self.db_path, drivers=('client', 'server'),
+                                           requests=6, concurrency=2)
+        self.assertEqual(len(results), len(benchmark.SCENARIOS) * 2)
+        for key, metrics in results.items():
+            self.assertEqual((metrics['requests'], metrics['errors']), (6, 0), key)
+            self.assertLessEqual(metrics['p50_ms'], metrics['p99_ms'])
+
+    def test_cold_scenarios_miss_the_fragment_cache(self):
+        benchmark.seed_database(self.db_path, users=1, items=10, crawls=1)
+        conn = sqlite3.connect(self.db_path)
+        version = lambda: conn.execute('SELECT version FROM user_data_versions').fetchone()[0]
+        try:
+            before = version()
+            results = benchmark.run_benchmarks(self.db_path, scenarios=('dashboard', 'dashboard_cold'),
+                                               requests=4)
+            self.assertEqual(version(), before + 4)
+        finally:
+            conn.close()
+        self.assertEqual(results['dashboard_cold/client']['errors'], 0)
+        self.assertGreaterEqual(results['dashboard_cold/client']['peak_rss_growth_kb'], 0)
+
+    def test_server_driver_counts_connection_errors(self):
+        benchmark.seed_database(self.db_path, users=1, items=5, crawls=1)
+        real_open = urllib.request.OpenerDirector.open
+
+        def open_url(opener, url, *args, **kwargs):
+            # Let the login through, then drop every benchmarked request
+            if isinstance(url, urllib.request.Request) and url.full_url.endswith('/crawl-history'):
+                raise ConnectionResetError('reset by peer')
+            return real_open(opener, url, *args, **kwargs)
+
+        with mock.patch.object(urllib.request.OpenerDirector, 'open', open_url):
+            results = benchmark.run_benchmarks(self.db_path, scenarios=('crawl_history',),
+                                               drivers=('server',), requests=4, concurrency=2)
+        self.assertEqual(results['crawl_history/server']['errors'], 4)
+
+    def test_compare_flags_only_regressions_past_threshold(self):
+        baseline = {'dashboard/client': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'rps': 100.0}}
+        current = {'dashboard/client': {'p50_ms': 11.0, 'p95_ms': 30.0, 'p99_ms': 30.0, 'rps': 50.0}}
+        regressions = benchmark.compare(current, baseline, threshold=0.2)
+        self.assertEqual([(key, metric) for key, metric, _, _ in regressions],
+                         [('dashboard/client', 'p95_ms'), ('dashboard/client', 'rps')])
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app import app
+from database import init_db
+
+
+class BulkUpdateTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True)
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        self.conn.executemany('''
+            INSERT INTO inventory (id, name, quantity, category, sector, application, user_id)
+            VALUES (?, ?, ?, 'tools', 'lab', 'app', ?)
+        ''', [(1, 'hammer', 5, 1), (2, 'wrench', 2, 1), (3, 'drill', 4, 1), (4, 'theirs', 9, 2)])
+        self.conn.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        self.conn.close()
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def quantities(self):
+        return dict(self.conn.execute('SELECT id, quantity FROM inventory'))
+
+    def test_form_returns_oob_rows_for_owned_items_only(self):
+        response = self.client.post('/inventory/bulk', data={
+            'ids': ['1', '2', '4'], 'op': 'set_quantity', 'value': '7'})
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['HX-Trigger'], 'inventory-changed')
+        self.assertEqual(body.count('hx-swap-oob="true"'), 2)
+        self.assertIn('id="item-1"', body)
+        self.assertNotIn('drill', body)
+        self.assertEqual(self.quantities(), {1: 7, 2: 7, 3: 4, 4: 9})
+
+    def test_delete_returns_oob_deletes(self):
+        response = self.client.post('/inventory/bulk', data={'ids': ['2', '4'], 'op': 'delete'})
+        self.assertIn('<tr id="item-2" hx-swap-oob="delete">', response.get_data(as_text=True))
+        self.assertEqual(set(self.quantities()), {1, 3, 4})
+
+    def test_json_applies_operations_in_one_request(self):
+        response = self.client.post('/inventory/bulk', headers={'Accept': 'application/json'}, json={
+            'ids': [1, 2, 3],
+            'operations': [{'op': 'adjust_quantity', 'value': -3},
+                           {'op': 'set_category', 'value': 'hand tools'}],
+        })
+        self.assertEqual(response.get_json(), {'updated': [3, 2, 1], 'deleted': []})
+        self.assertEqual(self.quantities(), {1: 2, 2: 0, 3: 1, 4: 9})
+        categories = {row[0] for row in self.conn.execute('SELECT category FROM inventory WHERE user_id = 1')}
+        self.assertEqual(categories, {'hand tools'})
+
+    def test_invalid_operation_changes_nothing(self):
+        for data in ({'ids': ['1'], 'op': 'rename'},
+                     {'ids': ['1'], 'op': 'set_quantity', 'value': '-1'},
+                     {'ids': [], 'op': 'delete'}):
+            self.assertEqual(self.client.post('/inventory/bulk', data=data).status_code, 400)
+        self.assertEqual(self.quantities(), {1: 5, 2: 2, 3: 4, 4: 9})
+
+
+if __name__ == '__main__':
+    unittest.main()
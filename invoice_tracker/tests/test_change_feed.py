@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from app import app
+from change_feed import coalesce, latest_change_id, poll, prune_change_feed, sse_message
+from database import init_db
+
+
+class ChangeFeedTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def add_item(self, name, user_id=1):
+        cursor = self.conn.execute('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES (?, 1, 'cat', 'lab', 'app', ?)
+        ''', (name, user_id))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def feed(self):
+        return [tuple(row) for row in self.conn.execute(
+            'SELECT user_id, entity, entity_id, op FROM change_feed ORDER BY id')]
+
+    def test_triggers_record_inventory_and_crawl_writes(self):
+        item = self.add_item('a')
+        self.conn.execute('UPDATE inventory SET quantity = 2 WHERE id = ?', (item,))
+        self.conn.execute('DELETE FROM inventory WHERE id = ?', (item,))
+        cursor = self.conn.execute('''
+            INSERT INTO crawled_data (user_id, url, crawl_data, status) VALUES (1, 'http://a.test/', '{}', 'queued')
+        ''')
+        crawl = cursor.lastrowid
+        self.conn.execute("UPDATE crawled_data SET status = 'completed' WHERE id = ?", (crawl,))
+        # Columns the history row does not show are not worth a patch
+        self.conn.execute("UPDATE crawled_data SET crawl_data = '[]' WHERE id = ?", (crawl,))
+        self.conn.commit()
+
+        self.assertEqual(self.feed(), [
+            (1, 'inventory', item, 'insert'),
+            (1, 'inventory', item, 'update'),
+            (1, 'inventory', item, 'delete'),
+            (1, 'crawl', crawl, 'insert'),
+            (1, 'crawl', crawl, 'update'),
+        ])
+
+    def test_coalesce_keeps_insert_and_last_op(self):
+        changes = [(1, 'inventory', 5, 'insert'), (2, 'inventory', 5, 'update'),
+                   (3, 'inventory', 6, 'update'), (4, 'inventory', 6, 'delete')]
+        self.assertEqual(coalesce(changes), {('inventory', 5): 'insert', ('inventory', 6): 'delete'})
+
+    def test_poll_returns_only_the_users_rows(self):
+        start = latest_change_id(self.conn, 1)
+        kept = self.add_item('kept')
+        gone = self.add_item('gone')
+        self.add_item('other', user_id=2)
+        self.conn.execute('DELETE FROM inventory WHERE id = ?', (gone,))
+        self.conn.commit()
+
+        last_id, patches = poll(self.conn, 1, start)
+        self.assertEqual(last_id, latest_change_id(self.conn, 1))
+        (op, row_id, row), (gone_op, gone_id, gone_row) = patches['inventory']
+        self.assertEqual((op, row_id, row['name']), ('insert', kept, 'kept'))
+        self.assertEqual((gone_op, gone_id, gone_row), ('delete', gone, None))
+        self.assertEqual(poll(self.conn, 1, last_id), (last_id, {}))
+
+    def test_poll_asks_for_reload_after_bulk_changes(self):
+        for i in range(5):
+            self.add_item(f'item{i}')
+        self.assertIsNone(poll(self.conn, 1, 0, max_patches=3)[1])
+        last_id, patches = poll(self.conn, 1, 0, limit=2)
+        self.assertIsNone(patches)
+        self.assertEqual(last_id, latest_change_id(self.conn, 1))
+
+    def test_prune_change_feed(self):
+        self.add_item('a')
+        self.conn.execute("UPDATE change_feed SET changed_at = datetime('now', '-2 days')")
+        self.add_item('b')
+        self.assertEqual(prune_change_feed(self.conn, 24), 1)
+
+    def test_sse_message_prefixes_every_data_line(self):
+        self.assertEqual(sse_message('<tr>\n</tr>', event='crawl', event_id=7),
+                         'id: 7\nevent: crawl\ndata: <tr>\ndata: </tr>\n\n')
+        self.assertEqual(sse_message(retry=2000), 'retry: 2000\n\n')
+
+
+class EventsStreamTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True,
+                          SSE_POLL_INTERVAL=0.01, SSE_MAX_SECONDS=0.5)
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_stream_resumes_after_last_event_id(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES ('widget', 3, 'cat', 'lab', 'app', 1)
+        ''')
+        conn.commit()
+        conn.close()
+
+        response = self.client.get('/events', headers={'Last-Event-ID': '0'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn('retry: ', body)
+        self.assertIn('event: inventory', body)
+        self.assertIn('hx-swap-oob="afterbegin:#inventory-rows"', body)
+        self.assertIn('widget', body)
+        # Without Last-Event-ID the stream starts at the present
+        response = self.client.get('/events')
+        self.assertNotIn('widget', response.get_data(as_text=True))
+
+    def test_new_stream_resumes_from_the_rendered_change_id(self):
+        body = self.client.get('/dashboard').get_data(as_text=True)
+        self.assertIn('sse-connect="/events?after=0"', body)
+        conn = sqlite3.connect(self.db_path)
+        # Committed after the page rendered but before the EventSource connected
+        conn.execute('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES ('late', 1, 'cat', 'lab', 'app', 1)
+        ''')
+        conn.commit()
+        conn.close()
+
+        body = self.client.get('/events?after=0').get_data(as_text=True)
+        self.assertIn('event: inventory', body)
+        self.assertIn('late', body)
+        # A reconnect's Last-Event-ID wins over the page's id
+        body = self.client.get('/events?after=0', headers={'Last-Event-ID': '1'}).get_data(as_text=True)
+        self.assertNotIn('late', body)
+        self.assertTrue(body.startswith('id: 1\nretry: '))
+        self.assertIn('sse-connect="/events?after=1"', self.client.get('/crawl-history').get_data(as_text=True))
+
+    def test_wsgi_stream_answers_one_poll_by_default(self):
+        app.config.update(SSE_POLL_INTERVAL=5, SSE_MAX_SECONDS=300)
+        started = time.monotonic()
+        body = self.client.get('/events').get_data(as_text=True)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIn('retry: ', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import asyncio
+import gzip
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import crawl_jobs
+from app import app
+from crawl_batches import fetch, parse_sitemap, parse_url_list, read_sitemap, sitemap_urls
+from crawl_worker import CrawlWorker
+from database import init_db
+
+PAGES = [f'/docs/page-{i}' for i in range(6)]
+
+
+class StaticSite(BaseHTTPRequestHandler):
+    # Serves a sitemap index, one child sitemap and a handful of pages
+    def do_GET(self):
+        base = f'http://{self.headers["Host"]}'
+        if self.path == '/sitemap.xml':
+            body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    f'<sitemap><loc>{base}/sitemap-docs.xml</loc></sitemap></sitemapindex>')
+        elif self.path in ('/sitemap-docs.xml', '/sitemap-docs.xml.gz'):
+            body = ('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                    + ''.join(f'<url><loc>{base}{page}</loc></url>' for page in PAGES) + '</urlset>')
+            if self.path.endswith('.gz'):
+                # Padded so it is far larger once decompressed than on the wire
+                body = gzip.compress(body.replace('</urlset>', ' ' * 10000 + '</urlset>').encode('utf-8'))
+        elif self.path in PAGES:
+            time.sleep(0.02)
+            body = f'<html><body>{self.path}</body></html>'
+        else:
+            self.send_error(404)
+            return
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class ParsingTests(unittest.TestCase):
+    def test_url_list_keeps_only_http_urls(self):
+        text = 'https://a.test/x\n  ftp://b.test/y  http://c.test/z\nnot-a-url\n'
+        self.assertEqual(parse_url_list(text), ['https://a.test/x', 'http://c.test/z'])
+
+    def test_sitemap_and_index_are_told_apart(self):
+        pages, children = parse_sitemap(b'<urlset><url><loc> http://a.test/1 </loc></url></urlset>')
+        self.assertEqual((pages, children), (['http://a.test/1'], []))
+        pages, children = parse_sitemap(
+            b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            b'<sitemap><loc>http://a.test/s.xml</loc></sitemap></sitemapindex>')
+        self.assertEqual((pages, children), ([], ['http://a.test/s.xml']))
+
+
+class BatchCrawlTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StaticSite)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.port = cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True, CRAWL_CACHE_TTL=0)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        self.conn.commit()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+    def tearDown(self):
+        self.conn.close()
+        pool = app.extensions.get('db_pool')
+        if pool is not None:
+            pool.close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def url(self, path, host='127.0.0.1'):
+        return f'http://{host}:{self.port}{path}'
+
+    def test_sitemap_index_is_followed_up_to_limit(self):
+        self.assertEqual(sitemap_urls(self.url('/sitemap.xml')), [self.url(page) for page in PAGES])
+        self.assertEqual(len(sitemap_urls(self.url('/sitemap.xml'), limit=4)), 4)
+
+    def test_sitemap_errors_become_messages_and_size_is_capped(self):
+        gzipped = self.url('/sitemap-docs.xml.gz')
+        self.assertEqual(read_sitemap(gzipped), [self.url(page) for page in PAGES])
+        for url in (self.url('/missing.xml'), 'http://127.0.0.1:notaport/sitemap.xml', 'http://a..test/sitemap.xml',
+                    'ftp://a.test/sitemap.xml', self.url('/docs/page-0')):
+            with self.assertRaises(ValueError, msg=url):
+                read_sitemap(url, timeout=2)
+        with self.assertRaisesRegex(ValueError, 'decompressed'):
+            read_sitemap(gzipped, max_bytes=2000)
+        with self.assertRaisesRegex(ValueError, 'more than 100 bytes'):
+            fetch(self.url('/sitemap-docs.xml'), 2, max_bytes=100)
+
+    def run_worker_until(self, batch_id, fetch=None):
+        async def page(url):
+            return {'url': url, 'html': '<p>x</p>', 'markdown': 'x', 'links': []}
+
+        async def run():
+            worker = CrawlWorker(self.db_path, concurrency=2, poll_interval=0.01, fetch=fetch or page,
+                                 write_interval=0.01)
+            serving = asyncio.ensure_future(worker.run())
+            while crawl_jobs.batch_progress(self.conn, batch_id, 1)['pending']:
+                await asyncio.sleep(0.02)
+            worker.stop()
+            await serving
+
+        asyncio.run(asyncio.wait_for(run(), timeout=20))
+        return crawl_jobs.batch_progress(self.conn, batch_id, 1)
+
+    def test_sitemap_form_queues_a_batch_the_worker_expands(self):
+        with mock.patch('crawl_batches.fetch') as fetch_sitemap:
+            response = self.client.post('/crawl', data={'sitemap': self.url('/sitemap.xml')})
+        fetch_sitemap.assert_not_called()
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/crawl-batch/', response.headers['Location'])
+
+        progress = self.client.get(response.headers['Location'], headers={'Accept': 'application/json'}).get_json()
+        self.assertEqual((progress['status'], progress['total']), ('queued', 0))
+        self.assertTrue(progress['pending'])
+        self.assertIn(b'Reading the sitemap', self.client.get(response.headers['Location']).data)
+
+        progress = self.run_worker_until(progress['id'])
+        self.assertEqual(progress['status'], 'ready')
+        self.assertEqual((progress['total'], progress['counts']['completed']), (len(PAGES), len(PAGES)))
+        hosts = {row[0] for row in self.conn.execute('SELECT host FROM crawled_data')}
+        self.assertEqual(hosts, {f'127.0.0.1:{self.port}'})
+
+    def test_url_list_is_deduplicated_and_bad_input_rejected(self):
+        urls = '\n'.join([self.url('/docs/page-0'), self.url('/docs/page-0#top'), self.url('/docs/page-1')])
+        self.client.post('/crawl', data={'urls': urls})
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM crawled_data').fetchone()[0], 2)
+
+        response = self.client.post('/crawl', data={'urls': 'not a url'}, follow_redirects=True)
+        self.assertIn(b'Could not start batch crawl', response.data)
+        response = self.client.post('/crawl', data={'sitemap': 'file:///etc/passwd'}, follow_redirects=True)
+        self.assertIn(b'Could not start batch crawl', response.data)
+
+    def test_unreadable_sitemap_fails_its_batch(self):
+        response = self.client.post('/crawl', data={'sitemap': self.url('/missing.xml')})
+        batch_id = int(response.headers['Location'].rstrip('/').rsplit('/', 1)[1])
+        # Polled once before the worker runs, so a cached "reading" page must not outlive the failure
+        self.assertIn(b'Reading the sitemap', self.client.get(f'/crawl-batch/{batch_id}').data)
+        progress = self.run_worker_until(batch_id)
+        self.assertEqual(progress['status'], 'failed')
+        self.assertIn('could not read sitemap', progress['error'])
+        self.assertFalse(progress['pending'])
+        self.assertIn(b'could not read sitemap', self.client.get(f'/crawl-batch/{batch_id}').data)
+
+    def test_claim_skips_busy_hosts(self):
+        first = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://a.test/1')
+        crawl_jobs.enqueue_crawl(self.conn, 1, 'http://a.test/2')
+        other = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://b.test/1')
+        self.assertEqual(crawl_jobs.claim_job(self.conn)['id'], first)
+        self.assertEqual(crawl_jobs.claim_job(self.conn, exclude_hosts=['a.test'])['id'], other)
+
+    def test_worker_respects_per_host_limit_and_batches_writes(self):
+        # Two hostnames for the same local server count as two sites
+        urls = [self.url(page, host) for page in PAGES for host in ('127.0.0.1', 'localhost')]
+        batch_id = crawl_jobs.enqueue_batch(self.conn, 1, urls, 'test')
+        active, peaks = {}, {}
+
+        async def fetch(url):
+            host = url.split('/')[2]
+            active[host] = active.get(host, 0) + 1
+            peaks[host] = max(peaks.get(host, 0), active[host])
+            try:
+                loop = asyncio.get_running_loop()
+                body = await loop.run_in_executor(None, lambda: urllib.request.urlopen(url).read())
+            finally:
+                active[host] -= 1
+            return {'url': url, 'html': body.decode(), 'markdown': body.decode(), 'links': []}
+
+        async def run():
+            worker = CrawlWorker(self.db_path, concurrency=4, poll_interval=0.01, fetch=fetch,
+                                 per_host=1, host_delay=0.01, write_batch_size=5, write_interval=0.05)
+            serving = asyncio.ensure_future(worker.run())
+            while crawl_jobs.batch_progress(self.conn, batch_id, 1)['pending']:
+                await asyncio.sleep(0.02)
+            worker.stop()
+            await serving
+
+        with mock.patch.object(crawl_jobs, 'record_results', wraps=crawl_jobs.record_results) as record:
+            asyncio.run(asyncio.wait_for(run(), timeout=20))
+
+        progress = crawl_jobs.batch_progress(self.conn, batch_id, 1)
+        self.assertEqual(progress['counts']['completed'], len(urls))
+        self.assertEqual(set(peaks.values()), {1})
+        self.assertEqual(len(peaks), 2)
+        self.assertLess(record.call_count, len(urls))
+
+
+if __name__ == '__main__':
+    unittest.main()
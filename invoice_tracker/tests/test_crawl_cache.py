@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import crawl_jobs
+from crawl_cache import is_not_modified, latest_crawl, normalize_url
+from crawl_worker import CrawlWorker
+from database import init_db
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b'<html><body>page</body></html>'
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NormalizeUrlTests(unittest.TestCase):
+    def test_equivalent_urls_share_a_key(self):
+        self.assertEqual(normalize_url('HTTP://Example.COM:80/a?b=2&a=1#top'),
+                         normalize_url('http://example.com/a?a=1&b=2'))
+        self.assertEqual(normalize_url('https://example.com'), 'https://example.com/')
+        self.assertNotEqual(normalize_url('http://example.com:8080/'), normalize_url('http://example.com/'))
+
+
+class CrawlCacheTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/page'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.fetched = []
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    async def fetch(self, url):
+        self.fetched.append(url)
+        return {'url': url, 'html': '<html><body>page</body></html>', 'markdown': 'page',
+                'links': [], 'status_code': 200, 'headers': {'ETag': StandInHandler.etag}}
+
+    def run_worker(self):
+        async def run():
+            worker = CrawlWorker(self.db_path, concurrency=2, poll_interval=0.01, fetch=self.fetch)
+            serving = asyncio.ensure_future(worker.run())
+            while self.conn.execute("SELECT COUNT(*) FROM crawled_data WHERE status IN ('queued', 'running')").fetchone()[0]:
+                await asyncio.sleep(0.01)
+            worker.stop()
+            await serving
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+
+    def cache_statuses(self):
+        return [row[0] for row in self.conn.execute('SELECT cache_status FROM crawled_data ORDER BY id')]
+
+    def test_conditional_request_against_stand_in(self):
+        self.assertTrue(is_not_modified(self.url, etag='"v1"'))
+        self.assertFalse(is_not_modified(self.url, etag='"v0"'))
+        self.assertFalse(is_not_modified('http://127.0.0.1:1/unreachable', etag='"v1"', timeout=1))
+
+    def test_fresh_crawl_is_served_from_cache(self):
+        crawl_jobs.enqueue_crawl(self.conn, 1, self.url, cache_ttl=3600)
+        self.run_worker()
+        job_id = crawl_jobs.enqueue_crawl(self.conn, 1, self.url + '#section', cache_ttl=3600)
+        self.assertEqual(crawl_jobs.get_job(self.conn, job_id, 1)['status'], crawl_jobs.COMPLETED)
+        self.assertEqual(self.cache_statuses(), ['miss', 'hit'])
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_cache_is_not_shared_between_users(self):
+        crawl_jobs.enqueue_crawl(self.conn, 1, self.url, cache_ttl=3600)
+        self.run_worker()
+        job_id = crawl_jobs.enqueue_crawl(self.conn, 2, self.url, cache_ttl=3600)
+        self.assertEqual(crawl_jobs.get_job(self.conn, job_id, 2)['status'], crawl_jobs.QUEUED)
+        self.assertIsNone(latest_crawl(self.conn, 2, normalize_url(self.url)))
+        # Nor is user 1's stored ETag used to revalidate user 2's crawl
+        self.run_worker()
+        self.assertEqual(self.cache_statuses(), ['miss', 'miss'])
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_stale_crawl_is_revalidated_and_body_shared(self):
+        crawl_jobs.enqueue_crawl(self.conn, 1, self.url, cache_ttl=0)
+        self.run_worker()
+        crawl_jobs.enqueue_crawl(self.conn, 1, self.url, cache_ttl=0)
+        self.run_worker()
+        self.assertEqual(self.cache_statuses(), ['miss', 'revalidated'])
+        self.assertEqual(len(self.fetched), 1)
+
+        StandInHandler.etag = '"v2"'
+        try:
+            crawl_jobs.enqueue_crawl(self.conn, 1, self.url, cache_ttl=0)
+            self.run_worker()
+        finally:
+            StandInHandler.etag = '"v1"'
+        self.assertEqual(self.cache_statuses(), ['miss', 'revalidated', 'miss'])
+        # The page body did not change, so all three crawls point at one blob
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM crawl_blobs').fetchone()[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
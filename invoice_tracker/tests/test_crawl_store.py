@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app import app
+from crawl_store import compress, decompress, load_crawl_data, store_crawl_data
+from database import MIGRATIONS, migrate
+
+CRAWL_DATA = {
+    'url': 'http://example.test',
+    'html': '<html><body>' + '<p>hello world</p>' * 500 + '</body></html>',
+    'cleaned_html': '<p>hello world</p>',
+    'markdown': 'hello world\n' * 500,
+    'fit_markdown': 'hello world',
+    'links': ['http://example.test/a', 'http://example.test/b'],
+    'status_code': 200,
+    'headers': {'etag': '"abc"'},
+    'timestamp': '2024-12-21T16:16:53',
+}
+
+
+class CrawlStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        self.conn.execute("INSERT INTO crawled_data (id, user_id, url, crawl_data, status) "
+                          "VALUES (1, 1, 'http://example.test', '{}', 'completed')")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_compression_round_trip(self):
+        codec, payload, raw_bytes = compress(CRAWL_DATA)
+        self.assertLess(len(payload), raw_bytes // 10)
+        self.assertEqual(decompress(codec, payload), CRAWL_DATA)
+
+    def test_store_fills_metadata_and_payload(self):
+        store_crawl_data(self.conn, 1, CRAWL_DATA)
+        row = self.conn.execute('SELECT status_code, html_bytes, link_count, etag '
+                                'FROM crawled_data WHERE id = 1').fetchone()
+        self.assertEqual(row, (200, len(CRAWL_DATA['html']), 2, '"abc"'))
+        envelope = json.loads(self.conn.execute('SELECT crawl_data FROM crawled_data WHERE id = 1').fetchone()[0])
+        self.assertNotIn('html', envelope)
+        self.assertEqual(load_crawl_data(self.conn, 1), CRAWL_DATA)
+        self.assertEqual(load_crawl_data(self.conn, 2), {})
+
+    def test_identical_bodies_are_stored_once(self):
+        self.conn.execute("INSERT INTO crawled_data (id, user_id, url, crawl_data, status) "
+                          "VALUES (2, 2, 'http://example.test/', '{}', 'completed')")
+        store_crawl_data(self.conn, 1, CRAWL_DATA)
+        store_crawl_data(self.conn, 2, dict(CRAWL_DATA, timestamp='2025-01-01T00:00:00'))
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM crawl_blobs').fetchone()[0], 1)
+        self.assertEqual(load_crawl_data(self.conn, 2)['timestamp'], '2025-01-01T00:00:00')
+
+        store_crawl_data(self.conn, 2, dict(CRAWL_DATA, markdown='changed'))
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM crawl_blobs').fetchone()[0], 2)
+
+    def test_migration_moves_inline_json(self):
+        conn = sqlite3.connect(':memory:')
+        migrate(conn, [m for m in MIGRATIONS if m[0] < 5])
+        conn.execute("INSERT INTO crawled_data (user_id, url, crawl_data, status) VALUES (1, 'u', ?, 'completed')",
+                     (json.dumps(dict(CRAWL_DATA, markdown='caf\u00e9 ' * 10)),))
+        conn.execute("INSERT INTO inventory (name, quantity, category, sector, application, user_id) "
+                     "VALUES ('LED TV', 3, 'TV', 'Home', 'Living room', 1)")
+        conn.commit()
+        migrate(conn)
+        self.assertEqual(conn.execute('SELECT normalized_url, link_count, status_code, markdown_bytes, etag '
+                                      'FROM crawled_data').fetchone(), ('u', 2, 200, 60, '"abc"'))
+        self.assertEqual(load_crawl_data(conn, 1), dict(CRAWL_DATA, markdown='caf\u00e9 ' * 10))
+        self.assertEqual(conn.execute("SELECT rowid FROM crawl_fts WHERE crawl_fts MATCH 'cafe'").fetchall(), [(1,)])
+        self.assertEqual(conn.execute("SELECT item_count, total_quantity FROM inventory_rollups "
+                                      "WHERE dimension = 'sector'").fetchone(), (1, 3))
+        conn.close()
+
+
+class CrawlPagesTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.db_path)
+        migrate(conn)
+        conn.execute("INSERT INTO crawled_data (id, user_id, url, crawl_data, status) "
+                     "VALUES (1, 1, 'http://example.test', '{}', 'completed')")
+        store_crawl_data(conn, 1, CRAWL_DATA)
+        conn.commit()
+        conn.close()
+        self.original_database = app.config['DATABASE']
+        app.config['DATABASE'] = self.db_path
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config['DATABASE'] = self.original_database
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_history_lists_metadata_only(self):
+        response = self.client.get('/crawl-history')
+        self.assertIn(b'http://example.test', response.data)
+        self.assertNotIn(b'hello world', response.data)
+
+    def test_details_decompresses_payload(self):
+        response = self.client.get('/crawl-details/1')
+        self.assertIn(b'http://example.test/b', response.data)
+        self.assertIn(b'hello world', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
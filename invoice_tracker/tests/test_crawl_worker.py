@@ -0,0 +1,118 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import crawl_jobs
+from app import app
+from crawl_worker import CrawlWorker
+from database import init_db
+
+
+class CrawlQueueTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def status(self, job_id):
+        return self.conn.execute('SELECT status FROM crawled_data WHERE id = ?', (job_id,)).fetchone()[0]
+
+    def run_worker(self, fetch, concurrency=2):
+        async def run():
+            worker = CrawlWorker(self.db_path, concurrency=concurrency, poll_interval=0.01, fetch=fetch)
+            serving = asyncio.ensure_future(worker.run())
+            while self.conn.execute("SELECT COUNT(*) FROM crawled_data WHERE status IN ('queued', 'running')").fetchone()[0]:
+                await asyncio.sleep(0.01)
+            worker.stop()
+            await serving
+        asyncio.run(asyncio.wait_for(run(), timeout=10))
+
+    def test_jobs_are_claimed_once_in_order(self):
+        first = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://a.test')
+        second = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://b.test')
+        self.assertEqual(crawl_jobs.claim_job(self.conn)['id'], first)
+        self.assertEqual(crawl_jobs.claim_job(self.conn)['id'], second)
+        self.assertIsNone(crawl_jobs.claim_job(self.conn))
+        self.assertEqual(self.status(first), crawl_jobs.RUNNING)
+
+    def test_worker_runs_jobs_concurrently_up_to_limit(self):
+        ids = [crawl_jobs.enqueue_crawl(self.conn, 1, f'http://{i}.test') for i in range(6)]
+        in_flight = []
+        peak = []
+
+        async def fetch(url):
+            in_flight.append(url)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.05)
+            in_flight.remove(url)
+            if url == 'http://3.test':
+                raise RuntimeError('boom')
+            return {'url': url, 'links': []}
+
+        self.run_worker(fetch, concurrency=3)
+        self.assertEqual(max(peak), 3)
+        statuses = [self.status(job_id) for job_id in ids]
+        self.assertEqual(statuses.count(crawl_jobs.COMPLETED), 5)
+        error = self.conn.execute('SELECT error FROM crawled_data WHERE id = ?', (ids[3],)).fetchone()[0]
+        self.assertEqual(error, 'boom')
+
+    def test_stale_running_jobs_are_requeued(self):
+        job_id = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://a.test')
+        crawl_jobs.claim_job(self.conn)
+        self.conn.execute("UPDATE crawled_data SET started_at = datetime('now', '-1 hour') WHERE id = ?", (job_id,))
+        self.conn.commit()
+        self.assertEqual(crawl_jobs.requeue_stale_jobs(self.conn, older_than_seconds=60), 1)
+        self.assertEqual(self.status(job_id), crawl_jobs.QUEUED)
+
+
+class CrawlRouteTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.original_database = app.config['DATABASE']
+        app.config['DATABASE'] = self.db_path
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config['DATABASE'] = self.original_database
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_crawl_is_queued_and_polled(self):
+        response = self.client.post('/crawl', data={'url': 'http://example.test'})
+        self.assertEqual(response.status_code, 302)
+
+        history = self.client.get('/crawl-history')
+        self.assertIn(b'http://example.test', history.data)
+        # The history page gets status changes pushed over /events instead of polling
+        self.assertIn(b'sse-connect="/events?after=1"', history.data)
+        self.assertNotIn(b'hx-trigger="every 2s"', history.data)
+
+        conn = sqlite3.connect(self.db_path)
+        job_id = conn.execute('SELECT id FROM crawled_data').fetchone()[0]
+        conn.execute("UPDATE crawled_data SET status = 'completed' WHERE id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+
+        status = self.client.get(f'/crawl-status/{job_id}')
+        self.assertIn(b'completed', status.data)
+        self.assertNotIn(b'hx-trigger', status.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import re
+import sqlite3
+import tempfile
+import unittest
+
+from app import app
+from queries import iter_inventory_page
+from database import init_db
+
+
+class DashboardPaginationTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, INVENTORY_PAGE_SIZE=4, TESTING=True)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        # Several items share a timestamp so the id tie-breaker matters
+        conn.executemany('''
+            INSERT INTO inventory (name, quantity, category, sector, application, date_added, user_id)
+            VALUES (?, 1, ?, ?, 'app', ?, ?)
+        ''', [(f'item{i}', 'even' if i % 2 == 0 else 'odd', 'lab',
+               f'2024-01-0{1 + i // 3} 00:00:00', 1) for i in range(10)] +
+             [('other-user', 'even', 'lab', '2024-01-01 00:00:00', 2)])
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_pages_cover_every_item_once_in_order(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        seen, cursor = [], None
+        while True:
+            page = iter_inventory_page(conn, 1, cursor=cursor, limit=4)
+            seen.extend(row['name'] for row in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        conn.close()
+        expected = sorted((f'item{i}' for i in range(10)),
+                          key=lambda name: (int(name[4:]) // 3, int(name[4:])), reverse=True)
+        self.assertEqual(seen, expected)
+
+    def test_row_stream_reads_rows_only_as_iterated(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        page = iter_inventory_page(conn, 1, limit=4)
+        self.assertTrue(page)
+        self.assertIsNone(page.next_cursor)
+        names = [row['name'] for row in page]
+        self.assertEqual(len(names), 4)
+        self.assertIsNotNone(page.next_cursor)
+        self.assertFalse(iter_inventory_page(conn, 3, limit=4))
+        conn.close()
+
+    def test_dashboard_renders_first_page_with_sentinel(self):
+        response = self.client.get('/dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.data.count(b'hx-delete='), 4)
+        self.assertIn(b'hx-trigger="revealed"', response.data)
+
+    def test_scroll_follows_cursor_to_last_page(self):
+        response = self.client.get('/dashboard')
+        names = re.findall(rb'<td>(item\d)</td>', response.data)
+        next_url = re.search(rb'hx-get="([^"]*cursor_id[^"]*)"', response.data)
+        while next_url:
+            response = self.client.get(next_url.group(1).decode().replace('&amp;', '&'))
+            names.extend(re.findall(rb'<td>(item\d)</td>', response.data))
+            next_url = re.search(rb'hx-get="([^"]*cursor_id[^"]*)"', response.data)
+        self.assertEqual(len(names), 10)
+        self.assertEqual(len(set(names)), 10)
+        self.assertNotIn(b'other-user', response.data)
+
+    def test_rows_filtered_by_category(self):
+        response = self.client.get('/inventory/rows?category=odd&sector=lab')
+        names = re.findall(rb'<td>(item\d)</td>', response.data)
+        self.assertEqual(names, [b'item9', b'item7', b'item5', b'item3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import sqlite3
+
+from database import (MIGRATIONS, ConnectionPool, PoolTimeout, create_base_tables, init_db,
+                      migrate, schema_version)
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.pool = ConnectionPool(self.db_path, size=2, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_pragmas_applied(self):
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+        self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+        self.pool.release(conn)
+
+    def test_connections_are_reused(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        self.assertIs(self.pool.acquire(), conn)
+
+    def test_pool_is_bounded(self):
+        first = self.pool.acquire()
+        self.pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+
+        # A connection released from another thread unblocks the waiter
+        threading.Timer(0.05, self.pool.release, args=(first,)).start()
+        self.assertIs(self.pool.acquire(), first)
+
+    def test_release_rolls_back_open_transaction(self):
+        conn = self.pool.acquire()
+        conn.execute("INSERT INTO users (username, password, email) VALUES ('a', 'b', 'c')")
+        self.pool.release(conn)
+        conn = self.pool.acquire()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM users').fetchone()[0], 0)
+        self.pool.release(conn)
+
+    def test_readers_not_blocked_by_writer(self):
+        writer = self.pool.acquire()
+        writer.execute("INSERT INTO users (username, password, email) VALUES ('a', 'b', 'c')")
+        reader = self.pool.acquire()
+        # Under WAL the uncommitted write neither blocks nor leaks into the reader
+        self.assertEqual(reader.execute('SELECT COUNT(*) FROM users').fetchone()[0], 0)
+        writer.commit()
+        self.assertEqual(reader.execute('SELECT COUNT(*) FROM users').fetchone()[0], 1)
+        self.pool.release(reader)
+        self.pool.release(writer)
+
+
+class MigrationTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_migrations_apply_once(self):
+        latest = max(version for version, _, _ in MIGRATIONS)
+        self.assertEqual(migrate(self.conn)[-1], latest)
+        self.assertEqual(schema_version(self.conn), latest)
+        self.assertEqual(migrate(self.conn), [])
+
+    def test_upgrades_database_created_before_migrations(self):
+        # Databases created by the old init_db have the tables but no version table
+        create_base_tables(self.conn)
+        self.conn.commit()
+        self.assertIn(2, migrate(self.conn))
+
+    def test_hot_queries_use_indexes(self):
+        migrate(self.conn)
+        queries = [
+            'SELECT * FROM inventory WHERE user_id = 1 ORDER BY date_added DESC, id DESC',
+            'SELECT id, url FROM crawled_data WHERE user_id = 1 ORDER BY crawl_date DESC, id DESC',
+            "SELECT * FROM users WHERE username = 'x'",
+        ]
+        for query in queries:
+            plan = ' '.join(row[-1] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + query))
+            self.assertIn('USING INDEX', plan, query)
+            self.assertNotIn('TEMP B-TREE', plan, query)
+
+    def test_failed_migration_rolls_back(self):
+        migrate(self.conn)
+        broken = MIGRATIONS + [(999, 'broken', ['CREATE TABLE scratch (id INTEGER)', 'NOT SQL'])]
+        with self.assertRaises(sqlite3.OperationalError):
+            migrate(self.conn, broken)
+        tables = [row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertNotIn('scratch', tables)
+        self.assertLess(schema_version(self.conn), 999)
+
+
+if __name__ == '__main__':
+    unittest.main()
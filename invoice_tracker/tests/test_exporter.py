@@ -0,0 +1,85 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import crawl_jobs
+import exporter
+from app import app
+from database import init_db
+
+
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True, EXPORT_BATCH_SIZE=2)
+
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        self.conn.executemany('''
+            INSERT INTO inventory (name, quantity, category, sector, application, date_added, user_id)
+            VALUES (?, ?, 'tools', 'lab', 'app', ?, ?)
+        ''', [(f'item{i}', i, f'2024-01-0{i + 1} 12:00:00', 1) for i in range(5)] +
+             [('theirs', 1, '2024-01-01 12:00:00', 2)])
+        self.conn.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+    def tearDown(self):
+        self.conn.close()
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_csv_export_is_streamed_in_date_order(self):
+        response = self.client.get('/export/inventory')
+        self.assertTrue(response.is_streamed)
+        self.assertIn('attachment; filename=inventory-export.csv', response.headers['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual([row['name'] for row in rows], [f'item{i}' for i in range(5)])
+
+    def test_columns_and_inclusive_date_range(self):
+        response = self.client.get('/export/inventory?format=jsonl&columns=name,quantity'
+                                   '&since=2024-01-02&until=2024-01-04')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [{'name': 'item1', 'quantity': 1}, {'name': 'item2', 'quantity': 2},
+                                 {'name': 'item3', 'quantity': 3}])
+
+    def test_gzip_export(self):
+        response = self.client.get('/export/inventory?gzip=1&columns=name')
+        self.assertEqual(response.mimetype, 'application/gzip')
+        text = gzip.decompress(response.get_data()).decode('utf-8')
+        self.assertEqual(text.split(), ['name'] + [f'item{i}' for i in range(5)])
+
+    def test_invalid_options_are_rejected(self):
+        for query in ('format=xml', 'columns=password', 'since=yesterday'):
+            self.assertEqual(self.client.get(f'/export/inventory?{query}').status_code, 400)
+
+    def test_crawl_export_can_include_markdown(self):
+        job_id = crawl_jobs.enqueue_crawl(self.conn, 1, 'http://a.test')
+        crawl_jobs.claim_job(self.conn)
+        crawl_jobs.complete_job(self.conn, job_id, {'url': 'http://a.test', 'markdown': '# Hello', 'links': []})
+        response = self.client.get('/export/crawls?format=jsonl&columns=url,markdown,status')
+        self.assertEqual(json.loads(response.get_data(as_text=True)),
+                         {'url': 'http://a.test', 'markdown': '# Hello', 'status': 'completed'})
+
+    def test_rows_are_fetched_in_batches(self):
+        batches = list(exporter.iter_rows(self.conn, 'inventory', 1, ('id',), batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
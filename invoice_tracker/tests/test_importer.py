@@ -0,0 +1,75 @@
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database import init_db
+from importer import import_csv
+
+
+class ImportCsvTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+
+    def tearDown(self):
+        self.conn.close()
+        os.remove(self.db_path)
+
+    def items(self):
+        return self.conn.execute(
+            'SELECT name, quantity, category, date_added FROM inventory WHERE user_id = 1 ORDER BY id'
+        ).fetchall()
+
+    def test_imports_bulk_file_with_date_added(self):
+        path = os.path.join(os.path.dirname(__file__), '..', 'data_bulk.csv')
+        with open(path, 'rb') as f:
+            report = import_csv(self.conn, f, user_id=1, chunk_size=3)
+
+        self.assertEqual(report.failed, 0)
+        items = self.items()
+        self.assertEqual(report.imported, len(items))
+        self.assertEqual(items[0]['name'], 'LED TV Samsung')
+        self.assertEqual(items[0]['date_added'], '2024-12-21 16:16:53')
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        data = (b'name,quantity,category,sector,application\n'
+                b'Good,1,a,b,c\n'
+                b'Short,1\n'
+                b',2,a,b,c\n'
+                b'Negative,-4,a,b,c\n'
+                b'BadDate,3,a,b,c,yesterday\n'
+                b'AlsoGood,2,a,b,c\n')
+        report = import_csv(self.conn, io.BytesIO(data), user_id=1, chunk_size=2)
+
+        self.assertEqual(report.imported, 2)
+        self.assertEqual([line for line, _ in report.errors], [3, 4, 5, 6])
+        self.assertEqual([row['name'] for row in self.items()], ['Good', 'AlsoGood'])
+
+    def test_upsert_updates_existing_items(self):
+        import_csv(self.conn, io.BytesIO(b'Drill,1,tools,Garage,Drilling\n'), user_id=1)
+        data = (b'Drill,4,power tools,Garage,Drilling\n'
+                b'Saw,2,tools,Garage,Cutting\n'
+                b'Saw,7,tools,Garage,Cutting\n')
+        report = import_csv(self.conn, io.BytesIO(data), user_id=1, upsert=True)
+
+        self.assertEqual(report.failed, 0)
+        # Drill already existed; Saw is new, and its second line overwrites the first
+        self.assertEqual((report.imported, report.updated), (1, 1))
+        self.assertEqual(report.to_dict()['updated'], 1)
+        items = [(row['name'], row['quantity'], row['category']) for row in self.items()]
+        self.assertEqual(items, [('Drill', 4, 'power tools'), ('Saw', 7, 'tools')])
+
+    def test_invalid_encoding_stops_import(self):
+        data = b'Good,1,a,b,c\n' + b'\xff\xfe,1,a,b,c\n'
+        report = import_csv(self.conn, io.BytesIO(data), user_id=1)
+        self.assertEqual(report.failed, 1)
+        self.assertIn('UTF-8', report.errors[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
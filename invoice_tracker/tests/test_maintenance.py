@@ -0,0 +1,149 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import crawl_jobs
+from crawl_cache import latest_crawl
+from crawl_store import load_crawl_data, store_crawl_data
+from database import init_db
+import maintenance
+from maintenance import backup, enable_incremental_vacuum, prune_crawls, run_maintenance, strip_html
+
+PAGE = {
+    'url': 'http://example.test/',
+    'html': '<html>' + '<p>%s</p>' * 2000 + '</html>',
+    'cleaned_html': '<p>x</p>',
+    'markdown': 'hello',
+    'fit_markdown': 'hello',
+    'links': [],
+    'status_code': 200,
+}
+
+
+class MaintenanceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, 'inventory.db')
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def add_crawl(self, url, days_ago, status='completed', user_id=1, body=None):
+        cursor = self.conn.execute('''
+            INSERT INTO crawled_data (user_id, url, normalized_url, crawl_data, status, crawl_date, finished_at)
+            VALUES (?, ?, ?, '{}', ?, datetime('now', ?), datetime('now', ?))
+        ''', (user_id, url, url, status, f'-{days_ago} days', f'-{days_ago} days'))
+        if status == 'completed':
+            store_crawl_data(self.conn, cursor.lastrowid, dict(PAGE, url=url, **(body or {})))
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def test_prune_keeps_newest_crawls_per_user_and_url(self):
+        kept = [self.add_crawl('http://a.test/', days) for days in (1, 2)]
+        self.add_crawl('http://a.test/', 3)
+        self.add_crawl('http://a.test/', 4)
+        other_user = self.add_crawl('http://a.test/', 5, user_id=2)
+        queued = self.add_crawl('http://a.test/', 6, status='queued')
+
+        self.assertEqual(prune_crawls(self.conn, keep_per_url=2), 2)
+        remaining = {row[0] for row in self.conn.execute('SELECT id FROM crawled_data')}
+        self.assertEqual(remaining, set(kept) | {other_user, queued})
+        with self.assertRaises(ValueError):
+            prune_crawls(self.conn, keep_per_url=0)
+
+    def test_prune_of_a_finished_batch_keeps_it_finished(self):
+        self.conn.row_factory = sqlite3.Row
+        batch_id = crawl_jobs.enqueue_batch(self.conn, 1, ['http://a.test/', 'http://b.test/'], 'test')
+        first, second = [row[0] for row in self.conn.execute('SELECT id FROM crawled_data ORDER BY id')]
+        crawl_jobs.record_results(self.conn, [(first, 'completed', PAGE), (second, 'failed', 'timeout')])
+        # A later crawl of the same page makes the batch's copy prunable
+        self.add_crawl('http://a.test/', 0)
+        self.conn.execute("UPDATE crawled_data SET finished_at = datetime('now', '-1 day') WHERE id = ?", (first,))
+        self.conn.commit()
+
+        self.assertEqual(prune_crawls(self.conn, keep_per_url=1), 1)
+        progress = crawl_jobs.batch_progress(self.conn, batch_id, 1)
+        self.assertFalse(progress['pending'])
+        self.assertEqual((progress['done'], progress['total'], progress['percent']), (2, 2, 100))
+        self.assertEqual((progress['counts']['failed'], progress['counts']['pruned']), (1, 1))
+
+    def test_strip_html_leaves_shared_blob_of_recent_crawl_intact(self):
+        old = self.add_crawl('http://a.test/', 40)
+        recent = self.add_crawl('http://a.test/', 1)
+
+        self.assertEqual(strip_html(self.conn, 30), 1)
+        self.assertIsNone(load_crawl_data(self.conn, old)['html'])
+        self.assertEqual(load_crawl_data(self.conn, old)['markdown'], 'hello')
+        self.assertEqual(load_crawl_data(self.conn, recent)['html'], PAGE['html'])
+        # A stripped crawl can no longer stand in for a fresh one
+        self.assertEqual(latest_crawl(self.conn, 1, 'http://a.test/')[0], recent)
+        self.assertEqual(strip_html(self.conn, 30), 0)
+
+    def test_run_reports_reclaimed_bytes_and_writes_backup(self):
+        for i in range(6):
+            # Incompressible bodies, so deleting them frees whole pages
+            self.add_crawl('http://a.test/', 40 + i, body={'html': os.urandom(20000).hex()})
+        self.conn.close()
+
+        backup_dir = os.path.join(self.directory, 'backups')
+        report = run_maintenance(self.db_path, keep_per_url=1, strip_html_days=30, backup_dir=backup_dir)
+        self.assertEqual(report['crawls_deleted'], 5)
+        self.assertEqual(report['html_stripped'], 1)
+        self.assertGreater(report['blobs_deleted'], 0)
+        self.assertGreater(report['reclaimed_bytes'], 0)
+
+        self.conn = sqlite3.connect(report['backup'])
+        self.assertEqual(self.conn.execute('SELECT COUNT(*) FROM crawled_data').fetchone()[0], 1)
+        self.assertEqual(self.conn.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+
+    def test_backups_beyond_keep_are_removed(self):
+        backup_dir = os.path.join(self.directory, 'backups')
+        os.makedirs(backup_dir)
+        for name in ('inventory-20240101-000000.db', 'inventory-20240102-000000.db'):
+            open(os.path.join(backup_dir, name), 'w').close()
+
+        path = backup(self.conn, backup_dir, keep=2)
+        self.assertEqual(sorted(os.listdir(backup_dir)),
+                         ['inventory-20240102-000000.db', os.path.basename(path)])
+
+    def test_backup_pauses_between_steps(self):
+        for i in range(3):
+            self.add_crawl(f'http://{i}.test/', 1, body={'html': os.urandom(20000).hex()})
+        page_count = self.conn.execute('PRAGMA page_count').fetchone()[0]
+
+        with mock.patch.object(maintenance.time, 'sleep') as sleep:
+            backup(self.conn, os.path.join(self.directory, 'backups'), pages=8, pause=0.25)
+        self.assertGreater(sleep.call_count, 1)
+        self.assertLess(sleep.call_count, page_count / 8)
+        sleep.assert_called_with(0.25)
+
+    def test_scheduled_runs_never_rebuild_older_files(self):
+        legacy = os.path.join(self.directory, 'legacy.db')
+        conn = sqlite3.connect(legacy)
+        conn.execute('CREATE TABLE t (x)')
+        conn.executemany('INSERT INTO t VALUES (?)', [(os.urandom(4000),) for _ in range(50)])
+        conn.execute('DELETE FROM t')
+        conn.commit()
+
+        self.assertEqual(run_maintenance(legacy)['pages_released'], 0)
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 0)
+        self.assertGreater(conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
+
+        # The explicit one-off step switches the mode, after which runs release pages
+        self.assertTrue(enable_incremental_vacuum(conn))
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        self.assertFalse(enable_incremental_vacuum(conn))
+        conn.execute('INSERT INTO t VALUES (?)', (os.urandom(40000),))
+        conn.execute('DELETE FROM t')
+        conn.commit()
+        conn.close()
+        self.assertGreater(run_maintenance(legacy)['pages_released'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
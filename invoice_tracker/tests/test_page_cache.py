@@ -0,0 +1,155 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import views
+from app import app
+from database import init_db
+from page_cache import FragmentCache, data_version, source_digest, tee_body
+
+
+class DataVersionTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_writes_bump_only_the_owning_user(self):
+        self.assertEqual(data_version(self.conn, 1), 0)
+        self.conn.execute('''INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+                             VALUES ('a', 1, 'c', 's', 'x', 1)''')
+        self.conn.execute("INSERT INTO crawled_data (user_id, url, crawl_data, status) VALUES (1, 'http://a.test', '{}', 'queued')")
+        self.conn.execute('UPDATE inventory SET quantity = 5')
+        self.assertEqual(data_version(self.conn, 1), 3)
+        self.assertEqual(data_version(self.conn, 2), 0)
+
+        # Moving an item changes what both users see
+        self.conn.execute('UPDATE inventory SET user_id = 2')
+        self.assertEqual(data_version(self.conn, 1), 4)
+        self.assertEqual(data_version(self.conn, 2), 1)
+        self.conn.execute('DELETE FROM crawled_data')
+        self.assertEqual(data_version(self.conn, 1), 5)
+
+
+class FragmentCacheTests(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = FragmentCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+    def test_zero_size_disables_caching(self):
+        cache = FragmentCache(maxsize=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_streamed_body_is_stored_only_when_complete_and_small(self):
+        stored = []
+        self.assertEqual(list(tee_body(iter(['ab', b'cd']), stored.append, limit=10)), [b'ab', b'cd'])
+        self.assertEqual(stored, [b'abcd'])
+
+        list(tee_body(iter(['abc', 'def']), stored.append, limit=5))
+        chunks = tee_body(iter(['ab', 'cd']), stored.append, limit=10)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(stored, [b'abcd'])
+
+
+class ConditionalGetTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True)
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        conn.execute('''INSERT INTO inventory (id, name, quantity, category, sector, application, user_id)
+                        VALUES (1, 'hammer', 1, 'tools', 'lab', 'app', 1)''')
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_unchanged_page_is_304_and_served_from_cache(self):
+        with mock.patch.object(views, 'iter_inventory_page',
+                               wraps=views.iter_inventory_page) as fetch:
+            first = self.client.get('/inventory/rows')
+            etag = first.headers['ETag']
+            self.assertEqual(first.status_code, 200)
+            # The streamed body is cached once it has been read to the end
+            body = first.get_data()
+
+            revalidated = self.client.get('/inventory/rows', headers={'If-None-Match': etag})
+            self.assertEqual(revalidated.status_code, 304)
+
+            replayed = self.client.get('/inventory/rows')
+            self.assertEqual(replayed.get_data(), body)
+            self.assertEqual(fetch.call_count, 1)
+
+    def test_write_changes_etag(self):
+        first = self.client.get('/dashboard')
+        etag = first.headers['ETag']
+        # Streamed pages hold their request context until the body is closed
+        first.close()
+        self.client.put('/update_quantity/1', data={'value': '9'})
+        response = self.client.get('/dashboard', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn(b'9', response.get_data())
+
+    def test_new_build_changes_etag(self):
+        etag = self.client.get('/inventory/summary').headers['ETag']
+        app.config['BUILD_ID'] = 'next-deploy'
+        response = self.client.get('/inventory/summary', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_default_build_id_follows_templates(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'templates'))
+        with open(os.path.join(root, 'templates', 'page.html'), 'w') as f:
+            f.write('v1')
+        before = source_digest(root)
+        self.assertEqual(source_digest(root), before)
+        with open(os.path.join(root, 'templates', 'page.html'), 'w') as f:
+            f.write('v2')
+        self.assertNotEqual(source_digest(root), before)
+
+    def test_query_string_and_headers_are_part_of_the_key(self):
+        page = self.client.get('/inventory/summary')
+        as_json = self.client.get('/inventory/summary', headers={'Accept': 'application/json'})
+        filtered = self.client.get('/inventory/rows?category=none')
+        self.assertEqual(as_json.get_json()['items'], 1)
+        self.assertNotEqual(page.headers['ETag'], as_json.headers['ETag'])
+        self.assertNotIn(b'hammer', filtered.get_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
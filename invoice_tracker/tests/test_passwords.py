@@ -0,0 +1,123 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import app, get_hasher
+from database import init_db
+from passwords import HasherBusy, PasswordHasher, hash_password, needs_rehash, verify_password
+
+FAST = 'pbkdf2:sha256:1000'
+
+
+class PasswordHasherTests(unittest.TestCase):
+    def test_verify_rehashes_only_when_parameters_changed(self):
+        stored = generate_password_hash('secret', 'pbkdf2:sha256:2000')
+        self.assertEqual(verify_password(stored, 'wrong', FAST), (False, None))
+        matches, new_hash = verify_password(stored, 'secret', FAST)
+        self.assertTrue(matches)
+        self.assertTrue(new_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(check_password_hash(new_hash, 'secret'))
+        self.assertEqual(verify_password(new_hash, 'secret', FAST), (True, None))
+        self.assertFalse(needs_rehash(generate_password_hash('x', 'pbkdf2'), 'pbkdf2'))
+
+    def test_pool_hashes_and_sheds_load_when_full(self):
+        hasher = PasswordHasher(FAST, workers=1, max_pending=1)
+        try:
+            stored = hasher.hash('secret')
+            self.assertEqual(hasher.verify(stored, 'secret'), (True, None))
+
+            # Hold the only slot and the next caller is turned away at once
+            hasher._slots.acquire()
+            with self.assertRaises(HasherBusy):
+                hasher.hash('secret')
+            hasher._slots.release()
+            self.assertTrue(check_password_hash(hasher.hash('secret'), 'secret'))
+        finally:
+            hasher.close()
+
+    def test_close_cancels_queued_hashes_and_frees_their_slots(self):
+        hasher = PasswordHasher('pbkdf2:sha256:2000000', workers=1, max_pending=4)
+        futures = [hasher._submit(hash_password, 'secret') for _ in range(4)]
+        hasher.close()
+        # One job runs and one waits in the call queue; the rest are still cancellable
+        self.assertTrue(all(future.cancelled() for future in futures[2:]))
+        self.assertTrue(hasher._slots.acquire(blocking=False) and hasher._slots.acquire(blocking=False))
+        self.assertFalse(hasher._futures & set(futures[2:]))
+
+    def test_timed_out_hash_frees_its_slot(self):
+        hasher = PasswordHasher('pbkdf2:sha256:2000000', workers=1, max_pending=1, timeout=0.01)
+        try:
+            with self.assertRaises(HasherBusy):
+                hasher.hash('secret')
+            # The job still runs in its worker, but the next login is admitted
+            with self.assertRaises(HasherBusy) as busy:
+                asyncio.run(hasher.hash_async('secret'))
+            self.assertIn('not done after', str(busy.exception))
+            self.assertFalse(hasher._futures)
+            self.assertTrue(hasher._slots.acquire(blocking=False))
+            hasher._slots.release()
+        finally:
+            hasher.close()
+
+
+class LoginRehashTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True, PASSWORD_HASH_METHOD=FAST,
+                          PASSWORD_HASH_WORKERS=1)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO users (username, password, email) VALUES ('u', ?, 'u@example.com')",
+                     (generate_password_hash('secret', 'pbkdf2:sha256:2000'),))
+        conn.commit()
+        conn.close()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.extensions.pop('password_hasher').close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def stored_hash(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT password FROM users WHERE username = 'u'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_login_upgrades_hash_to_configured_method(self):
+        response = self.client.post('/login', data={'username': 'u', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:1000$'))
+
+        self.client.get('/logout')
+        response = self.client.post('/login', data={'username': 'u', 'password': 'secret'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_saturated_hasher_answers_503(self):
+        with app.app_context():
+            hasher = get_hasher()
+        for _ in range(hasher.max_pending):
+            hasher._slots.acquire()
+        try:
+            response = self.client.post('/login', data={'username': 'u', 'password': 'secret'})
+        finally:
+            for _ in range(hasher.max_pending):
+                hasher._slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertTrue(self.stored_hash().startswith('pbkdf2:sha256:2000$'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import views
+from app import app
+from config import optional_int
+from database import init_db
+from perf import PerfStats, ProfiledConnection, RequestTimings, _current, fingerprint, percentile, phase
+
+
+class FingerprintTests(unittest.TestCase):
+    def test_literals_and_in_lists_are_normalized(self):
+        self.assertEqual(
+            fingerprint("SELECT *  FROM inventory\n WHERE id IN (?, ?, ?) AND name = 'it''s' LIMIT 50"),
+            'SELECT * FROM inventory WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(fingerprint('SELECT 1 -- comment\n FROM idx_2'), 'SELECT ? FROM idx_2')
+
+    def test_profile_threshold_can_be_switched_off(self):
+        for value, expected in ((None, 500), ('250', 250), ('', None), ('off', None), (' OFF ', None)):
+            environ = {} if value is None else {'INVENTORY_PERF_PROFILE_MS': value}
+            with mock.patch.dict(os.environ, environ, clear=True):
+                self.assertEqual(optional_int('INVENTORY_PERF_PROFILE_MS', 500), expected)
+
+    def test_percentile_is_nearest_rank(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([4, 1, 3, 2], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+
+
+class RequestTimingsTests(unittest.TestCase):
+    def setUp(self):
+        self.timings = RequestTimings('test')
+        self.token = _current.set(self.timings)
+
+    def tearDown(self):
+        _current.reset(self.token)
+
+    def test_nested_phases_are_exclusive(self):
+        with phase('template'):
+            time.sleep(0.01)
+            with phase('db'):
+                time.sleep(0.02)
+        self.timings.finish()
+        self.assertGreaterEqual(self.timings.phases['db'], 0.02)
+        self.assertLess(self.timings.phases['template'], 0.02)
+        total = sum(seconds for name, seconds in self.timings.phases.items())
+        self.assertAlmostEqual(total, self.timings.elapsed, places=6)
+
+    def test_profiled_connection_groups_statements_by_fingerprint(self):
+        conn = sqlite3.connect(':memory:', factory=ProfiledConnection)
+        conn.execute('CREATE TABLE t (x)')
+        conn.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(10)])
+        for limit in (1, 5):
+            rows = conn.execute(f'SELECT x FROM t LIMIT {limit}').fetchall()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(conn.execute('SELECT count(*) FROM t')), [(10,)])
+        conn.close()
+
+        self.assertEqual(self.timings.statements['SELECT x FROM t LIMIT ?'][0], 2)
+        self.assertEqual(self.timings.statements['INSERT INTO t VALUES (?)'][0], 1)
+        self.assertEqual(self.timings.statements['SELECT count(*) FROM t'][0], 1)
+        self.assertGreater(self.timings.phases['db'], 0)
+
+
+class PerfMiddlewareTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.profile_dir = tempfile.mkdtemp()
+        self.original_config = dict(app.config)
+        app.config.update(DATABASE=self.db_path, TESTING=True, PERF_ENABLED=True,
+                          PERF_PROFILE_DIR=self.profile_dir)
+        app.extensions['perf'].stats = PerfStats()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO users (id, username, password, email) VALUES (1, 'u', 'x', 'u@example.com')")
+        conn.execute('''INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+                        VALUES ('hammer', 5, 'tools', 'lab', 'app', 1)''')
+        conn.commit()
+        conn.close()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['username'] = 'u'
+
+    def tearDown(self):
+        app.extensions['db_pool'].close()
+        app.config.clear()
+        app.config.update(self.original_config)
+        shutil.rmtree(self.profile_dir)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def test_requests_report_phases_and_aggregate_on_debug_page(self):
+        response = self.client.get('/inventory/summary')
+        self.assertEqual(response.status_code, 200)
+        metrics = response.headers['Server-Timing']
+        for name in ('db;dur=', 'template;dur=', 'total;dur='):
+            self.assertIn(name, metrics)
+        # The dashboard streams, so its template time is only known once the body is read
+        self.client.get('/dashboard').get_data()
+
+        summary = self.client.get('/_debug/perf?format=json').get_json()
+        endpoints = {entry['endpoint']: entry for entry in summary['endpoints']}
+        self.assertEqual(endpoints['dashboard']['requests'], 1)
+        self.assertGreater(endpoints['dashboard']['template']['p50'], 0)
+        self.assertNotIn('perf.perf_page', endpoints)
+        self.assertTrue(any('FROM inventory' in entry['sql'] for entry in summary['statements']))
+        self.assertEqual(self.client.get('/_debug/perf').status_code, 200)
+
+    def test_slow_requests_write_collapsed_stacks(self):
+        app.config['PERF_PROFILE_THRESHOLD_MS'] = 20
+        fetch_page = views.iter_inventory_page
+
+        def slow_fetch(*args, **kwargs):
+            time.sleep(0.05)
+            return fetch_page(*args, **kwargs)
+
+        with mock.patch.object(views, 'iter_inventory_page', slow_fetch):
+            self.client.get('/dashboard').get_data()
+        files = os.listdir(self.profile_dir)
+        self.assertTrue(files)
+        with open(os.path.join(self.profile_dir, files[0])) as f:
+            stacks = f.read()
+        self.assertIn('test_perf.py:slow_fetch', stacks)
+
+    def test_debug_page_is_hidden_when_disabled(self):
+        app.config['PERF_ENABLED'] = False
+        self.assertEqual(self.client.get('/_debug/perf').status_code, 404)
+        response = self.client.get('/dashboard')
+        self.assertNotIn('Server-Timing', response.headers)
+        response.close()
@@ -0,0 +1,52 @@
+import sqlite3
+import unittest
+
+from database import migrate
+from rollups import fetch_summary, rebuild_rollups
+
+
+class RollupTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        migrate(self.conn)
+        self.conn.executemany('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [('TV', 25, 'home appliances', 'Living Room', 'Display', 1),
+              ('Oven', 15, 'home appliances', 'Kitchen', 'Heating', 1),
+              ('Camera', 40, 'security', 'Outdoor', 'Surveillance', 1),
+              ('Lock', 20, 'security', 'Entry', 'Access Control', 2)])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_insert_maintains_totals(self):
+        summary = fetch_summary(self.conn, 1)
+        self.assertEqual((summary['items'], summary['quantity']), (3, 80))
+        self.assertEqual(summary['category'], [{'value': 'home appliances', 'items': 2, 'quantity': 40},
+                                               {'value': 'security', 'items': 1, 'quantity': 40}])
+
+    def test_update_and_delete_maintain_totals(self):
+        self.conn.execute("UPDATE inventory SET quantity = 5, category = 'security' WHERE name = 'Oven'")
+        self.conn.execute("DELETE FROM inventory WHERE name = 'TV'")
+        summary = fetch_summary(self.conn, 1)
+        self.assertEqual(summary['category'], [{'value': 'security', 'items': 2, 'quantity': 45}])
+        self.assertEqual([row['value'] for row in summary['sector']], ['Outdoor', 'Kitchen'])
+        self.assertEqual(rebuild_rollups(self.conn), [])
+
+    def test_rebuild_reports_and_repairs_drift(self):
+        self.conn.execute("UPDATE inventory_rollups SET total_quantity = 0 WHERE user_id = 2 AND dimension = 'sector'")
+        self.conn.execute("DELETE FROM inventory_rollups WHERE user_id = 1 AND value = 'Kitchen'")
+        self.conn.execute("INSERT INTO inventory_rollups VALUES (3, 'category', 'ghost', 1, 1)")
+        drift = rebuild_rollups(self.conn)
+        self.assertEqual(sorted(drift), [
+            (1, 'sector', 'Kitchen', None, (1, 15)),
+            (2, 'sector', 'Entry', (1, 0), (1, 20)),
+            (3, 'category', 'ghost', (1, 1), None),
+        ])
+        self.assertEqual(rebuild_rollups(self.conn), [])
+        self.assertEqual(fetch_summary(self.conn, 3)['items'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app import app
+from crawl_store import store_crawl_data
+from database import init_db
+from search import build_match_query, search_crawls, search_inventory
+
+
+class SearchTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        init_db(self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executemany('''
+            INSERT INTO inventory (name, quantity, category, sector, application, user_id)
+            VALUES (?, 1, ?, ?, ?, ?)
+        ''', [('Smart Thermostat', 'home automation', 'HVAC', 'Temperature Control', 1),
+              ('Smart Speaker', 'home automation', 'Living Room', 'Voice Control', 1),
+              ('Dishwasher', 'home appliances', 'Kitchen', 'Dish Cleaning', 1),
+              ('Smart Thermostat', 'home automation', 'HVAC', 'Temperature Control', 2)])
+        self.conn.execute("INSERT INTO crawled_data (id, user_id, url, crawl_data, status) "
+                          "VALUES (1, 1, 'http://docs.test', '{}', 'completed')")
+        store_crawl_data(self.conn, 1, {'url': 'http://docs.test', 'markdown': 'Installing the <thermostat> firmware',
+                                        'fit_markdown': None, 'html': '', 'links': []})
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def names(self, rows):
+        return [row['name'].replace('\x02', '').replace('\x03', '') for row in rows]
+
+    def test_query_syntax_is_neutralised(self):
+        self.assertIsNone(build_match_query('  "*: ', ['name']))
+        self.assertEqual(build_match_query('smart OR -x', ['name']), '{name}: ("smart"* "OR"* "x"*)')
+
+    def test_prefix_match_is_scoped_to_user(self):
+        self.assertEqual(self.names(search_inventory(self.conn, 1, 'therm')), ['Smart Thermostat'])
+        self.assertEqual(len(search_inventory(self.conn, 1, 'smart')), 2)
+        self.assertEqual(len(search_inventory(self.conn, 3, 'smart')), 0)
+        # The owner token itself is not searchable
+        self.assertEqual(search_inventory(self.conn, 1, 'u1'), [])
+
+    def test_triggers_keep_index_in_sync(self):
+        self.conn.execute("UPDATE inventory SET name = 'Dish Drawer' WHERE name = 'Dishwasher'")
+        self.assertEqual(self.names(search_inventory(self.conn, 1, 'drawer')), ['Dish Drawer'])
+        self.assertEqual(search_inventory(self.conn, 1, 'dishwasher'), [])
+        self.conn.execute("DELETE FROM inventory WHERE name = 'Dish Drawer'")
+        self.assertEqual(search_inventory(self.conn, 1, 'drawer'), [])
+
+    def test_crawl_markdown_search_and_delete(self):
+        results = search_crawls(self.conn, 1, 'firmware')
+        self.assertEqual([row['url'] for row in results], ['http://docs.test'])
+        self.assertIn('\x02firmware\x03', results[0]['snippet'])
+        self.conn.execute('DELETE FROM crawled_data WHERE id = 1')
+        self.assertEqual(search_crawls(self.conn, 1, 'firmware'), [])
+
+    def test_search_endpoint_escapes_snippets(self):
+        original_database = app.config['DATABASE']
+        app.config['DATABASE'] = self.db_path
+        try:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+            response = client.get('/search?q=thermo&scope=crawls', headers={'HX-Request': 'true'})
+            self.assertIn(b'&lt;<mark>thermostat</mark>&gt;', response.data)
+            self.assertNotIn(b'<html', response.data)
+            response = client.get('/search?q=smart')
+            self.assertEqual(response.data.count(b'<mark>Smart</mark>'), 2)
+        finally:
+            app.extensions['db_pool'].close()
+            app.config['DATABASE'] = original_database
+
+
+if __name__ == '__main__':
+    unittest.main()
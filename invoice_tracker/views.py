@@ -0,0 +1,330 @@
+# View logic shared by the WSGI app (app.py) and the ASGI app (asgi.py).
+#
+# Each view takes an open connection, the user id and plain values read from
+# the request, runs its queries and returns what to send back: a Page to
+# render, Json, a Redirect with an optional flash message, or a Reply. The
+# front-ends only read the request, borrow a connection (in the request thread
+# under Flask, on the DB executor under Quart) and turn the result into their
+# framework's response, so a query or template change is made here once.
+import os
+import sqlite3
+import threading
+
+import queries
+from change_feed import latest_change_id
+from crawl_batches import is_http_url, parse_url_list
+from crawl_jobs import batch_progress, enqueue_batch, enqueue_crawl, enqueue_sitemap, get_job
+from crawl_store import load_crawl_data
+from database import ConnectionPool, init_db
+from importer import import_csv
+from page_cache import FragmentCache, cache_key, source_digest
+from passwords import PasswordHasher
+from queries import RowStream, iter_inventory_page
+from rollups import fetch_summary
+from search import search_crawls, search_inventory
+
+
+class Page:
+    """A template to render. With stream set, context holds RowStreams read while sending."""
+
+    def __init__(self, template, stream=False, message=None, headers=None, **context):
+        self.template = template
+        self.stream = stream
+        self.message = message
+        self.headers = headers or {}
+        self.context = context
+
+    def load(self):
+        # Read any RowStreams now, e.g. before the connection goes back to the pool
+        for value in self.context.values():
+            if isinstance(value, RowStream):
+                value.load()
+        return self
+
+
+class Json:
+    def __init__(self, data):
+        self.data = data
+
+
+class Redirect:
+    def __init__(self, endpoint, message=None, **values):
+        self.endpoint = endpoint
+        self.message = message
+        self.values = values
+
+
+class Reply:
+    """A plain response body, e.g. an error message for an HTMX request."""
+
+    def __init__(self, body, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+
+# Per-process resources, kept in app.extensions of either front-end
+
+_resources_lock = threading.Lock()
+
+
+def get_pool(app, factory=sqlite3.Connection):
+    """Return this process's connection pool, creating it on first use.
+
+    A forked worker must not reuse its parent's handles, and a changed
+    DATABASE or connection factory (tests, PERF_ENABLED) gets a fresh pool.
+    Callable from any thread.
+    """
+    with _resources_lock:
+        pool = app.extensions.get('db_pool')
+        if (pool is None or pool.pid != os.getpid() or pool.database != app.config['DATABASE']
+                or pool.factory is not factory):
+            if pool is not None and pool.pid == os.getpid():
+                pool.close()
+            # Bring the schema up to date before the first connection is handed out
+            init_db(app.config['DATABASE'])
+            # Versions restart with a different database, so cached pages must go
+            app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+            pool = ConnectionPool(app.config['DATABASE'],
+                                  size=app.config['DB_POOL_SIZE'],
+                                  timeout=app.config['DB_POOL_TIMEOUT'],
+                                  factory=factory)
+            app.extensions['db_pool'] = pool
+        return pool
+
+
+def get_hasher(app):
+    """Return the password hasher, replaced whenever its settings change."""
+    settings = (app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+                app.config['PASSWORD_HASH_MAX_PENDING'], app.config['PASSWORD_HASH_TIMEOUT'])
+    with _resources_lock:
+        hasher = app.extensions.get('password_hasher')
+        if hasher is None or (hasher.method, hasher.workers, hasher.max_pending, hasher.timeout) != settings:
+            if hasher is not None:
+                hasher.close()
+            hasher = PasswordHasher(*settings)
+            app.extensions['password_hasher'] = hasher
+        return hasher
+
+
+def build_id(app):
+    """BUILD_ID if set, else a digest of the deployed modules and templates."""
+    if app.config['BUILD_ID']:
+        return app.config['BUILD_ID']
+    digest = app.extensions.get('source_digest')
+    if digest is None:
+        digest = app.extensions['source_digest'] = source_digest(app.root_path, app.template_folder)
+    return digest
+
+
+def page_key(app, request, user_id, view, version):
+    """Fragment cache key, and ETag source, for the current request."""
+    return cache_key(user_id, view, request.full_path,
+                     (request.headers.get('HX-Request'), request.accept_mimetypes.best),
+                     version, build_id(app))
+
+
+HASHER_BUSY = ('Too many sign-ins at once, please try again in a moment.', 503, {'Retry-After': '2'})
+
+
+# Request values
+
+def inventory_filters(args):
+    return {
+        'category': args.get('category') or None,
+        'sector': args.get('sector') or None,
+    }
+
+
+def inventory_cursor(args):
+    cursor_date = args.get('cursor_date')
+    cursor_id = args.get('cursor_id', type=int)
+    if cursor_date and cursor_id is not None:
+        return cursor_date, cursor_id
+    return None
+
+
+def bulk_request(payload, form):
+    """Read (ids, operations) from a JSON body or the dashboard's bulk form.
+
+    JSON: {"ids": [1, 2], "operations": [{"op": "adjust_quantity", "value": -3}, ...]}
+    """
+    if payload is not None:
+        ids = payload.get('ids') or []
+        operations = [queries.parse_bulk_operation(op.get('op'), op.get('value'))
+                      for op in payload.get('operations') or []]
+    else:
+        ids = form.getlist('ids')
+        operations = [queries.parse_bulk_operation(form.get('op'), form.get('value'))]
+    return [int(item_id) for item_id in ids], operations
+
+
+# Views
+
+def dashboard(conn, user_id, args, page_size):
+    try:
+        filters = inventory_filters(args)
+        # Read before the rows, so a change made meanwhile is pushed over /events, not lost
+        change_id = latest_change_id(conn, user_id)
+        items = iter_inventory_page(conn, user_id, limit=page_size, **filters)
+
+        # Filter choices and summary tiles are read from the trigger-maintained rollups
+        summary = fetch_summary(conn, user_id)
+        categories = sorted(row['value'] for row in summary['category'])
+        sectors = sorted(row['value'] for row in summary['sector'])
+    except Exception as e:
+        return Redirect('login', f'Error loading dashboard: {str(e)}')
+    return Page('dashboard.html', stream=True, items=items, filters=filters,
+                categories=categories, sectors=sectors, summary=summary, change_id=change_id)
+
+
+def inventory_rows(conn, user_id, args, page_size):
+    # HTMX partial: the next page of rows plus a sentinel that loads the one after
+    filters = inventory_filters(args)
+    items = iter_inventory_page(conn, user_id, cursor=inventory_cursor(args),
+                                limit=page_size, **filters)
+    return Page('partials/inventory_rows.html', stream=True, items=items, filters=filters)
+
+
+def inventory_summary(conn, user_id, accept):
+    summary = fetch_summary(conn, user_id)
+    if accept == 'application/json':
+        return Json(summary)
+    return Page('partials/inventory_summary.html', summary=summary)
+
+
+def search(conn, user_id, args, htmx, page_size):
+    query = args.get('q', '').strip()
+    scope = 'crawls' if args.get('scope') == 'crawls' else 'inventory'
+    page = max(args.get('page', 1, type=int), 1)
+
+    search_fn = search_crawls if scope == 'crawls' else search_inventory
+    # One extra row tells us whether to render the "load more" sentinel
+    results = search_fn(conn, user_id, query, limit=page_size + 1, offset=(page - 1) * page_size)
+    has_more = len(results) > page_size
+
+    template = 'partials/search_results.html' if htmx else 'search.html'
+    return Page(template, query=query, scope=scope, page=page,
+                results=results[:page_size], has_more=has_more)
+
+
+def add_item(conn, user_id, form):
+    if not form.get('name') or not form.get('quantity'):
+        return Page('add_item.html', message='Name and quantity are required!')
+    queries.add_item(conn, user_id, form['name'], form['quantity'], form.get('category'),
+                     form.get('sector'), form.get('application'))
+    return Redirect('dashboard', 'Item successfully added!')
+
+
+def upload_csv(conn, user_id, file, mode, accept, chunk_size):
+    if file is None or file.filename == '':
+        return Redirect('upload_csv', 'No file selected')
+    if not file.filename.endswith('.csv'):
+        return Redirect('upload_csv', 'Please upload a CSV file')
+
+    report = import_csv(conn, file.stream, user_id, upsert=mode == 'upsert', chunk_size=chunk_size)
+    if accept == 'application/json':
+        return Json(report.to_dict())
+
+    message = f'Successfully imported {report.imported} items'
+    if report.updated:
+        message += f' and updated {report.updated}'
+    message += f'. {report.failed} items failed.'
+    if report.failed:
+        return Page('upload_csv.html', message=message, report=report)
+    return Redirect('dashboard', message)
+
+
+def update_quantity(conn, user_id, item_id, value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return Reply('Invalid quantity value', 400)
+    if quantity < 0:
+        return Reply('Quantity cannot be negative', 400)
+
+    item = queries.set_item_quantity(conn, item_id, user_id, quantity)
+    if not item:
+        return Reply('Item not found', 404)
+    return Page('partials/inventory_row.html', item=item)
+
+
+def delete_item(conn, user_id, item_id):
+    if not queries.delete_item(conn, item_id, user_id):
+        return Reply('Item not found', 404)
+    return Reply('', 204)
+
+
+def bulk_update(conn, user_id, ids, operations, accept):
+    if not ids or not operations:
+        return Reply('Select at least one item and one operation', 400)
+
+    items, deleted_ids = queries.bulk_update(conn, user_id, ids, operations)
+    if accept == 'application/json':
+        return Json({'updated': [item['id'] for item in items], 'deleted': deleted_ids})
+    # HX-Trigger lets the summary tiles refresh themselves
+    return Page('partials/inventory_bulk_result.html', headers={'HX-Trigger': 'inventory-changed'},
+                items=items, deleted_ids=deleted_ids)
+
+
+def start_crawl(conn, user_id, form, config):
+    url_list = form.get('urls', '').strip()
+    sitemap = form.get('sitemap', '').strip()
+    if sitemap:
+        # The crawl worker reads the sitemap and queues its pages; nothing is fetched here
+        if not is_http_url(sitemap):
+            return Redirect('crawl_website', f'Could not start batch crawl: {sitemap!r} is not an http(s) URL')
+        batch_id = enqueue_sitemap(conn, user_id, sitemap, config['CRAWL_BATCH_MAX_URLS'],
+                                   cache_ttl=config['CRAWL_CACHE_TTL'])
+        return Redirect('crawl_batch', 'Sitemap queued. Its pages will be listed here once it has been read.',
+                        batch_id=batch_id)
+    if url_list:
+        # Batch mode: every page is queued at once and crawled with per-host limits
+        urls = parse_url_list(url_list)[:config['CRAWL_BATCH_MAX_URLS']]
+        if not urls:
+            return Redirect('crawl_website', 'Could not start batch crawl: no http(s) URLs found')
+        batch_id = enqueue_batch(conn, user_id, urls, f'{len(urls)} URLs', cache_ttl=config['CRAWL_CACHE_TTL'])
+        return Redirect('crawl_batch', f'Queued {len(urls)} pages for crawling.', batch_id=batch_id)
+
+    url = form.get('url', '').strip()
+    if not url:
+        return Redirect('crawl_website', 'Enter a URL, a list of URLs or a sitemap.')
+    # The crawl itself runs in crawl_worker.py; the request only queues it
+    enqueue_crawl(conn, user_id, url, cache_ttl=config['CRAWL_CACHE_TTL'])
+    return Redirect('crawl_history', 'Crawl queued. Its status will update here when it finishes.')
+
+
+def crawl_batch(conn, user_id, batch_id, accept, htmx):
+    batch = batch_progress(conn, batch_id, user_id)
+    if batch is None:
+        return Reply('Batch not found', 404)
+    if accept == 'application/json':
+        return Json(batch)
+    # Polled by the progress bar until every page has finished
+    template = 'partials/crawl_batch_progress.html' if htmx else 'crawl_batch.html'
+    return Page(template, batch=batch)
+
+
+def crawl_history(conn, user_id):
+    try:
+        change_id = latest_change_id(conn, user_id)
+        crawls = queries.iter_crawls(conn, user_id)
+    except Exception as e:
+        return Redirect('dashboard', f'Error loading crawl history: {str(e)}')
+    return Page('crawl_history.html', stream=True, crawls=crawls, live=True, change_id=change_id)
+
+
+def crawl_status(conn, user_id, crawl_id):
+    # Polled by pending rows on the history page until the job finishes
+    job = get_job(conn, crawl_id, user_id)
+    if job is None:
+        return Reply('Crawl not found', 404)
+    return Page('partials/crawl_status.html', crawl=job)
+
+
+def crawl_details(conn, user_id, crawl_id):
+    crawl = queries.get_crawl(conn, crawl_id, user_id)
+    if crawl is None:
+        return Redirect('crawl_history', 'Crawl not found')
+    # The only place the compressed payload is read back
+    return Page('crawl_details.html', crawl=crawl, crawl_data=load_crawl_data(conn, crawl_id))